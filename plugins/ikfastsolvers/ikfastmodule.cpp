@@ -141,6 +141,9 @@ public:
             LOAD_IKFUNCTION(GetIkFastVersion);
             LOAD_IKFUNCTION(GetIkType);
             LOAD_IKFUNCTION(GetKinematicsHash);
+            // batch functions are only present in newer generated libraries
+            ikfunctions->_ComputeIkBatch = (typename ikfast::IkFastFunctions<T>::ComputeIkBatchFn)SysLoadSym(plib, "ComputeIkBatch");
+            ikfunctions->_ComputeFkBatch = (typename ikfast::IkFastFunctions<T>::ComputeFkBatchFn)SysLoadSym(plib, "ComputeFkBatch");
             return true;
         }
 
@@ -257,7 +260,8 @@ public:
 #endif
         RegisterCommand("PerfTiming",boost::bind(&IkFastModule::PerfTiming,this,_1,_2),
                         "Times the ik call of a given library.\n"
-                        "Usage::\n\n  PerfTiming [options] iklibrarypath\n\n"
+                        "Usage::\n\n  PerfTiming [num N] [maxtime T] [batch B] iklibrarypath\n\n"
+                        "If batch is greater than 0, the library has to export ComputeIkBatch and every measurement is the average time of one pose solved in a batch of B poses.\n"
                         "return the set of time measurements made in nano-seconds");
         RegisterCommand("IKTest",boost::bind(&IkFastModule::IKtest,this,_1,_2),
                         "Tests for an IK solution if active manipulation has an IK solver attached");
@@ -515,7 +519,7 @@ public:
     {
         EnvironmentMutex::scoped_lock lock(GetEnv()->GetMutex());
         string cmd, libraryname;
-        int num=1000;
+        int num=1000, batch=0;
         dReal maxtime = 1200;
         while(!sinput.eof()) {
             istream::streampos pos = sinput.tellg();
@@ -531,6 +535,9 @@ public:
             else if( cmd == "maxtime" ) {
                 sinput >> maxtime;
             }
+            else if( cmd == "batch" ) {
+                sinput >> batch;
+            }
             else {
                 sinput.clear();     // have to clear eof bit
                 sinput.seekg(pos);
@@ -549,7 +556,15 @@ public:
             return false;
         }
 
-        if( !!lib->_ikfloat ) {
+        if( batch > 0 ) {
+            if( !!lib->_ikfloat ) {
+                return _PerfTimingBatch<float>(sout,lib->_ikfloat,num, maxtime, batch);
+            }
+            else if( !!lib->_ikdouble ) {
+                return _PerfTimingBatch<double>(sout,lib->_ikdouble,num, maxtime, batch);
+            }
+        }
+        else if( !!lib->_ikfloat ) {
             return _PerfTiming<float>(sout,lib->_ikfloat,num, maxtime);
         }
         else if( !!lib->_ikdouble ) {
@@ -599,6 +614,44 @@ public:
         return true;
     }
 
+    template<typename T> bool _PerfTimingBatch(ostream& sout, boost::shared_ptr<ikfast::IkFastFunctions<T> > ikfunctions, int num, dReal maxtime, int batch)
+    {
+        OPENRAVE_ASSERT_OP(ikfunctions->_GetIkRealSize(),==,sizeof(T));
+        if( !ikfunctions->_ComputeIkBatch || !ikfunctions->_ComputeFkBatch ) {
+            RAVELOG_WARN("library does not export ComputeIkBatch and ComputeFkBatch, regenerate it with a newer ikfast\n");
+            return false;
+        }
+
+        int numjoints = ikfunctions->_GetNumJoints(), numfree = ikfunctions->_GetNumFreeParameters();
+        int maxsolutions = 32;
+        vector<uint64_t> vtimes(num);
+        // all arrays are structure-of-arrays of batch elements
+        vector<T> vjoints(numjoints*batch), vfree(max(1,numfree*batch)), veetrans(3*batch), veerot(9*batch), vsolutions(maxsolutions*numjoints*batch);
+        vector<int> vnumsolutions(batch);
+        uint32_t runstarttimems = utils::GetMilliTime();
+        uint32_t runmaxtimems = (uint32_t)(1000*maxtime);
+        size_t i = 0;
+        for(i = 0; i < vtimes.size(); ++i) {
+            if( (utils::GetMilliTime() - runstarttimems) > runmaxtimems ) {
+                break;
+            }
+            for(size_t j = 0; j < vjoints.size(); ++j) {
+                vjoints[j] = RaveRandomDouble()*2*PI;
+            }
+            for(int j = 0; j < numfree; ++j) {
+                std::copy(vjoints.begin()+ikfunctions->_GetFreeParameters()[j]*batch, vjoints.begin()+(ikfunctions->_GetFreeParameters()[j]+1)*batch, vfree.begin()+j*batch);
+            }
+            ikfunctions->_ComputeFkBatch(batch,&vjoints[0],&veetrans[0],&veerot[0]);
+            uint64_t starttime = utils::GetNanoPerformanceTime();
+            ikfunctions->_ComputeIkBatch(batch,&veetrans[0],&veerot[0],numfree > 0 ? &vfree[0] : NULL,maxsolutions,&vsolutions[0],&vnumsolutions[0]);
+            vtimes[i] = (utils::GetNanoPerformanceTime()-starttime)/batch;
+        }
+        while(i-- > 0) {
+            sout << vtimes[i] << " ";
+        }
+        return true;
+    }
+
     bool IKtest(ostream& sout, istream& sinput)
     {
         EnvironmentMutex::scoped_lock lock(GetEnv()->GetMutex());
@@ -1755,6 +1755,99 @@ public:
         return bCollision;
     }
 
+    /// \brief checks every row of an Nxdof array of configurations for collisions and returns an N boolean mask. The GIL is released while checking.
+    ///
+    /// If stopatfirst is set, checking ends at the first colliding configuration and the rest of the mask is left as False.
+    /// If returnpairs is set, also returns a list of N (link1,link2) tuples of the first colliding links, or None when the configuration is free.
+    /// Each configuration is set with checklimits, so by default it is clamped to the joint limits like SetDOFValues does.
+    object CheckConfigurationsCollision(object oconfigurations, object oindices=object(), bool selfcollision=true, bool envcollision=true, bool stopatfirst=false, bool returnpairs=false, uint32_t checklimits=KinBody::CLA_CheckLimits)
+    {
+        vector<int> vindices;
+        if( oindices != object() ) {
+            vindices = ExtractArray<int>(oindices);
+            FOREACH(it, vindices) {
+                if(( *it < 0) ||( *it >= _pbody->GetDOF()) ) {
+                    throw openrave_exception(boost::str(boost::format("bad index passed %d")%(*it)));
+                }
+            }
+        }
+        else {
+            for(int i = 0; i < _pbody->GetDOF(); ++i) {
+                vindices.push_back(i);
+            }
+        }
+        PyObject* pyconfigurations = PyArray_ContiguousFromAny(oconfigurations.ptr(), sizeof(dReal)==8 ? PyArray_DOUBLE : PyArray_FLOAT, 2, 2);
+        if( !pyconfigurations ) {
+            throw_error_already_set();
+        }
+        handle<> hconfigurations(pyconfigurations);
+        int N = (int)PyArray_DIM((PyArrayObject*)pyconfigurations,0);
+        int dof = (int)PyArray_DIM((PyArrayObject*)pyconfigurations,1);
+        if( dof != (int)vindices.size() ) {
+            throw openrave_exception(boost::str(boost::format("configurations have %d columns, expected %d")%dof%vindices.size()));
+        }
+        const dReal* pconfigurations = (const dReal*)PyArray_DATA(pyconfigurations);
+        npy_intp dims[] = { N};
+        PyObject *pymask = PyArray_SimpleNew(1,dims, PyArray_BOOL);
+        if( !pymask ) {
+            throw_error_already_set();
+        }
+        handle<> hmask(pymask);
+        npy_bool* pmask = (npy_bool*)PyArray_DATA(pymask);
+        std::fill(pmask,pmask+N,NPY_FALSE);
+        vector< std::pair<KinBody::LinkConstPtr, KinBody::LinkConstPtr> > vpairs(returnpairs ? N : 0);
+        {
+            openravepy::PythonThreadSaver threadsaver;
+            // lock after releasing the GIL, the saver has to restore the state while still locked
+            EnvironmentMutex::scoped_lock lock(_pbody->GetEnv()->GetMutex());
+            KinBody::KinBodyStateSaver saver(_pbody);
+            CollisionReportPtr report;
+            if( returnpairs ) {
+                report.reset(new CollisionReport());
+            }
+            EnvironmentBasePtr penv = _pbody->GetEnv();
+            vector<dReal> values;
+            _pbody->GetDOFValues(values);
+            for(int i = 0; i < N; ++i) {
+                const dReal* pvalues = pconfigurations+(size_t)i*dof;
+                for(int j = 0; j < dof; ++j) {
+                    values[vindices[j]] = pvalues[j];
+                }
+                _pbody->SetDOFValues(values,checklimits);
+                bool bCollision = (envcollision && penv->CheckCollision(KinBodyConstPtr(_pbody),report)) || (selfcollision && _pbody->CheckSelfCollision(report));
+                if( bCollision ) {
+                    pmask[i] = NPY_TRUE;
+                    if( returnpairs ) {
+                        vpairs[i] = std::make_pair(report->plink1,report->plink2);
+                    }
+                    if( stopatfirst ) {
+                        break;
+                    }
+                }
+            }
+        }
+        if( !returnpairs ) {
+            return static_cast<numeric::array>(hmask);
+        }
+        boost::python::list pairs;
+        for(int i = 0; i < N; ++i) {
+            if( pmask[i] ) {
+                object olink1, olink2;
+                if( !!vpairs[i].first ) {
+                    olink1 = openravepy::toPyKinBodyLink(boost::const_pointer_cast<KinBody::Link>(vpairs[i].first), GetEnv());
+                }
+                if( !!vpairs[i].second ) {
+                    olink2 = openravepy::toPyKinBodyLink(boost::const_pointer_cast<KinBody::Link>(vpairs[i].second), GetEnv());
+                }
+                pairs.append(boost::python::make_tuple(olink1,olink2));
+            }
+            else {
+                pairs.append(object());
+            }
+        }
+        return boost::python::make_tuple(static_cast<numeric::array>(hmask),pairs);
+    }
+
     bool IsAttached(PyKinBodyPtr pattachbody) {
         CHECK_POINTER(pattachbody);
         return _pbody->IsAttached(pattachbody->GetBody());
@@ -2117,6 +2210,67 @@ public:
             return _pmanip->FindIKSolutions(ikparam,vFreeParameters,filteroptions,vikreturns);
         }
 
+        /// \brief solves the ik of every row of an Nx7 array of quaternion+translation Transform6D poses with the GIL released.
+        ///
+        /// Returns (numsolutions,solutions). If firstonly, every pose uses FindIKSolution and numsolutions is 0 or 1, otherwise FindIKSolutions.
+        /// If returnsolutions, solutions is an Nxarmdof array of the first solutions (nan if none) when firstonly, otherwise the (sum(numsolutions))xarmdof array of all solutions in order. Otherwise it is None.
+        object FindIKSolutionsBatch(object oposes, int filteroptions, bool firstonly=true, bool returnsolutions=false) const
+        {
+            PyObject* pyposes = PyArray_ContiguousFromAny(oposes.ptr(), sizeof(dReal)==8 ? PyArray_DOUBLE : PyArray_FLOAT, 2, 2);
+            if( !pyposes ) {
+                throw_error_already_set();
+            }
+            handle<> hposes(pyposes);
+            if( PyArray_DIM((PyArrayObject*)pyposes,1) != 7 ) {
+                throw openrave_exception("poses need to be a Nx7 array of quaternion+translation");
+            }
+            int N = (int)PyArray_DIM((PyArrayObject*)pyposes,0);
+            const dReal* pposes = (const dReal*)PyArray_DATA(pyposes);
+            int armdof = (int)_pmanip->GetArmIndices().size();
+            npy_intp numdims[] = { N};
+            PyObject *pynumsolutions = PyArray_SimpleNew(1,numdims, PyArray_INT);
+            if( !pynumsolutions ) {
+                throw_error_already_set();
+            }
+            handle<> hnumsolutions(pynumsolutions);
+            int* pnumsolutions = (int*)PyArray_DATA(pynumsolutions);
+            std::vector<dReal> vsolutions;
+            {
+                openravepy::PythonThreadSaver threadsaver;
+                EnvironmentMutex::scoped_lock lock(_pmanip->GetRobot()->GetEnv()->GetMutex());
+                std::vector<dReal> solution;
+                std::vector<std::vector<dReal> > allsolutions;
+                if( firstonly && returnsolutions ) {
+                    vsolutions.resize((size_t)N*armdof, std::numeric_limits<dReal>::quiet_NaN());
+                }
+                for(int i = 0; i < N; ++i) {
+                    const dReal* ppose = pposes+(size_t)i*7;
+                    IkParameterization ikparam(Transform(Vector(ppose[0],ppose[1],ppose[2],ppose[3]),Vector(ppose[4],ppose[5],ppose[6])));
+                    if( firstonly ) {
+                        pnumsolutions[i] = _pmanip->FindIKSolution(ikparam,solution,filteroptions) ? 1 : 0;
+                        if( returnsolutions && pnumsolutions[i] > 0 ) {
+                            std::copy(solution.begin(),solution.end(),vsolutions.begin()+(size_t)i*armdof);
+                        }
+                    }
+                    else {
+                        allsolutions.resize(0);
+                        _pmanip->FindIKSolutions(ikparam,allsolutions,filteroptions);
+                        pnumsolutions[i] = (int)allsolutions.size();
+                        if( returnsolutions ) {
+                            FOREACH(itsol,allsolutions) {
+                                vsolutions.insert(vsolutions.end(),itsol->begin(),itsol->end());
+                            }
+                        }
+                    }
+                }
+            }
+            if( !returnsolutions ) {
+                return boost::python::make_tuple(static_cast<numeric::array>(hnumsolutions),object());
+            }
+            std::vector<npy_intp> dims(2); dims[0] = (npy_intp)(vsolutions.size()/std::max(armdof,1)); dims[1] = armdof;
+            return boost::python::make_tuple(static_cast<numeric::array>(hnumsolutions),toPyArray(vsolutions,dims));
+        }
+
         object FindIKSolution(object oparam, int filteroptions, bool ikreturn=false, bool releasegil=false) const
         {
             IkParameterization ikparam;
@@ -3270,12 +3424,14 @@ BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(FindIKSolution_overloads, FindIKSolution,
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(FindIKSolutionFree_overloads, FindIKSolution, 3, 5)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(FindIKSolutions_overloads, FindIKSolutions, 2, 4)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(FindIKSolutionsFree_overloads, FindIKSolutions, 3, 5)
+BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(FindIKSolutionsBatch_overloads, FindIKSolutionsBatch, 2, 4)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(GetArmConfigurationSpecification_overloads, GetArmConfigurationSpecification, 0, 1)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(ComputeJacobianTranslation_overloads, ComputeJacobianTranslation, 2, 3)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(ComputeJacobianAxisAngle_overloads, ComputeJacobianAxisAngle, 1, 2)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(ComputeHessianTranslation_overloads, ComputeHessianTranslation, 2, 3)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(ComputeHessianAxisAngle_overloads, ComputeHessianAxisAngle, 1, 2)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(ComputeInverseDynamics_overloads, ComputeInverseDynamics, 1, 3)
+BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(CheckConfigurationsCollision_overloads, CheckConfigurationsCollision, 1, 7)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(Restore_overloads, Restore, 0,1)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(CreateKinBodyStateSaver_overloads, CreateKinBodyStateSaver, 0,1)
 BOOST_PYTHON_MEMBER_FUNCTION_OVERLOADS(CreateRobotStateSaver_overloads, CreateRobotStateSaver, 0,1)
@@ -3434,6 +3590,7 @@ void init_openravepy_kinbody()
                         .def("ComputeInverseDynamics",&PyKinBody::ComputeInverseDynamics, ComputeInverseDynamics_overloads(args("dofaccelerations","externalforcetorque","returncomponents"), sComputeInverseDynamicsDoc.c_str()))
                         .def("CheckSelfCollision",pkinbodyself, DOXY_FN(KinBody,CheckSelfCollision))
                         .def("CheckSelfCollision",pkinbodyselfr,args("report"), DOXY_FN(KinBody,CheckSelfCollision))
+                        .def("CheckConfigurationsCollision",&PyKinBody::CheckConfigurationsCollision, CheckConfigurationsCollision_overloads(args("configurations","indices","selfcollision","envcollision","stopatfirst","returnpairs","checklimits"), "Checks every row of an Nxdof array of configurations for environment and self collisions with the GIL released and returns an N boolean collision mask.\n\n:param indices: the dof indices the columns of configurations map to, defaults to all dofs.\n\n:param stopatfirst: If True, stops at the first colliding configuration and leaves the remaining mask entries False.\n\n:param returnpairs: If True, returns (mask, pairs) where pairs holds the (link1,link2) of the first collision of each configuration or None.\n\n:param checklimits: how every configuration is set, see KinBody.CheckLimitsAction. Defaults to clamping to the joint limits.\n\n"))
                         .def("IsAttached",&PyKinBody::IsAttached,args("body"), DOXY_FN(KinBody,IsAttached))
                         .def("GetAttached",&PyKinBody::GetAttached, DOXY_FN(KinBody,GetAttached))
                         .def("SetZeroConfiguration",&PyKinBody::SetZeroConfiguration, DOXY_FN(KinBody,SetZeroConfiguration))
@@ -3879,6 +4036,7 @@ void init_openravepy_kinbody()
         .def("FindIKSolution",pmanipikf,FindIKSolutionFree_overloads(args("param","freevalues","filteroptions","ikreturn","releasegil"), DOXY_FN(RobotBase::Manipulator,FindIKSolution "const IkParameterization; const std::vector; std::vector; int")))
         .def("FindIKSolutions",pmanipiks,FindIKSolutions_overloads(args("param","filteroptions","ikreturn","releasegil"), DOXY_FN(RobotBase::Manipulator,FindIKSolutions "const IkParameterization; std::vector; int")))
         .def("FindIKSolutions",pmanipiksf,FindIKSolutionsFree_overloads(args("param","freevalues","filteroptions","ikreturn","releasegil"), DOXY_FN(RobotBase::Manipulator,FindIKSolutions "const IkParameterization; const std::vector; std::vector; int")))
+        .def("FindIKSolutionsBatch",&PyRobotBase::PyManipulator::FindIKSolutionsBatch,FindIKSolutionsBatch_overloads(args("poses","filteroptions","firstonly","returnsolutions"), "Solves the Transform6D ik of every row of a Nx7 array of quaternion+translation poses in one call with the GIL released and returns (numsolutions,solutions).\n\n:param firstonly: If True, every pose is solved with FindIKSolution and numsolutions is 0 or 1, otherwise with FindIKSolutions.\n\n:param returnsolutions: If True, solutions is a Nxarmdof array of the first solutions (nan if none) when firstonly is set, otherwise the sum(numsolutions)xarmdof array of all the solutions in order. If False, solutions is None and no solution is copied.\n\n"))
         .def("GetIkParameterization",&PyRobotBase::PyManipulator::GetIkParameterization, GetIkParameterization_overloads(args("iktype","inworld"), GetIkParameterization_doc.c_str()))
         .def("GetBase",&PyRobotBase::PyManipulator::GetBase, DOXY_FN(RobotBase::Manipulator,GetBase))
         .def("GetEndEffector",&PyRobotBase::PyManipulator::GetEndEffector, DOXY_FN(RobotBase::Manipulator,GetEndEffector))
@@ -76,6 +76,46 @@ public:
         return toPyArray(values);
     }
 
+    object SampleRange(object otimes) const
+    {
+        return _SampleRange(otimes,_ptrajectory->GetConfigurationSpecification());
+    }
+
+    object SampleRange(object otimes, PyConfigurationSpecificationPtr pyspec) const
+    {
+        return _SampleRange(otimes,openravepy::GetConfigurationSpecification(pyspec));
+    }
+
+    /// \brief samples the trajectory at every time of otimes and returns a Nxdof array. The GIL is released while interpolating.
+    object _SampleRange(object otimes, const ConfigurationSpecification& spec) const
+    {
+        PyObject* pytimes = PyArray_ContiguousFromAny(otimes.ptr(), sizeof(dReal)==8 ? PyArray_DOUBLE : PyArray_FLOAT, 1, 1);
+        if( !pytimes ) {
+            throw_error_already_set();
+        }
+        handle<> htimes(pytimes);
+        const dReal* ptimes = (const dReal*)PyArray_DATA(pytimes);
+        int N = (int)PyArray_DIM((PyArrayObject*)pytimes,0);
+        int dof = spec.GetDOF();
+        npy_intp dims[] = { N,dof};
+        PyObject *pyvalues = PyArray_SimpleNew(2,dims, sizeof(dReal)==8 ? PyArray_DOUBLE : PyArray_FLOAT);
+        if( !pyvalues ) {
+            throw_error_already_set();
+        }
+        handle<> hvalues(pyvalues);
+        dReal* pvalues = (dReal*)PyArray_DATA(pyvalues);
+        {
+            openravepy::PythonThreadSaver saver;
+            vector<dReal> values;
+            for(int i = 0; i < N; ++i) {
+                _ptrajectory->Sample(values,ptimes[i],spec);
+                BOOST_ASSERT((int)values.size()==dof);
+                std::copy(values.begin(),values.end(),pvalues+(size_t)i*dof);
+            }
+        }
+        return static_cast<numeric::array>(hvalues);
+    }
+
     object GetConfigurationSpecification() const {
         return object(openravepy::toPyConfigurationSpecification(_ptrajectory->GetConfigurationSpecification()));
     }
@@ -191,6 +231,8 @@ void init_openravepy_trajectory()
     void (PyTrajectoryBase::*Insert4)(size_t,object,PyConfigurationSpecificationPtr,bool) = &PyTrajectoryBase::Insert;
     object (PyTrajectoryBase::*Sample1)(dReal) const = &PyTrajectoryBase::Sample;
     object (PyTrajectoryBase::*Sample2)(dReal, PyConfigurationSpecificationPtr) const = &PyTrajectoryBase::Sample;
+    object (PyTrajectoryBase::*SampleRange1)(object) const = &PyTrajectoryBase::SampleRange;
+    object (PyTrajectoryBase::*SampleRange2)(object, PyConfigurationSpecificationPtr) const = &PyTrajectoryBase::SampleRange;
     object (PyTrajectoryBase::*GetWaypoints1)(size_t,size_t) const = &PyTrajectoryBase::GetWaypoints;
     object (PyTrajectoryBase::*GetWaypoints2)(size_t,size_t,PyConfigurationSpecificationPtr) const = &PyTrajectoryBase::GetWaypoints;
     object (PyTrajectoryBase::*GetWaypoint1)(int) const = &PyTrajectoryBase::GetWaypoint;
@@ -204,6 +246,8 @@ void init_openravepy_trajectory()
     .def("Remove",&PyTrajectoryBase::Remove,args("startindex","endindex"),DOXY_FN(TrajectoryBase,Remove))
     .def("Sample",Sample1,args("time"),DOXY_FN(TrajectoryBase,Sample "std::vector; dReal"))
     .def("Sample",Sample2,args("time","spec"),DOXY_FN(TrajectoryBase,Sample "std::vector; dReal; const ConfigurationSpecification"))
+    .def("SampleRange",SampleRange1,args("times"),"Samples the trajectory at every time of the array and returns a Nxdof array, where dof is the dimension of the configuration specification of the trajectory. The GIL is released while sampling.")
+    .def("SampleRange",SampleRange2,args("times","spec"),"Samples the trajectory at every time of the array and returns the data of the spec groups as a Nxdof array. The GIL is released while sampling.")
     .def("GetConfigurationSpecification",&PyTrajectoryBase::GetConfigurationSpecification,DOXY_FN(TrajectoryBase,GetConfigurationSpecification))
     .def("GetNumWaypoints",&PyTrajectoryBase::GetNumWaypoints,DOXY_FN(TrajectoryBase,GetNumWaypoints))
     .def("GetWaypoints",GetWaypoints1,args("startindex","endindex"),DOXY_FN(TrajectoryBase, GetWaypoints "size_t; size_t; std::vector"))
@@ -128,15 +128,35 @@ object search(ANNkd_tree& kdtree, object q, int k, double eps, bool priority = f
     return boost::python::make_tuple(static_cast<numeric::array>(handle<>(pyidx)), static_cast<numeric::array>(handle<>(pydists)));
 }
 
+/// \brief converts a sequence of points into a contiguous Nxdim numpy array of ANNcoord values
+///
+/// If qarray is already a contiguous array of the correct type, no copy is made.
+handle<> _GetContiguousPoints(object qarray, int dim)
+{
+    PyObject* pyarray = PyArray_ContiguousFromAny(qarray.ptr(), sizeof(ANNcoord)==8 ? PyArray_DOUBLE : PyArray_FLOAT, 2, 2);
+    if( !pyarray ) {
+        throw_error_already_set();
+    }
+    handle<> harray(pyarray);
+    // checked in release builds too, a wrong column count would read past the end of the rows
+    if( PyArray_DIM((PyArrayObject*)pyarray,1) != dim ) {
+        throw pyann_exception(str(boost::format("query points have %d columns, the kdtree has dimension %d")%PyArray_DIM((PyArrayObject*)pyarray,1)%dim));
+    }
+    return harray;
+}
+
 object search_array(ANNkd_tree& kdtree, object qarray, int k, double eps, bool priority = false)
 {
-    BOOST_ASSERT(k <= kdtree.nPoints());
+    if( k > kdtree.nPoints() ) {
+        throw pyann_exception(str(boost::format("k=%d is larger than the %d points of the kdtree")%k%kdtree.nPoints()));
+    }
     int N = len(qarray);
     if( N == 0 )
         return boost::python::make_tuple(numeric::array(boost::python::list()).astype("i4"),numeric::array(boost::python::list()));
 
-    BOOST_ASSERT(len(qarray[0])==kdtree.theDim());
-    ANNpointManaged annq(kdtree.theDim());
+    int dim = kdtree.theDim();
+    handle<> hqarray = _GetContiguousPoints(qarray,dim);
+    ANNcoord* pq = (ANNcoord*)PyArray_DATA(hqarray.get());
     npy_intp dims[] = { N,k};
     PyObject *pydists = PyArray_SimpleNew(2,dims, sizeof(ANNdist)==8 ? PyArray_DOUBLE : PyArray_FLOAT);
     BOOST_ASSERT(!!pydists);
@@ -148,19 +168,15 @@ object search_array(ANNkd_tree& kdtree, object qarray, int k, double eps, bool p
     ANNdist* pdists = (ANNdist*)PyArray_DATA(pydists);
     ANNidx* pidx = (ANNidx*)PyArray_DATA(pyidx);
 
-    std::vector<ANNdist> dists(k);
-    std::vector<ANNidx> nn_idx(k);
+    // query directly from the contiguous point data and write into the output arrays
     for(int i = 0; i < N; ++i) {
-        object q = qarray[i];
-        for (int c = 0; c < kdtree.theDim(); ++c)
-            annq.pt[c] = extract<ANNcoord>(q[c]);
         if (priority)
-            kdtree.annkPriSearch(annq.pt, k, &nn_idx[0], &dists[0], eps);
+            kdtree.annkPriSearch(pq, k, pidx, pdists, eps);
         else
-            kdtree.annkSearch(annq.pt, k, &nn_idx[0], &dists[0], eps);
-
-        std::copy(nn_idx.begin(),nn_idx.end(),pidx); pidx += k;
-        std::copy(dists.begin(),dists.end(),pdists); pdists += k;
+            kdtree.annkSearch(pq, k, pidx, pdists, eps);
+        pq += dim;
+        pidx += k;
+        pdists += k;
     }
 
     return boost::python::make_tuple(static_cast<numeric::array>(handle<>(pyidx)), static_cast<numeric::array>(handle<>(pydists)));
@@ -208,24 +224,24 @@ object k_fixed_radius_search(ANNkd_tree& kdtree, object q, double sqRad, int k,
 
 object k_fixed_radius_search_array(ANNkd_tree& kdtree, object qarray, double sqRad, int k, double eps)
 {
-    BOOST_ASSERT(k <= kdtree.nPoints());
+    if( k > kdtree.nPoints() ) {
+        throw pyann_exception(str(boost::format("k=%d is larger than the %d points of the kdtree")%k%kdtree.nPoints()));
+    }
     int N = len(qarray);
     if( N == 0 )
         return boost::python::make_tuple(numeric::array(boost::python::list()).astype("i4"),numeric::array(boost::python::list()),numeric::array(boost::python::list()));
 
-    BOOST_ASSERT(len(qarray[0])==kdtree.theDim());
-    ANNpointManaged annq(kdtree.theDim());
+    int dim = kdtree.theDim();
+    handle<> hqarray = _GetContiguousPoints(qarray,dim);
+    ANNcoord* pq = (ANNcoord*)PyArray_DATA(hqarray.get());
     npy_intp dimsball[] = { N};
     PyObject *pykball = PyArray_SimpleNew(1,dimsball, PyArray_INT);
     BOOST_ASSERT(!!pykball);
     int* pkball = (int*)PyArray_DATA(pykball);
 
     if( k <= 0 ) {
-        for(int i = 0; i < N; ++i) {
-            object q = qarray[i];
-            for (int c = 0; c < kdtree.theDim(); ++c)
-                annq.pt[c] = extract<ANNcoord>(q[c]);
-            pkball[i] = kdtree.annkFRSearch(annq.pt, sqRad, k, NULL, NULL, eps);
+        for(int i = 0; i < N; ++i, pq += dim) {
+            pkball[i] = kdtree.annkFRSearch(pq, sqRad, k, NULL, NULL, eps);
         }
         return boost::python::make_tuple(numeric::array(boost::python::list()).astype("i4"),numeric::array(boost::python::list()),static_cast<numeric::array>(handle<>(pykball)));
     }
@@ -244,16 +260,11 @@ object k_fixed_radius_search_array(ANNkd_tree& kdtree, object qarray, double sqR
     ANNdist* pdists = (ANNdist*)PyArray_DATA(pydists);
     ANNidx* pidx = (ANNidx*)PyArray_DATA(pyidx);
 
-    std::vector<ANNdist> dists(k);
-    std::vector<ANNidx> nn_idx(k);
     for(int i = 0; i < N; ++i) {
-        object q = qarray[i];
-        for (int c = 0; c < kdtree.theDim(); ++c)
-            annq.pt[c] = extract<ANNcoord>(q[c]);
-        pkball[i] = kdtree.annkFRSearch(annq.pt, sqRad, k, &nn_idx[0], &dists[0], eps);
-
-        std::copy(nn_idx.begin(),nn_idx.end(),pidx); pidx += k;
-        std::copy(dists.begin(),dists.end(),pdists); pdists += k;
+        pkball[i] = kdtree.annkFRSearch(pq, sqRad, k, pidx, pdists, eps);
+        pq += dim;
+        pidx += k;
+        pdists += k;
     }
 
     return boost::python::make_tuple(static_cast<numeric::array>(handle<>(pyidx)), static_cast<numeric::array>(handle<>(pydists)),static_cast<numeric::array>(handle<>(pykball)));
@@ -32,7 +32,8 @@ from .. import openravepy_int
 from .. import metaclass
 from ..misc import OpenRAVEGlobalArguments
 import os.path
-from os import getenv, makedirs
+from os import getenv, makedirs, remove
+from itertools import islice
 import time
 
 import logging
@@ -54,6 +55,9 @@ class DatabaseGenerator(metaclass.AutoReloader):
         self.robot = robot
         self.env = self.robot.GetEnv()
         self._databasefile = None # necessary if file handle needs to be open
+        self.numthreads = None # if > 1, generate will distribute the consumer work across that many processes
+        self.checkpointinterval = None # if not None, seconds between checkpoints of the generation state
+        self.ikcache = None # if not None, an inversekinematics.IkResultCache used for the ik queries of the generator
         try:
             self.manip = self.robot.GetActiveManipulator()
         except:
@@ -79,6 +83,10 @@ class DatabaseGenerator(metaclass.AutoReloader):
         clone.robot = clone.env.GetRobot(self.robot.GetName())
         clone.manip = clone.robot.GetManipulators(self.manip.GetName())[0] if not self.manip is None else None
         return clone
+    def _FindIKSolution(self,ikparam,filteroptions):
+        if self.ikcache is not None:
+            return self.ikcache.FindIKSolution(self.manip,ikparam,filteroptions)
+        return self.manip.FindIKSolution(ikparam,filteroptions)
     def has(self):
         raise NotImplementedError()
     def getfilename(self,read=False):
@@ -124,6 +132,10 @@ class DatabaseGenerator(metaclass.AutoReloader):
         raise NotImplementedError()
 
     def autogenerate(self,options=None):
+        if options is not None and getattr(options,'numthreads',None) is not None:
+            self.numthreads = options.numthreads
+        if options is not None and getattr(options,'checkpointinterval',None) is not None:
+            self.checkpointinterval = options.checkpointinterval
         self.generate(*self.autogenerateparams(options))
         self.save()
 
@@ -131,16 +143,118 @@ class DatabaseGenerator(metaclass.AutoReloader):
         """Generate producer, consumer, and gatherer functions allowing parallelization
         """
         return NotImplementedError()
+    def generateconsumer(self,*args,**kwargs):
+        """Returns only the consumer function of :meth:`generatepcg` for the same arguments. Used by the worker processes of parallel generation, so should avoid the work of setting up the producer and gatherer. By default calls :meth:`generatepcg`.
+        """
+        return self.generatepcg(*args,**kwargs)[1]
     def generate(self,*args,**kwargs):
         starttime = time.time()
+        if self.numthreads is not None and self.numthreads > 1:
+            self._generateParallel(self.numthreads,*args,**kwargs)
+        else:
+            producer,consumer,gatherer,numjobs = self.generatepcg(*args,**kwargs)
+            log.info('database %s has %d items',self.__class__.__name__.split()[-1],numjobs)
+            checkpointkey = self._GetCheckpointKey(args,kwargs)
+            works,numprocessed = self._resumeFromCheckpoint(producer(),checkpointkey)
+            self._gatherResults((consumer(*work) for work in works),gatherer,checkpointkey,numprocessed)
+        log.info('database %s finished in %fs',self.__class__.__name__,time.time()-starttime)
+
+    def _generateParallel(self,numprocesses,*args,**kwargs):
+        """Runs the producer/consumer/gatherer functions of :meth:`generatepcg` with the consumer distributed across worker processes.
+
+        The workers are fresh python processes rather than forks, since forking a process with running environment threads can leave their mutexes locked in the child. Each worker loads a copy of the environment saved by this process, constructs the model with Model(robot=robot) and gets its consumer through :meth:`generateconsumer`. The work items of the producer are sent in chunks and the results are streamed back into the gatherer of this process in the order they were produced. The environment should not be locked when calling this function. Work items, consumer results and generation arguments have to be picklable.
+        """
         producer,consumer,gatherer,numjobs = self.generatepcg(*args,**kwargs)
-        log.info('database %s has %d items',self.__class__.__name__.split()[-1],numjobs)
-        for work in producer():
-            results = consumer(*work)
+        chunksize = max(1,min(1000,numjobs/(4*numprocesses)))
+        log.info('database %s has %d items, distributing across %d processes with chunk size %d',self.__class__.__name__.split()[-1],numjobs,numprocesses,chunksize)
+        checkpointkey = self._GetCheckpointKey(args,kwargs)
+        works,numprocessed = self._resumeFromCheckpoint(producer(),checkpointkey)
+        pool = _ParallelWorkerPool(self,numprocesses,args,kwargs)
+        try:
+            allresults = pool.imap(_ChunkWork(works,chunksize))
+            self._gatherResults((results for chunkresults in allresults for results in chunkresults),gatherer,checkpointkey,numprocessed)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+
+    def _gatherResults(self,allresults,gatherer,checkpointkey=None,numprocessed=0):
+        """Passes the consumer results of every work item to the gatherer, in order, and periodically writes a checkpoint of the gatherer state if :attr:`checkpointinterval` is set. Removes the checkpoint once everything is gathered.
+
+        :param checkpointkey: if None, no checkpoints are written
+        :param numprocessed: the number of work items already gathered (ie restored from a checkpoint)
+        """
+        lastcheckpointtime = time.time()
+        for results in allresults:
             if len(results) > 0:
                 gatherer(*results)
+            numprocessed += 1
+            if checkpointkey is not None and self.checkpointinterval is not None and time.time()-lastcheckpointtime > self.checkpointinterval:
+                self._saveCheckpoint(checkpointkey,numprocessed)
+                lastcheckpointtime = time.time()
         gatherer() # gather results
-        log.info('database %s finished in %fs',self.__class__.__name__,time.time()-starttime)
+        self._removeCheckpoint()
+
+    def getcheckpointstate(self):
+        """Returns a picklable object describing the gatherer state of :meth:`generatepcg`. If None is returned, checkpointing is not supported."""
+        return None
+    def setcheckpointstate(self,state):
+        """Restores the gatherer state returned by :meth:`getcheckpointstate`. Called right after :meth:`generatepcg`."""
+        raise NotImplementedError()
+    def getcheckpointfilename(self):
+        return self.getfilename(False)+'.checkpoint'
+
+    @staticmethod
+    def _GetCheckpointKey(args,kwargs):
+        """hash of the generation parameters, a checkpoint is only resumed if they match"""
+        from hashlib import md5
+        try:
+            return md5(pickle.dumps((args,sorted(kwargs.items())),pickle.HIGHEST_PROTOCOL)).hexdigest()
+        except (pickle.PicklingError,TypeError):
+            return md5(repr((args,sorted(kwargs.items())))).hexdigest()
+
+    def _saveCheckpoint(self,checkpointkey,numprocessed):
+        state = self.getcheckpointstate()
+        if state is None:
+            return
+        filename = self.getcheckpointfilename()
+        log.info('saving checkpoint of %d processed items to %s',numprocessed,filename)
+        try:
+            makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        # write to a temporary file first so that a killed process never leaves a partial checkpoint
+        tempfilename = filename+'.tmp'
+        pickle.dump((self.getversion(),checkpointkey,numprocessed,state), open(tempfilename,'wb'), pickle.HIGHEST_PROTOCOL)
+        os.rename(tempfilename,filename)
+
+    def _resumeFromCheckpoint(self,works,checkpointkey):
+        """If a matching checkpoint exists, restores the gatherer state and skips the work items that were already processed.
+
+        :return: (works,numprocessed)
+        """
+        filename = self.getcheckpointfilename()
+        if not os.path.isfile(filename):
+            return works,0
+        try:
+            modelversion,key,numprocessed,state = pickle.load(open(filename,'rb'))
+        except Exception,e:
+            log.warn('failed to read checkpoint %s: %s',filename,e)
+            return works,0
+        if modelversion != self.getversion() or key != checkpointkey:
+            log.info('ignoring checkpoint %s since it was generated with different parameters',filename)
+            return works,0
+        self.setcheckpointstate(state)
+        log.info('resuming from checkpoint %s, %d items already processed',filename,numprocessed)
+        return islice(works,numprocessed,None),numprocessed
+
+    def _removeCheckpoint(self):
+        filename = self.getcheckpointfilename()
+        if os.path.isfile(filename):
+            try:
+                remove(filename)
+            except OSError,e:
+                log.warn('failed to remove checkpoint %s: %s',filename,e)
 
     @staticmethod
     def CreateOptionParser(useManipulator=True):
@@ -160,6 +274,8 @@ class DatabaseGenerator(metaclass.AutoReloader):
                            help='OpenRAVE robot to load (default=%default)')
         dbgroup.add_option('--numthreads',action='store',type='int',dest='numthreads',default=1,
                            help='number of threads to compute the database with (default=%default)')
+        dbgroup.add_option('--checkpointinterval',action='store',type='float',dest='checkpointinterval',default=None,
+                           help='If set, will save the generation state every CHECKPOINTINTERVAL seconds so that an interrupted generation can resume from it.')
         if useManipulator:
             dbgroup.add_option('--manipname',action='store',type='string',dest='manipname',default=None,
                                help='The name of the manipulator on the robot to use')
@@ -255,6 +371,157 @@ class DatabaseGenerator(metaclass.AutoReloader):
             if destroyenv and env is not None:
                 env.Destroy()
 
+class _ParallelWorkerPool(object):
+    """Worker processes for DatabaseGenerator._generateParallel and the other parallel database computations, started as new python interpreters that communicate through pickles over their stdin/stdout.
+
+    Every worker has at most one chunk of work items in flight, so a worker never blocks on writing its results while this process blocks on sending it more work.
+    """
+    def __init__(self,model,numprocesses,args,kwargs,consumername='generateconsumer',bodyargs=None):
+        """
+        :param consumername: the method of the model in every worker that is called with args and kwargs and returns the consumer of the work items
+        :param bodyargs: dict of the constructor arguments of the model that are bodies of the environment, they are sent by name
+        """
+        import subprocess, sys, tempfile
+        self.tempdir = tempfile.mkdtemp(prefix='openravedb')
+        envfilename = os.path.join(self.tempdir,'env.dae')
+        with model.env:
+            model.env.Save(envfilename)
+        environ = dict(os.environ)
+        environ['PYTHONPATH'] = os.pathsep.join(sys.path)
+        command = [sys.executable,'-c','from %s import _RunParallelWorker; _RunParallelWorker()'%__name__]
+        initargs = (envfilename,model.__class__.__module__,model.__class__.__name__,model.robot.GetName(),model.manip.GetName() if model.manip is not None else None,bodyargs if bodyargs is not None else dict(),consumername,args,kwargs)
+        self.processes = []
+        try:
+            for i in range(numprocesses):
+                self.processes.append(subprocess.Popen(command,stdin=subprocess.PIPE,stdout=subprocess.PIPE,env=environ))
+                self._send(self.processes[-1],initargs)
+        except:
+            self.terminate()
+            raise
+
+    def _send(self,process,obj):
+        pickle.dump(obj,process.stdin,pickle.HIGHEST_PROTOCOL)
+        process.stdin.flush()
+
+    def _receive(self,process):
+        try:
+            return pickle.load(process.stdout)
+        except EOFError:
+            raise RuntimeError('database worker process %d exited with code %r'%(process.pid,process.wait()))
+
+    def imap(self,chunks):
+        """Sends the chunks to the workers in round-robin order and yields the consumer results of every chunk in the same order."""
+        numsent = 0
+        numreceived = 0
+        try:
+            for chunk in chunks:
+                if numsent-numreceived >= len(self.processes):
+                    results = self._receive(self.processes[numreceived%len(self.processes)])
+                    numreceived += 1
+                    yield results
+                self._send(self.processes[numsent%len(self.processes)],chunk)
+                numsent += 1
+            while numreceived < numsent:
+                results = self._receive(self.processes[numreceived%len(self.processes)])
+                numreceived += 1
+                yield results
+        except GeneratorExit:
+            # stopped early, discard the chunks in flight so the workers can be reused
+            while numreceived < numsent:
+                self._receive(self.processes[numreceived%len(self.processes)])
+                numreceived += 1
+            raise
+
+    def imap_unordered(self,chunks):
+        """Sends every chunk to the next idle worker and yields the consumer results of every chunk as soon as its worker returns them."""
+        import select
+        chunks = iter(chunks)
+        idle = list(self.processes)
+        busy = dict() # stdout file descriptor -> process
+        try:
+            while True:
+                while len(idle) > 0:
+                    try:
+                        chunk = chunks.next()
+                    except StopIteration:
+                        break
+                    process = idle.pop()
+                    self._send(process,chunk)
+                    busy[process.stdout.fileno()] = process
+                if len(busy) == 0:
+                    break
+                for fd in select.select(busy.keys(),[],[])[0]:
+                    process = busy.pop(fd)
+                    idle.append(process)
+                    yield self._receive(process)
+        except GeneratorExit:
+            for process in busy.values():
+                self._receive(process)
+            raise
+
+    def close(self):
+        for process in self.processes:
+            process.stdin.close()
+        for process in self.processes:
+            process.wait()
+        self._removeTempDir()
+
+    def terminate(self):
+        for process in self.processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+            process.wait()
+        self._removeTempDir()
+
+    def _removeTempDir(self):
+        import shutil
+        shutil.rmtree(self.tempdir,ignore_errors=True)
+
+def _RunParallelWorker():
+    """entry point of a worker process of _ParallelWorkerPool"""
+    import sys
+    # pickles are exchanged through the original stdin/stdout, anything printed goes to stderr
+    channelin = os.fdopen(os.dup(0),'rb')
+    channelout = os.fdopen(os.dup(1),'wb')
+    os.dup2(2,1)
+    envfilename,modulename,classname,robotname,manipname,bodyargs,consumername,args,kwargs = pickle.load(channelin)
+    openravepy_int.RaveInitialize(True)
+    env = openravepy_int.Environment()
+    try:
+        env.StopSimulation()
+        env.Load(envfilename)
+        robot = env.GetKinBody(robotname)
+        if manipname is not None:
+            robot.SetActiveManipulator(manipname)
+        Model = getattr(__import__(modulename,fromlist=[classname]),classname)
+        modelkwargs = dict([(name,env.GetKinBody(bodyname)) for name,bodyname in bodyargs.iteritems()])
+        model = Model(robot=robot,**modelkwargs)
+        consumer = getattr(model,consumername)(*args,**kwargs)
+        while True:
+            try:
+                works = pickle.load(channelin)
+            except EOFError:
+                break
+            pickle.dump([consumer(*work) for work in works],channelout,pickle.HIGHEST_PROTOCOL)
+            channelout.flush()
+    finally:
+        model = None
+        robot = None
+        env.Destroy()
+        openravepy_int.RaveDestroy()
+
+def _ChunkWork(works,chunksize):
+    chunk = []
+    for work in works:
+        chunk.append(work)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
 import inversekinematics
 import grasping
 import convexdecomposition
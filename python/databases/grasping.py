@@ -156,6 +156,8 @@ __license__ = 'Apache License, Version 2.0'
 from traceback import print_exc
 import time
 import os.path
+from os import makedirs
+from bisect import bisect_left, insort
 try:
     import cPickle as pickle
 except:
@@ -191,9 +193,34 @@ except:
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 
+# grasp quality metrics computed from the contacts (N,6) of a simulated grasp. Lower values are better grasps.
+def _GraspQualityCentroid(contacts,center,mindist,volume):
+    """negative squared distance of the closest contact to the center of the object"""
+    if len(contacts) == 0:
+        return -inf
+    return -numpy.min(sum((contacts[:,0:3]-center)**2,1))
+
+def _GraspQualityEpsilon(contacts,center,mindist,volume):
+    """negative epsilon quality (radius of the largest ball inside the grasp wrench space) returned by the grasper"""
+    return -mindist if mindist is not None else 0.0
+
+def _GraspQualityVolume(contacts,center,mindist,volume):
+    """negative volume of the grasp wrench space returned by the grasper"""
+    return -volume if volume is not None else 0.0
+
+def _GraspQualityNormalSpread(contacts,center,mindist,volume):
+    """length of the mean contact normal, 0 when the contact normals are balanced and 1 when they all point the same way"""
+    if len(contacts) == 0:
+        return inf
+    normals = contacts[:,3:6]/maximum(sqrt(sum(contacts[:,3:6]**2,1)),1e-12)[:,newaxis]
+    return sqrt(sum(mean(normals,0)**2))
+
 class GraspingModel(DatabaseGenerator):
     """Holds all functions/data related to a grasp between a robot hand and a target"""
 
+    rejectionstages = ('workspace','reachability','obstacles','ik','collision','backup','grasper')
+    graspqualitymetrics = {'centroid':_GraspQualityCentroid, 'epsilon':_GraspQualityEpsilon, 'volume':_GraspQualityVolume, 'normalspread':_GraspQualityNormalSpread}
+
     class GripperVisibility:
         """When 'entered' will hide all the non-gripper links in order to facilitate visiblity of the gripper"""
         def __init__(self,manip):
@@ -227,10 +254,12 @@ class GraspingModel(DatabaseGenerator):
         self.preprocess()
         self.approachgraphs = None
         self.contactgraph = None
-        self.numthreads=None
         self.disableallbodies=True
         self.translationstepmult = None
         self.finestep = None
+        self.approachindex = None # (directionbins,binorder,binoffsets) grouping the grasps by approach direction, see getGraspIndicesByApproach
+        self.rejectioncounts = dict.fromkeys(self.rejectionstages,0) # number of grasps rejected by each stage of the last grasp validation
+        self.graspquality = 'centroid' # name of a metric in graspqualitymetrics, a function with the same signature, or 'simulate'
         # only the indices used by the TaskManipulation plugin should start with an 'i'
         graspdof = {'igraspdir':3,'igrasppos':3,'igrasproll':1,'igraspstandoff':1,'igrasppreshape':len(self.manip.GetGripperIndices()),'igrasptrans':12,'imanipulatordirection':3,'forceclosure':1,'grasptrans_nocol':12,'performance':1}
         self.graspindices = dict()
@@ -252,7 +281,10 @@ class GraspingModel(DatabaseGenerator):
         self.basemanip = interfaces.BaseManipulation(self.robot,maxvelmult=self.maxvelmult)
         self.grasper = interfaces.Grasper(self.robot,friction=friction,avoidlinks=avoidlinks,plannername=plannername)
         self.grasps = []
+        self.approachindex = None
     def load(self):
+        if self.LoadMemoryMapped():
+            return True
         filename = self.getfilename(True)
         if len(filename) == 0:
             return None
@@ -267,6 +299,7 @@ class GraspingModel(DatabaseGenerator):
 
             self.basemanip = interfaces.BaseManipulation(self.robot,maxvelmult=self.maxvelmult)
             self.grasper = interfaces.Grasper(self.robot,friction,avoidlinks = [self.robot.GetLink(name) for name in linknames],plannername=plannername)
+            self.approachindex = None
             return self.has()
 
         except MemoryError,e:
@@ -275,12 +308,157 @@ class GraspingModel(DatabaseGenerator):
             print '%s failed: '%filename,e
         return False
 
-    def save(self):
+    def save(self,legacyformat=True):
+        """Saves the memory-mapped format of :meth:`SaveMemoryMapped`, which :meth:`load` prefers.
+
+        :param legacyformat: If True, also writes the pickled .pp file of :meth:`getfilename` that tools reading the database file expect.
+        """
+        self.SaveMemoryMapped()
+        if legacyformat:
+            self.SavePickle()
+    def SavePickle(self):
         DatabaseGenerator.save(self,(self.grasps,self.graspindices,self.grasper.friction,[link.GetName() for link in self.grasper.avoidlinks],self.grasper.plannername,self.translationstepmult,self.finestep))
+    def getcheckpointstate(self):
+        return self.grasps
+    def setcheckpointstate(self,state):
+        self.grasps = state
     def getfilename(self,read=False):
         return RaveFindDatabaseFile(os.path.join('robot.'+self.robot.GetKinematicsGeometryHash(), 'graspset.' + self.manip.GetStructureHash() + '.' + self.target.GetKinematicsGeometryHash()+'.pp'),read)
 
         return DatabaseGenerator.getfilename(self,read,)
+    def getmmapfilename(self,name,read=False):
+        """filename of the memory-mapped array called name. The 'header' name holds the pickled parameters"""
+        ext = '.pp' if name == 'header' else '.npy'
+        return RaveFindDatabaseFile(os.path.join('robot.'+self.robot.GetKinematicsGeometryHash(), 'graspset.' + self.manip.GetStructureHash() + '.' + self.target.GetKinematicsGeometryHash()+'.mmap.' + name + ext),read)
+
+    def SaveMemoryMapped(self):
+        """Saves the grasps as a memory-mappable array along with the approach direction index of :meth:`getGraspIndicesByApproach`.
+
+        The grasps are stored in row-major order, so reading one grasp (grasps[i]) touches a single contiguous row. Databases saved in column-major order by earlier versions still load.
+        """
+        grasps = ascontiguousarray(self.grasps if len(self.grasps) > 0 else zeros((0,self.totaldof)))
+        if self.approachindex is None:
+            self.approachindex = self.ComputeApproachIndex(grasps[:,self.graspindices['igraspdir']])
+        directionbins,binorder,binoffsets = self.approachindex
+        filename = self.getmmapfilename('header',False)
+        log.info('saving model to %s',filename)
+        try:
+            makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        numpy.save(self.getmmapfilename('grasps',False),grasps)
+        numpy.save(self.getmmapfilename('approachorder',False),binorder)
+        numpy.save(self.getmmapfilename('approachoffsets',False),binoffsets)
+        # write the header last so that an incomplete save is never loaded
+        pickle.dump((self.getversion(),self.graspindices,self.grasper.friction,[link.GetName() for link in self.grasper.avoidlinks],self.grasper.plannername,self.translationstepmult,self.finestep,directionbins), open(filename,'wb'))
+
+    def LoadMemoryMapped(self):
+        """Memory-maps the grasps saved by :meth:`SaveMemoryMapped`, rows are only read from disk when accessed."""
+        filename = self.getmmapfilename('header',True)
+        if len(filename) == 0:
+            return False
+        try:
+            modelversion,graspindices,friction,linknames,plannername,translationstepmult,finestep,directionbins = pickle.load(open(filename,'rb'))
+            if modelversion != self.getversion():
+                log.error('version is wrong %s!=%s ',modelversion,self.getversion())
+                return False
+            self.grasps = numpy.load(self.getmmapfilename('grasps',True),mmap_mode='r')
+            binorder = numpy.load(self.getmmapfilename('approachorder',True),mmap_mode='r')
+            binoffsets = numpy.load(self.getmmapfilename('approachoffsets',True))
+            self.graspindices,self.translationstepmult,self.finestep = graspindices,translationstepmult,finestep
+            self.approachindex = (directionbins,binorder,binoffsets)
+            self.basemanip = interfaces.BaseManipulation(self.robot,maxvelmult=self.maxvelmult)
+            self.grasper = interfaces.Grasper(self.robot,friction,avoidlinks = [self.robot.GetLink(name) for name in linknames],plannername=plannername)
+            return self.has()
+        except Exception,e:
+            log.debug('LoadMemoryMapped for %s: %s',filename,e)
+            return False
+
+    def getGraspField(self,name):
+        """returns the (N,dof) columns of the field name of graspindices for all grasps. This is a view, so when memory-mapped nothing is copied until accessed."""
+        indices = self.graspindices[name]
+        return self.grasps[:,indices[0]:(indices[-1]+1)]
+
+    @staticmethod
+    def ComputeApproachIndex(directions,directionbins=8):
+        """Groups the grasps by the cube-map cell of their approach direction. Every face of the cube is divided into directionbins x directionbins cells.
+
+        :return: (directionbins,binorder,binoffsets) where the grasps of bin i are binorder[binoffsets[i]:binoffsets[i+1]] in increasing index order
+        """
+        bins = GraspingModel._ComputeDirectionBins(directions,directionbins)
+        binorder = argsort(bins,kind='mergesort').astype(int32)
+        binoffsets = searchsorted(bins[binorder],arange(6*directionbins**2+1))
+        return directionbins,binorder,binoffsets
+
+    @staticmethod
+    def _ComputeDirectionBins(directions,directionbins):
+        directions = reshape(directions,(-1,3))
+        if len(directions) == 0:
+            return zeros(0,int)
+        axes = argmax(abs(directions),1)
+        rows = arange(len(directions))
+        major = directions[rows,axes]
+        faces = 2*axes+(major<0)
+        # project on the cube face and discretize the two other coordinates
+        u = directions[rows,(axes+1)%3]/abs(major)
+        v = directions[rows,(axes+2)%3]/abs(major)
+        iu = minimum(array(floor((u+1)*0.5*directionbins),int),directionbins-1)
+        iv = minimum(array(floor((v+1)*0.5*directionbins),int),directionbins-1)
+        return (faces*directionbins+iu)*directionbins+iv
+
+    def getGraspIndicesByApproach(self,direction,angle,position=None,radius=None):
+        """Returns the sorted indices of the grasps whose approach direction (igraspdir) is within angle radians of direction. Only the grasps of the cube-map bins overlapping the cone are tested.
+
+        :param direction: direction in the target coordinate system
+        :param position: if not None, also requires the grasp position (igrasppos) to be within radius of position in the target coordinate system
+        :param radius: has to be set if and only if position is set
+        """
+        if (position is None) != (radius is None):
+            raise ValueError('position and radius have to be specified together')
+        if len(self.grasps) == 0:
+            return zeros(0,int)
+        if self.approachindex is None:
+            self.approachindex = self.ComputeApproachIndex(self.getGraspField('igraspdir'))
+        directionbins,binorder,binoffsets = self.approachindex
+        direction = array(direction,float)/linalg.norm(direction)
+        # every bin is bounded by the cone around its center direction passing through its corners
+        numbins = 6*directionbins**2
+        faces = arange(numbins)//(directionbins**2)
+        iu = (arange(numbins)//directionbins)%directionbins
+        iv = arange(numbins)%directionbins
+        binuv = zeros((numbins,2,2))
+        binuv[:,0,:] = c_[iu,iu+1]*2.0/directionbins-1
+        binuv[:,1,:] = c_[iv,iv+1]*2.0/directionbins-1
+        axes = faces//2
+        signs = 1-2*(faces%2)
+        rows = arange(numbins)
+        centers = zeros((numbins,3))
+        centers[rows,axes] = signs
+        centers[rows,(axes+1)%3] = mean(binuv[:,0,:],1)
+        centers[rows,(axes+2)%3] = mean(binuv[:,1,:],1)
+        centers /= sqrt(sum(centers**2,1))[:,newaxis]
+        binradius = zeros(numbins)
+        for iucorner,ivcorner in iterproduct(range(2),range(2)):
+            corners = zeros((numbins,3))
+            corners[rows,axes] = signs
+            corners[rows,(axes+1)%3] = binuv[:,0,iucorner]
+            corners[rows,(axes+2)%3] = binuv[:,1,ivcorner]
+            corners /= sqrt(sum(corners**2,1))[:,newaxis]
+            binradius = maximum(binradius,arccos(minimum(1.0,sum(centers*corners,1))))
+        binangle = arccos(minimum(1.0,maximum(-1.0,dot(centers,direction))))
+        candidatebins = flatnonzero(binangle <= angle+binradius+1e-9)
+        if len(candidatebins) == 0:
+            return zeros(0,int)
+        candidates = sort(numpy.concatenate([binorder[binoffsets[b]:binoffsets[b+1]] for b in candidatebins]))
+        if len(candidates) == 0:
+            return zeros(0,int)
+        directions = self.grasps[candidates][:,self.graspindices['igraspdir']]
+        valid = dot(directions,direction) >= cos(angle)*sqrt(sum(directions**2,1))
+        if position is not None:
+            positions = self.grasps[candidates][:,self.graspindices['igrasppos']]
+            valid = logical_and(valid,sum((positions-position)**2,1) <= radius**2)
+        return candidates[valid]
+
     def preprocess(self):
         with self.env:
             self.jointmaxlengths = zeros(len(self.robot.GetJoints()))
@@ -320,9 +498,11 @@ class GraspingModel(DatabaseGenerator):
             if hasattr(options,'manipulatordirections') and options.manipulatordirections is not None:
                 manipulatordirections = array([array([float(s) for s in md.split()]) for md in options.manipulatordirections])
             if hasattr(options,'boxdelta') and options.boxdelta is not None:
-                approachrays = self.computeBoxApproachRays(delta=options.boxdelta,normalanglerange=options.normalanglerange,directiondelta=options.directiondelta)
+                approachrays = self.computeBoxApproachRays(delta=options.boxdelta,normalanglerange=options.normalanglerange,directiondelta=options.directiondelta,maxapproachrays=getattr(options,'maxapproachrays',None))
             elif hasattr(options,'spheredelta') and options.spheredelta is not None:
-                approachrays = self.computeSphereApproachRays(delta=options.spheredelta,normalanglerange=options.normalanglerange,directiondelta=options.directiondelta)
+                approachrays = self.computeSphereApproachRays(delta=options.spheredelta,normalanglerange=options.normalanglerange,directiondelta=options.directiondelta,maxapproachrays=getattr(options,'maxapproachrays',None))
+            elif hasattr(options,'meshdelta') and options.meshdelta is not None:
+                approachrays = self.computeMeshApproachRays(delta=options.meshdelta,normalanglerange=options.normalanglerange,directiondelta=options.directiondelta,maxapproachrays=getattr(options,'maxapproachrays',None))
             if hasattr(options,'standoffs') and options.standoffs is not None:
                 standoffs = array(options.standoffs)
             if hasattr(options,'rolls') and options.rolls is not None:
@@ -367,6 +547,15 @@ class GraspingModel(DatabaseGenerator):
         forceclosurethreshold=1e-9
         return preshapes,standoffs,rolls,approachrays, graspingnoise,forceclosure,forceclosurethreshold,None,manipulatordirections,translationstepmult,finestep,friction,avoidlinks,plannername
 
+    def autogenerate(self,options=None):
+        if options is not None and (getattr(options,'targetgrasps',None) is not None or getattr(options,'timebudget',None) is not None):
+            if getattr(options,'checkpointinterval',None) is not None:
+                log.warn('checkpointing is not supported with --targetgrasps or --timebudget, ignoring --checkpointinterval')
+            self.generate(*self.autogenerateparams(options),adaptive=True,targetgrasps=options.targetgrasps,timebudget=options.timebudget)
+            self.save()
+        else:
+            DatabaseGenerator.autogenerate(self,options)
+
     def generate(self,*args,**kwargs):
         """
         Generates all the worker items, processes them, and stores the results. For an argument list, take a look at :meth:`.generatepcg`
@@ -379,21 +568,27 @@ class GraspingModel(DatabaseGenerator):
             for b in bodies:
                 b[0].Enable(False)
         try:
-            if self.numthreads is not None and self.numthreads > 1:
+            if self.numthreads is not None and self.numthreads > 1 and not kwargs.get('adaptive',False):
                 self._generateThreaded(*args,**kwargs)
             else:
                 with self.GripperVisibility(self.manip):
                     if self.env.GetViewer() is not None:
                         self.env.UpdatePublishedBodies()
                     producer,consumer,gatherer,numjobs = self.generatepcg(*args,**kwargs)
-                    counter = 0
-                    for work in producer():
-                        print 'grasp %d/%d'%(counter,numjobs)
-                        counter += 1
-                        results = consumer(*work)
-                        if len(results) > 0:
-                            gatherer(*results)
-                    gatherer() # gather results
+                    def countingproducer():
+                        for counter,work in enumerate(producer()):
+                            print 'grasp %d/%d'%(counter,numjobs)
+                            yield work
+                    if kwargs.get('adaptive',False):
+                        # the adaptive producer picks its work items from the grasps gathered so far and its time budget starts with the generation, so it cannot be resumed by skipping the processed items
+                        if self.checkpointinterval is not None:
+                            log.warn('checkpointing is not supported for adaptive generation, ignoring checkpointinterval')
+                        checkpointkey = None
+                        works,numprocessed = countingproducer(),0
+                    else:
+                        checkpointkey = self._GetCheckpointKey(args,kwargs)
+                        works,numprocessed = self._resumeFromCheckpoint(countingproducer(),checkpointkey)
+                    self._gatherResults((consumer(*work) for work in works),gatherer,checkpointkey,numprocessed)
         finally:
             for b,enable in bodies:
                 b.Enable(enable)
@@ -401,11 +596,15 @@ class GraspingModel(DatabaseGenerator):
         print 'grasping finished in %fs'%(time.time()-starttime)
 
 
-    def generatepcg(self,preshapes=None,standoffs=None,rolls=None,approachrays=None, graspingnoise=None,forceclosure=True,forceclosurethreshold=1e-9,checkgraspfn=None,manipulatordirections=None,translationstepmult=None,finestep=None,friction=None,avoidlinks=None,plannername=None,boxdelta=None,spheredelta=None,normalanglerange=None):
+    def generatepcg(self,preshapes=None,standoffs=None,rolls=None,approachrays=None, graspingnoise=None,forceclosure=True,forceclosurethreshold=1e-9,checkgraspfn=None,manipulatordirections=None,translationstepmult=None,finestep=None,friction=None,avoidlinks=None,plannername=None,boxdelta=None,spheredelta=None,normalanglerange=None,adaptive=False,targetgrasps=None,timebudget=None,coarsefraction=0.1,refineradius=0.04,refineangle=0.5,graspquality=None):
         """Generates a grasp set by searching space and evaluating contact points.
 
         All grasp parameters have to be in the bodies's coordinate system (ie: approachrays).
-        @param checkgraspfn: If set, then will be used to validate the grasp. If its evaluation returns false, then grasp will not be added to set. Called by checkgraspfn(contacts,finalconfig,grasp,info)"""
+        @param checkgraspfn: If set, then will be used to validate the grasp. If its evaluation returns false, then grasp will not be added to set. Called by checkgraspfn(contacts,finalconfig,grasp,info)
+        @param adaptive: If True, first evaluates a coarse subset (coarsefraction) of the approach rays, then evaluates the (approach ray, roll) pairs closest to the good grasps found so far, see refineradius and refineangle. Only the regions without any good grasps nearby fall back to the coarse to fine sweep. The found grasps are fed back as they are gathered, so generation has to run in one thread.
+        @param targetgrasps: If set, stops once that many good grasps are found
+        @param timebudget: If set, stops producing new grasps after that many seconds
+        @param graspquality: If set, the metric used for the performance of every grasp, see :meth:`computeGraspQuality`"""
         print 'Generating Grasp Set for %s:%s:%s'%(self.robot.GetName(),self.manip.GetName(),self.target.GetName())
         if friction is None:
             friction = 0.4
@@ -438,6 +637,8 @@ class GraspingModel(DatabaseGenerator):
             manipulatordirections = array([self.manip.GetDirection()])
         self.translationstepmult = translationstepmult
         self.finestep = finestep
+        if graspquality is not None:
+            self.graspquality = graspquality
         time.sleep(0.1) # sleep or otherwise viewer might not load well
         N = approachrays.shape[0]
         with self.env:
@@ -450,15 +651,75 @@ class GraspingModel(DatabaseGenerator):
         self.contactgraph = None
         totalgrasps = N*len(preshapes)*len(rolls)*len(standoffs)*len(manipulatordirections)
         self.grasps = []
+        starttime = time.time()
+
+        def stopgenerating():
+            if targetgrasps is not None and len(self.grasps) >= targetgrasps:
+                log.info('found %d grasps, stopping generation',len(self.grasps))
+                return True
+            if timebudget is not None and time.time()-starttime > timebudget:
+                log.info('time budget of %fs reached, stopping generation',timebudget)
+                return True
+            return False
 
         def producer():
             for approachray in approachrays:
                 for roll in rolls:
+                    if stopgenerating():
+                        return
                     for preshape in preshapes:
                         for standoff in standoffs:
                             for manipulatordirection in manipulatordirections:
                                 yield approachray, roll, preshape, standoff, manipulatordirection
 
+        def adaptiveproducer():
+            numrolls = len(rolls)
+            raylookup = dict()
+            for iray in range(N-1,-1,-1):
+                raylookup[tuple(approachrays[iray])] = iray
+            rolllookup = dict([(roll,iroll) for iroll,roll in enumerate(rolls)])
+            scores = zeros((N,numrolls))
+            evaluated = zeros((N,numrolls),bool)
+            # sweeping the rays with a stride makes the first pass a coarse covering of the surface
+            stride = max(1,int(round(1.0/coarsefraction)))
+            exploreorder = numpy.concatenate([arange(offset,N,stride) for offset in range(stride)])
+            iexplore = 0
+            # performances of the gathered grasps, kept sorted
+            sortedperformances = []
+            while not stopgenerating():
+                # increase the scores of the neighbors of the newly gathered grasps, weighted by how good their performance is
+                while len(sortedperformances) < len(self.grasps):
+                    grasp = self.grasps[len(sortedperformances)]
+                    performance = grasp[self.graspindices['performance'][0]]
+                    insort(sortedperformances,performance)
+                    iray = raylookup.get(tuple(r_[grasp[self.graspindices['igrasppos']],-grasp[self.graspindices['igraspdir']]]),None)
+                    iroll = rolllookup.get(grasp[self.graspindices['igrasproll'][0]],None)
+                    if iray is None or iroll is None:
+                        continue
+                    # fraction of the gathered grasps whose performance is >= this one
+                    weight = 1.0+float(len(sortedperformances)-bisect_left(sortedperformances,performance))/len(sortedperformances)
+                    neighbors = flatnonzero(logical_and(sum((approachrays[:,0:3]-approachrays[iray,0:3])**2,1) <= refineradius**2, dot(approachrays[:,3:6],approachrays[iray,3:6]) >= cos(refineangle)))
+                    scores[neighbors,iroll] += weight
+                    if numrolls > 1:
+                        scores[neighbors,(iroll+1)%numrolls] += 0.5*weight
+                        scores[neighbors,(iroll-1)%numrolls] += 0.5*weight
+                candidates = numpy.where(evaluated,-1,scores)
+                ibest = argmax(candidates)
+                if candidates.flat[ibest] > 0:
+                    iray,iroll = unravel_index(ibest,scores.shape)
+                else:
+                    while iexplore < len(exploreorder) and numpy.all(evaluated[exploreorder[iexplore]]):
+                        iexplore += 1
+                    if iexplore >= len(exploreorder):
+                        return
+                    iray = exploreorder[iexplore]
+                    iroll = flatnonzero(~evaluated[iray])[0]
+                evaluated[iray,iroll] = True
+                for preshape in preshapes:
+                    for standoff in standoffs:
+                        for manipulatordirection in manipulatordirections:
+                            yield approachrays[iray], rolls[iroll], preshape, standoff, manipulatordirection
+
         def consumer(approachray, roll, preshape, standoff, manipulatordirection):
             grasp = zeros(self.totaldof)
             grasp[self.graspindices.get('igrasppos')] = approachray[0:3]
@@ -495,7 +756,10 @@ class GraspingModel(DatabaseGenerator):
                 grasp[self.graspindices.get('forceclosure')] = mindist if mindist is not None else 0
                 self.robot.SetTransform(Trobotorig) # transform back to original position for checkgraspfn
                 if not forceclosure or mindist >= forceclosurethreshold:
-                    grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp, graspingnoise=graspingnoise,translate=True,forceclosure=False)
+                    if self.graspquality == 'simulate':
+                        grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp, graspingnoise=graspingnoise,translate=True,forceclosure=False)
+                    else:
+                        grasp[self.graspindices.get('performance')] = self.computeGraspQuality(contacts,mindist,volume)
                     if checkgraspfn is None or checkgraspfn(contacts,finalconfig,grasp,{'mindist':mindist,'volume':volume}):
                         print 'found good grasp'
                         return grasp,
@@ -510,11 +774,12 @@ class GraspingModel(DatabaseGenerator):
                 if len(self.grasps) > 1:
                     order = argsort(self.grasps[:,self.graspindices.get('performance')[0]])
                     self.grasps = self.grasps[order]
+                self.approachindex = None
                 # force closing the handles
                 self.approachgraphs = None
                 self.contactgraph = None
         
-        return producer, consumer, gatherer, totalgrasps
+        return adaptiveproducer if adaptive else producer, consumer, gatherer, totalgrasps
 
     def _generateThreaded(self,preshapes=None,standoffs=None,rolls=None,approachrays=None, graspingnoise=None,forceclosure=True,forceclosurethreshold=1e-9,checkgraspfn=None,manipulatordirections=None,translationstepmult=None,finestep=None,friction=None,avoidlinks=None,plannername=None):
         """Generates a grasp set by searching space and evaluating contact points.
@@ -598,7 +863,10 @@ class GraspingModel(DatabaseGenerator):
                     grasp[self.graspindices.get('grasptrans_nocol')] = reshape(transpose(Tlocalgrasp_nocol[0:3,0:4]),12)
                     grasp[self.graspindices.get('forceclosure')] = mindist if mindist is not None else 0
                     if not forceclosurethreshold or mindist >= forceclosurethreshold:
-                        grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp)
+                        if self.graspquality == 'simulate':
+                            grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp)
+                        else:
+                            grasp[self.graspindices.get('performance')] = self.computeGraspQuality(contacts,mindist,volume)
                         if checkgraspfn is None or checkgraspfn(contacts,[Tfinal,finalshape],grasp,{'mindist':mindist,'volume':volume}):
                             self.grasps.append(grasp)
 
@@ -757,7 +1025,7 @@ class GraspingModel(DatabaseGenerator):
         while execute and not self.robot.GetController().IsDone(): # busy wait
             time.sleep(0.01)
         return trajdata
-    def computeValidGrasps(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,returnnum=inf):
+    def computeValidGrasps(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,returnnum=inf,indices=None,workspacebounds=None,workspaceplanes=None,reachabilitymodel=None,obstacles=None):
         """Returns the set of grasps that satisfy conditions like collision-free and reachable.
 
         :param returnnum: If set, will also return once that many number of grasps are found.
@@ -766,24 +1034,36 @@ class GraspingModel(DatabaseGenerator):
         :param startindex: The index to start searching for grasps
         :param checkik: If True will check that the grasp is reachable by the arm.
         :param checkcollision: If true will return only collision-free grasps. If checkik is also True, will return grasps that have collision-free arm solutions.
+        :param indices: If not None, only the grasps at these indices are checked, for example the result of :meth:`getGraspIndicesByApproach`.
+
+        workspacebounds, workspaceplanes, reachabilitymodel, and obstacles are passed to :meth:`computeGraspPrefilter`, which rejects grasps before any expensive checks. The number of grasps rejected by every stage is stored in self.rejectioncounts.
         """
+        self.rejectioncounts = dict.fromkeys(self.rejectionstages,0)
         with self.robot:
             validgrasps = []
             validindices = []
             self.robot.SetActiveManipulator(self.manip)
             report = CollisionReport()
-            for i in range(startindex,len(self.grasps)):
+            if indices is None:
+                order = range(startindex,len(self.grasps))
+            else:
+                order = [i for i in indices if i >= startindex]
+            if workspacebounds is not None or workspaceplanes is not None or reachabilitymodel is not None or obstacles is not None:
+                order = self.computeGraspPrefilter(order,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=reachabilitymodel,obstacles=obstacles)
+            for i in order:
                 grasp = self.grasps[i]
                 self.setPreshape(grasp)
                 Tglobalgrasp = self.getGlobalGraspTransform(grasp,collisionfree=True)
                 if checkik:
                     if self.manip.GetIkSolver().Supports(IkParameterization.Type.Transform6D):
-                        if self.manip.FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                            self.rejectioncounts['ik'] += 1
                             continue
                     elif self.manip.GetIkSolver().Supports(IkParameterization.Type.TranslationDirection5D):
                         ikparam = IkParameterization(Ray(Tglobalgrasp[0:3,3],dot(Tglobalgrasp[0:3,0:3],self.manip.GetDirection())),IkParameterization.Type.TranslationDirection5D)
-                        solution = self.manip.FindIKSolution(ikparam,checkcollision)
+                        solution = self._FindIKSolution(ikparam,checkcollision)
                         if solution is None:
+                            self.rejectioncounts['ik'] += 1
                             continue
                         with RobotStateSaver(self.robot):
                             self.robot.SetDOFValues(solution, self.manip.GetArmIndices())
@@ -794,20 +1074,24 @@ class GraspingModel(DatabaseGenerator):
                         return ValueError('manipulator iktype not correct')
                 elif checkcollision:
                     if self.manip.CheckEndEffectorCollision(Tglobalgrasp):
+                        self.rejectioncounts['collision'] += 1
                         continue
                 if backupdist > 0:
                     Tnewgrasp = array(Tglobalgrasp)
                     Tnewgrasp[0:3,3] -= backupdist * self.getGlobalApproachDir(grasp)
                     if checkik:
-                        if self.manip.FindIKSolution(Tnewgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tnewgrasp,checkcollision) is None:
+                            self.rejectioncounts['backup'] += 1
                             continue
                     elif checkcollision:
                         if self.manip.CheckEndEffectorCollision(Tnewgrasp):
+                            self.rejectioncounts['backup'] += 1
                             continue
                 if checkcollision and checkgrasper:
                     try:
                         contacts2,finalconfig2,mindist2,volume2 = self.runGraspFromTrans(grasp)
                     except planning_error, e:
+                        self.rejectioncounts['grasper'] += 1
                         continue
                 validgrasps.append(grasp)
                 validindices.append(i)
@@ -815,40 +1099,50 @@ class GraspingModel(DatabaseGenerator):
                     return validgrasps,validindices
             return validgrasps,validindices
 
-    def validGraspIterator(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,randomgrasps=False,returnfinal=False):
+    def validGraspIterator(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,randomgrasps=False,returnfinal=False,indices=None,workspacebounds=None,workspaceplanes=None,reachabilitymodel=None,obstacles=None):
         """Returns an iterator for valid grasps that satisfy certain conditions.
 
         :param returnfinal: if True will return the contacts and finalconfig of the simulation grasp
         See :meth:`computeValidGrasps` for description of parameters.
         """
-        if randomgrasps:
-            order = startindex+random.permutation(len(self.grasps)-startindex)
+        self.rejectioncounts = dict.fromkeys(self.rejectionstages,0)
+        if indices is not None:
+            order = array([i for i in indices if i >= startindex],int)
         else:
-            order = range(startindex,len(self.grasps))
+            order = arange(startindex,len(self.grasps))
+        if workspacebounds is not None or workspaceplanes is not None or reachabilitymodel is not None or obstacles is not None:
+            order = self.computeGraspPrefilter(order,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=reachabilitymodel,obstacles=obstacles)
+        if randomgrasps:
+            order = random.permutation(order)
         for i in order:
             grasp = self.grasps[i]
             with self.robot.CreateKinBodyStateSaver():
                 self.setPreshape(grasp)
                 Tglobalgrasp = self.getGlobalGraspTransform(grasp,collisionfree=True)
                 if checkik:
-                    if self.manip.FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                    if self._FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                        self.rejectioncounts['ik'] += 1
                         continue
                 elif checkcollision:
                     if self.manip.CheckEndEffectorCollision(Tglobalgrasp):
+                        self.rejectioncounts['collision'] += 1
                         continue
                 if backupdist > 0:
                     Tnewgrasp = array(Tglobalgrasp)
                     Tnewgrasp[0:3,3] -= backupdist * self.getGlobalApproachDir(grasp)
                     if checkik:
-                        if self.manip.FindIKSolution(Tnewgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tnewgrasp,checkcollision) is None:
+                            self.rejectioncounts['backup'] += 1
                             continue
                     elif checkcollision:
                         if self.manip.CheckEndEffectorCollision(Tnewgrasp):
+                            self.rejectioncounts['backup'] += 1
                             continue
                 if checkcollision and checkgrasper:
                     try:
                         contacts,finalconfig,mindist,volume = self.runGraspFromTrans(grasp)
                     except planning_error, e:
+                        self.rejectioncounts['grasper'] += 1
                         continue
 
             if returnfinal:
@@ -856,6 +1150,119 @@ class GraspingModel(DatabaseGenerator):
             else:
                 yield grasp,i
 
+    def computeGraspPrefilter(self,indices=None,backupdist=0.0,workspacebounds=None,workspaceplanes=None,reachabilitymodel=None,obstacles=None):
+        """Rejects the grasps that cannot be valid in the current scene with vectorized tests over all the grasps, before any inverse kinematics or grasp simulation is run.
+
+        The stages run in order on the survivors of the previous stage and the number of grasps each one rejects is added to self.rejectioncounts. All the tests are on the collision-free grasp transform and, if backupdist > 0, on the end effector moved back along the approach direction.
+
+        :param indices: the grasp indices to test, if None tests all the grasps
+        :param workspacebounds: (2,3) array of the global lower and upper coordinates the end effector has to lie in
+        :param workspaceplanes: (M,4) array of global planes (normal,d). The end effector has to lie on the positive side dot(normal,p)+d >= 0 of every plane, so a table top plane rejects the grasps approaching from below the table.
+        :param reachabilitymodel: a loaded kinematicreachability.ReachabilityModel of the manipulator, rejects the grasps whose end effector is outside its reachable volume
+        :param obstacles: list of KinBody, rejects the grasps where the bounding box of the gripper at its preshape overlaps the bounding box of any obstacle link. Since boxes are conservative, only pass bodies whose links are tightly bounded by their boxes.
+        :return: array of the surviving indices in the same order as indices
+        """
+        if indices is None:
+            indices = arange(len(self.grasps))
+        indices = array(indices,int)
+        if len(indices) == 0:
+            return indices
+        grasps = array(self.grasps[indices])
+        Ttarget = self.target.GetTransform()
+        localtrans = reshape(grasps[:,self.graspindices['grasptrans_nocol']],(-1,4,3))
+        rotations = transpose(dot(localtrans[:,0:3,:],transpose(Ttarget[0:3,0:3])),(0,2,1))
+        positions = dot(localtrans[:,3,:],transpose(Ttarget[0:3,0:3]))+Ttarget[0:3,3]
+        checkpositions = [positions]
+        if backupdist > 0:
+            approachdirs = dot(grasps[:,self.graspindices['igraspdir']],transpose(Ttarget[0:3,0:3]))
+            checkpositions.append(positions-backupdist*approachdirs)
+
+        def applystage(stage,valid):
+            self.rejectioncounts[stage] += len(valid)-sum(valid)
+            return [x[valid] for x in (indices,grasps,rotations)],[x[valid] for x in checkpositions]
+
+        if workspacebounds is not None or workspaceplanes is not None:
+            valid = ones(len(indices),bool)
+            for p in checkpositions:
+                if workspacebounds is not None:
+                    valid &= numpy.all(logical_and(p >= workspacebounds[0],p <= workspacebounds[1]),1)
+                if workspaceplanes is not None:
+                    valid &= numpy.all(dot(p,transpose(array(workspaceplanes)[:,0:3]))+array(workspaceplanes)[:,3] >= 0,1)
+            (indices,grasps,rotations),checkpositions = applystage('workspace',valid)
+        if reachabilitymodel is not None and len(indices) > 0:
+            valid = ones(len(indices),bool)
+            for p in checkpositions:
+                valid &= reachabilitymodel.GetReachabilityAtPositions(p) > 0
+            (indices,grasps,rotations),checkpositions = applystage('reachability',valid)
+        if obstacles is not None and len(obstacles) > 0 and len(indices) > 0:
+            obstacleboxes = [(ab.pos(),ab.extents()) for ab in [link.ComputeAABB() for body in obstacles for link in body.GetLinks() if len(link.GetGeometries()) > 0]]
+            # gripper boxes in the end effector coordinate system, one for every different preshape
+            boxcenters = zeros((len(indices),3))
+            boxextents = zeros((len(indices),3))
+            preshapes = grasps[:,self.graspindices['igrasppreshape']]
+            with self.robot.CreateKinBodyStateSaver():
+                for preshape in set([tuple(preshape) for preshape in preshapes]):
+                    self.robot.SetDOFValues(preshape,self.manip.GetGripperIndices())
+                    Teeinv = linalg.inv(self.manip.GetEndEffectorTransform())
+                    corners = []
+                    for link in self.manip.GetChildLinks():
+                        if len(link.GetGeometries()) > 0:
+                            ab = link.ComputeAABB()
+                            corners.append(ab.pos()+ab.extents()*array([[i,j,k] for i in [-1,1] for j in [-1,1] for k in [-1,1]]))
+                    if len(corners) == 0:
+                        continue
+                    localcorners = transformPoints(Teeinv,numpy.concatenate(corners))
+                    lower,upper = numpy.min(localcorners,0),numpy.max(localcorners,0)
+                    inds = flatnonzero(numpy.all(preshapes==preshape,1))
+                    boxcenters[inds] = 0.5*(lower+upper)
+                    boxextents[inds] = 0.5*(upper-lower)
+            globalextents = sum(abs(rotations)*boxextents[:,newaxis,:],2)
+            valid = ones(len(indices),bool)
+            for p in checkpositions:
+                globalcenters = sum(rotations*boxcenters[:,newaxis,:],2)+p
+                for pos,extents in obstacleboxes:
+                    valid &= ~numpy.all(abs(globalcenters-pos) <= globalextents+extents,1)
+            (indices,grasps,rotations),checkpositions = applystage('obstacles',valid)
+        return indices
+
+    def generatevalidationconsumer(self,iktypename,grasps,graspindices,friction,linknames,plannername,translationstepmult,finestep):
+        """Returns the function validating a chunk of grasp indices in a given scene state, used by the worker processes of :class:`ParallelGraspValidator`. The arguments after iktypename are the grasp parameters saved by :meth:`SavePickle`.
+
+        The function takes (states,indices,options) where states holds (name,transform,dofvalues,enabled) of every body, options are the keyword arguments of :meth:`computeValidGrasps`, and returns (validindices,validgrasps,rejectioncounts).
+
+        :param iktypename: if not None, the name of the IkParameterizationType of the ik solver to load for the manipulator
+        """
+        self.validationikmodel = None # keeps the loaded ik solver of the worker
+        if iktypename is not None:
+            from . import inversekinematics
+            self.validationikmodel = ikmodel = inversekinematics.InverseKinematicsModel(manip=self.manip,iktype=IkParameterizationType.names[iktypename])
+            if not ikmodel.load():
+                raise ValueError('failed to load the %s ik solver of manipulator %s'%(iktypename,self.manip.GetName()))
+        self.init(friction,[self.robot.GetLink(name) for name in linknames],plannername)
+        self.grasps,self.graspindices,self.translationstepmult,self.finestep = grasps,graspindices,translationstepmult,finestep
+        def consumer(states,indices,options):
+            with self.env:
+                for name,T,dofvalues,enabled in states:
+                    body = self.env.GetKinBody(name)
+                    body.SetTransform(T)
+                    if len(dofvalues) > 0:
+                        body.SetDOFValues(dofvalues)
+                    body.Enable(enabled)
+                validgrasps,validindices = self.computeValidGrasps(indices=indices,**options)
+            return validindices,array(validgrasps),self.rejectioncounts
+        return consumer
+
+    def computeGraspQuality(self,contacts,mindist=None,volume=None,graspquality=None):
+        """Scores a grasp from the contacts, mindist, and volume already returned by the grasper without simulating it again. Lower values are better grasps.
+
+        :param graspquality: name of a metric in graspqualitymetrics ('centroid','epsilon','volume','normalspread') or a function fn(contacts,center,mindist,volume), if None uses self.graspquality. The contacts and center of the target are in the global coordinate system.
+        """
+        if graspquality is None:
+            graspquality = self.graspquality
+        metric = graspquality if callable(graspquality) else self.graspqualitymetrics[graspquality]
+        contacts = reshape(array(contacts,float),(-1,6))
+        return metric(contacts,self.target.ComputeAABB().pos(),mindist,volume)
+
     def _ComputeGraspPerformance(self,grasp, **kwargs):
         """compute a performance metric based on closest contact to the center of object."""
         with self.target:
@@ -875,7 +1282,7 @@ class GraspingModel(DatabaseGenerator):
             else:
                 return -inf
 
-    def computePlaneApproachRays(self,center,sidex,sidey,delta=0.02,normalanglerange=0,directiondelta=0.4):
+    def computePlaneApproachRays(self,center,sidex,sidey,delta=0.02,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
         # ode gives the most accurate rays
         cc = RaveCreateCollisionChecker(self.env,'ode')
         if cc is not None:
@@ -900,28 +1307,18 @@ class GraspingModel(DatabaseGenerator):
                 if len(newinfo) > 0:
                     newinfo[sum(rays[collision,3:6]*newinfo[:,3:6],1)>0,3:6] *= -1
                     approachrays = r_[approachrays,newinfo]
-                if normalanglerange > 0:
-                    theta,pfi = SpaceSamplerExtra().sampleS2(angledelta=directiondelta)
-                    dirs = c_[cos(theta),sin(theta)*cos(pfi),sin(theta)*sin(pfi)]
-                    dirs = array([dir for dir in dirs if arccos(dir[2])<=normalanglerange]) # find all dirs within normalanglerange
-                    if len(dirs) == 0:
-                        dirs = array([[0,0,1]])
-                    newapproachrays = zeros((0,6))
-                    for approachray in approachrays:
-                        R = rotationMatrixFromQuat(quatRotateDirection(array((0,0,1)),approachray[3:6]))
-                        newapproachrays = r_[newapproachrays,c_[tile(approachray[0:3],(len(dirs),1)),dot(dirs,transpose(R))]]
-                    approachrays=newapproachrays
+                approachrays = self.ExpandApproachRays(approachrays,normalanglerange,directiondelta,maxapproachrays)
             return approachrays
         finally:
             # restore the collision checker
             if cc is not None:
                 self.env.SetCollisionChecker(cc)
 
-    def computeBoxApproachRays(self,delta=0.02,normalanglerange=0,directiondelta=0.4):
-        return self._computeBoxApproachRays(self.env,self.target,delta=delta,normalanglerange=normalanglerange,directiondelta=directiondelta)
+    def computeBoxApproachRays(self,delta=0.02,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
+        return self._computeBoxApproachRays(self.env,self.target,delta=delta,normalanglerange=normalanglerange,directiondelta=directiondelta,maxapproachrays=maxapproachrays)
 
     @staticmethod
-    def _computeBoxApproachRays(env,target,delta=0.02,normalanglerange=0,directiondelta=0.4):
+    def _computeBoxApproachRays(env,target,delta=0.02,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
         # ode gives the most accurate rays
         cc = RaveCreateCollisionChecker(env,'ode')
         if cc is not None:
@@ -941,7 +1338,7 @@ class GraspingModel(DatabaseGenerator):
                                (e[0],0,0,-1,0,0,0,e[1],0,0,0,e[2]),
                                (-e[0],0,0,1,0,0,0,e[1],0,0,0,e[2])))
                 maxlen = 2*sqrt(sum(e**2))+0.03
-                approachrays = zeros((0,6))
+                sideapproachrays = []
                 for side in sides:
                     ex = sqrt(sum(side[6:9]**2))
                     ey = sqrt(sum(side[9:12]**2))
@@ -957,25 +1354,16 @@ class GraspingModel(DatabaseGenerator):
                     newinfo = info[collision,:]
                     if len(newinfo) > 0:
                         newinfo[sum(rays[collision,3:6]*newinfo[:,3:6],1)>0,3:6] *= -1
-                        approachrays = r_[approachrays,newinfo]
-                if normalanglerange > 0:
-                    theta,pfi = SpaceSamplerExtra().sampleS2(angledelta=directiondelta)
-                    dirs = c_[cos(theta),sin(theta)*cos(pfi),sin(theta)*sin(pfi)]
-                    dirs = array([dir for dir in dirs if arccos(dir[2])<=normalanglerange]) # find all dirs within normalanglerange
-                    if len(dirs) == 0:
-                        dirs = array([[0,0,1]])
-                    newapproachrays = zeros((0,6))
-                    for approachray in approachrays:
-                        R = rotationMatrixFromQuat(quatRotateDirection(array((0,0,1)),approachray[3:6]))
-                        newapproachrays = r_[newapproachrays,c_[tile(approachray[0:3],(len(dirs),1)),dot(dirs,transpose(R))]]
-                    approachrays = newapproachrays
+                        sideapproachrays.append(newinfo)
+                approachrays = numpy.concatenate(sideapproachrays) if len(sideapproachrays) > 0 else zeros((0,6))
+                approachrays = GraspingModel.ExpandApproachRays(approachrays,normalanglerange,directiondelta,maxapproachrays)
                 return approachrays
         finally:
             # restore the collision checker
             if cc is not None:
                 env.SetCollisionChecker(cc)
 
-    def computeSphereApproachRays(self,delta=0.1,normalanglerange=0,directiondelta=0.4):
+    def computeSphereApproachRays(self,delta=0.1,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
         # ode gives the most accurate rays
         cc = RaveCreateCollisionChecker(self.env,'ode')
         if cc is not None:
@@ -995,23 +1383,89 @@ class GraspingModel(DatabaseGenerator):
                 approachrays = info[collision,:]
                 if len(approachrays) > 0:
                     approachrays[sum(rays[collision,3:6]*approachrays[:,3:6],1)>0,3:6] *= -1
-                if normalanglerange > 0:
-                    theta,pfi = SpaceSamplerExtra().sampleS2(angledelta=directiondelta)
-                    dirs = c_[cos(theta),sin(theta)*cos(pfi),sin(theta)*sin(pfi)]
-                    dirs = array([dir for dir in dirs if arccos(dir[2])<=normalanglerange]) # find all dirs within normalanglerange
-                    if len(dirs) == 0:
-                        dirs = array([[0,0,1]])
-                    newapproachrays = zeros((0,6))
-                    for approachray in approachrays:
-                        R = rotationMatrixFromQuat(quatRotateDirection(array((0,0,1)),approachray[3:6]))
-                        newapproachrays = r_[newapproachrays,c_[tile(approachray[0:3],(len(dirs),1)),dot(dirs,transpose(R))]]
-                    approachrays = newapproachrays
+                approachrays = self.ExpandApproachRays(approachrays,normalanglerange,directiondelta,maxapproachrays)
                 return approachrays
         finally:
             # restore the collision checker
             if cc is not None:
                 self.env.SetCollisionChecker(cc)
 
+    def computeMeshApproachRays(self,delta=0.02,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
+        """Samples approach rays uniformly over the triangulated surface of the target instead of casting rays from its bounding box, so concave and non-box objects are covered evenly.
+
+        Triangles are picked with probability proportional to their area, with on average one sample per delta x delta of surface. The normals come from the triangle winding, so the target mesh has to be consistently oriented outward.
+        """
+        with self.target:
+            self.target.SetTransform(eye(4))
+            trimesh = self.env.Triangulate(self.target)
+        vertices = trimesh.vertices[trimesh.indices]
+        normals = cross(vertices[:,1]-vertices[:,0],vertices[:,2]-vertices[:,0])
+        areas = 0.5*sqrt(sum(normals**2,1))
+        valid = flatnonzero(areas > 1e-12)
+        if len(valid) == 0:
+            return zeros((0,6))
+        vertices,normals,areas = vertices[valid],normals[valid],areas[valid]
+        normals /= 2*areas[:,newaxis]
+        numsamples = max(1,int(ceil(sum(areas)/delta**2)))
+        cumareas = cumsum(areas)
+        triangles = minimum(searchsorted(cumareas,random.rand(numsamples)*cumareas[-1]),len(areas)-1)
+        # uniform barycentric coordinates
+        u = random.rand(numsamples)
+        v = random.rand(numsamples)
+        flip = u+v > 1
+        u[flip] = 1-u[flip]
+        v[flip] = 1-v[flip]
+        v0 = vertices[triangles,0]
+        positions = v0+u[:,newaxis]*(vertices[triangles,1]-v0)+v[:,newaxis]*(vertices[triangles,2]-v0)
+        return self.ExpandApproachRays(c_[positions,normals[triangles]],normalanglerange,directiondelta,maxapproachrays)
+
+    @staticmethod
+    def ExpandApproachRays(approachrays,normalanglerange=0,directiondelta=0.4,maxapproachrays=None):
+        """Expands every approach ray (position,normal) into the fan of directions within normalanglerange of its normal.
+
+        All the fans are computed at once by rotating the fan around +z onto every normal with the shortest rotation (same as quatRotateDirection).
+        :param maxapproachrays: If not None and there are more rays, returns that many rays evenly spread over the expanded set.
+        """
+        approachrays = reshape(approachrays,(-1,6))
+        if normalanglerange > 0:
+            theta,pfi = SpaceSamplerExtra().sampleS2(angledelta=directiondelta)
+            dirs = c_[cos(theta),sin(theta)*cos(pfi),sin(theta)*sin(pfi)]
+            dirs = dirs[arccos(minimum(1.0,maximum(-1.0,dirs[:,2])))<=normalanglerange] # find all dirs within normalanglerange
+            if len(dirs) == 0:
+                dirs = array([[0,0,1.0]])
+        else:
+            dirs = array([[0,0,1.0]])
+        numrays = len(approachrays)*len(dirs)
+        if maxapproachrays is not None and numrays > maxapproachrays:
+            inds = unique(array(around(linspace(0,numrays-1,maxapproachrays)),int))
+        elif normalanglerange > 0:
+            inds = arange(numrays)
+        else:
+            return array(approachrays)
+        rayinds = inds//len(dirs)
+        dirinds = inds%len(dirs)
+        # rotations taking +z to every normal: R = c*I + s*[k]x + (1-c)*k*k^T with k = z x n/s
+        normals = approachrays[:,3:6]/sqrt(sum(approachrays[:,3:6]**2,1))[:,newaxis]
+        c = normals[:,2]
+        s = sqrt(normals[:,0]**2+normals[:,1]**2)
+        k = zeros((len(normals),3))
+        rotate = s > 0
+        k[rotate,0] = -normals[rotate,1]/s[rotate]
+        k[rotate,1] = normals[rotate,0]/s[rotate]
+        # when the normal is -z the hand is flipped around the x axis
+        flipped = logical_and(~rotate,c < 0)
+        k[flipped,0] = 1
+        k[~logical_or(rotate,flipped),0] = 1
+        c[~logical_or(rotate,flipped)] = 1
+        c[flipped] = -1
+        newapproachrays = zeros((len(inds),6))
+        newapproachrays[:,0:3] = approachrays[rayinds,0:3]
+        d = dirs[dirinds]
+        kr = k[rayinds]
+        cr = c[rayinds]
+        newapproachrays[:,3:6] = cr[:,newaxis]*d+s[rayinds][:,newaxis]*cross(kr,d)+((1-cr)*sum(kr*d,1))[:,newaxis]*kr
+        return newapproachrays
+
     def drawContacts(self,contacts,conelength=0.03,transparency=0.5):
         angs = linspace(0,2*pi,10)
         conepoints = r_[[[0,0,0]],conelength*c_[self.grasper.friction*cos(angs),self.grasper.friction*sin(angs),ones(len(angs))]]
@@ -1035,6 +1489,14 @@ class GraspingModel(DatabaseGenerator):
                           help='Step size of of box surface sampling')
         parser.add_option('--spheredelta', action='store', type='float',dest='spheredelta',default=None,
                           help='Delta angle between directions on the sphere')
+        parser.add_option('--meshdelta', action='store', type='float',dest='meshdelta',default=None,
+                          help='Average distance between approach points sampled on the triangulated surface of the target')
+        parser.add_option('--targetgrasps', action='store', type='int',dest='targetgrasps',default=None,
+                          help='If set, uses adaptive sampling and stops once this many good grasps are found')
+        parser.add_option('--timebudget', action='store', type='float',dest='timebudget',default=None,
+                          help='If set, uses adaptive sampling and stops generating grasps after this many seconds')
+        parser.add_option('--maxapproachrays', action='store', type='int',dest='maxapproachrays',default=None,
+                          help='If set, the maximum number of approach rays after expanding the normal angle range')
         parser.add_option('--normalanglerange', action='store', type='float',dest='normalanglerange',default=0.0,
                           help='The range of angles around the surface normal to approach from (default=%default)')
         parser.add_option('--directiondelta', action='store', type='float',dest='directiondelta',default=0.4,
@@ -1077,6 +1539,113 @@ class GraspingModel(DatabaseGenerator):
         kwargs.update({ 'args':args, 'defaultviewer':True })
         return DatabaseGenerator.InitializeFromParser(Model,parser,*margs,**kwargs)
 
+class ParallelGraspValidator(object):
+    """Validates the grasps of a :class:`GraspingModel` on a pool of worker processes, each with its own copy of the environment.
+
+    The workers are fresh python processes of the database worker pool, started on first use. Each loads a copy of the environment saved by this process and gets the grasp parameters of the model (see :meth:`GraspingModel.SavePickle`) when it starts. Every dispatched chunk of grasp indices carries the transforms, joint values, and enable states of all the bodies in the main environment, so the workers always validate against the current scene. If bodies are added or removed, or the grasp set changes, the pool is restarted. Grabbed bodies are only synchronized when the pool starts.
+
+    The vectorized rejection stages of :meth:`GraspingModel.computeGraspPrefilter` run in the main process before dispatching.
+    """
+    def __init__(self,gmodel,numprocesses=None):
+        self.gmodel = gmodel
+        self.numprocesses = numprocesses
+        self.pool = None
+        self.poolkey = None
+    def __del__(self):
+        self.close()
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            self.poolkey = None
+
+    def getSceneState(self):
+        """returns (bodieskey,states) where bodieskey identifies the set of bodies in the environment and states holds their current state"""
+        with self.gmodel.env:
+            bodies = self.gmodel.env.GetBodies()
+            bodieskey = tuple([(body.GetName(),body.GetKinematicsGeometryHash()) for body in bodies])
+            states = [(body.GetName(),body.GetTransform(),body.GetDOFValues(),body.IsEnabled()) for body in bodies]
+        return bodieskey,states
+
+    def _getPool(self,bodieskey):
+        poolkey = (bodieskey,id(self.gmodel.grasps),len(self.gmodel.grasps))
+        if self.pool is None or self.poolkey != poolkey:
+            self.close()
+            from multiprocessing import cpu_count
+            from . import _ParallelWorkerPool
+            gmodel = self.gmodel
+            numprocesses = self.numprocesses if self.numprocesses is not None else cpu_count()
+            log.info('starting %d grasp validation processes',numprocesses)
+            iktypename = None
+            iksolver = gmodel.manip.GetIkSolver()
+            if iksolver is not None:
+                for iktype in [IkParameterizationType.Transform6D,IkParameterizationType.TranslationDirection5D]:
+                    if iksolver.Supports(iktype):
+                        iktypename = iktype.name
+                        break
+            graspparams = (iktypename,array(gmodel.grasps),gmodel.graspindices,gmodel.grasper.friction,[link.GetName() for link in gmodel.grasper.avoidlinks],gmodel.grasper.plannername,gmodel.translationstepmult,gmodel.finestep)
+            self.pool = _ParallelWorkerPool(gmodel,numprocesses,graspparams,{},consumername='generatevalidationconsumer',bodyargs={'target':gmodel.target.GetName()})
+            self.poolkey = poolkey
+            self.numprocesses = numprocesses
+        return self.pool
+
+    def validGraspIterator(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,indices=None,ordered=True,chunksize=None,workspacebounds=None,workspaceplanes=None,reachabilitymodel=None,obstacles=None):
+        """Returns an iterator of (grasp,index) for the valid grasps, see :meth:`GraspingModel.computeValidGrasps` for a description of the parameters.
+
+        :param ordered: If True, the grasps are returned in increasing index order, which is the same order as the serial validation. Otherwise they are returned as soon as any worker finds them.
+        :param chunksize: number of grasp indices sent to a worker at once
+        The environment should not be locked when calling this function. Every worker validates one chunk at a time, so stopping the iteration early leaves little work behind on the workers.
+        """
+        gmodel = self.gmodel
+        gmodel.rejectioncounts = dict.fromkeys(gmodel.rejectionstages,0)
+        if indices is not None:
+            order = array([i for i in indices if i >= startindex],int)
+        else:
+            order = arange(startindex,len(gmodel.grasps))
+        if workspacebounds is not None or workspaceplanes is not None or reachabilitymodel is not None or obstacles is not None:
+            order = gmodel.computeGraspPrefilter(order,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=reachabilitymodel,obstacles=obstacles)
+        if len(order) == 0:
+            return
+        bodieskey,states = self.getSceneState()
+        pool = self._getPool(bodieskey)
+        if chunksize is None:
+            chunksize = max(1,min(50,len(order)/(4*self.numprocesses)))
+        options = {'checkcollision':checkcollision,'checkik':checkik,'checkgrasper':checkgrasper,'backupdist':backupdist}
+        chunks = ([(states,order[i:(i+chunksize)],options)] for i in range(0,len(order),chunksize))
+        allresults = pool.imap(chunks) if ordered else pool.imap_unordered(chunks)
+        try:
+            for (validindices,validgrasps,rejectioncounts), in allresults:
+                for stage,count in rejectioncounts.iteritems():
+                    gmodel.rejectioncounts[stage] += count
+                for i,grasp in zip(validindices,validgrasps):
+                    yield grasp,i
+        except RuntimeError, e:
+            pool.terminate()
+            self.pool = None
+            self.poolkey = None
+            raise planning_error('grasp validation worker failed: %s'%e)
+        finally:
+            # if stopped early, waits for the chunks in flight so the pool can be reused
+            allresults.close()
+
+    def computeValidGrasps(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,returnnum=inf,indices=None,ordered=None,**kwargs):
+        """Parallel version of :meth:`GraspingModel.computeValidGrasps`.
+
+        :param ordered: If None, the grasps are ordered only when returnnum is not set, otherwise the first grasps found are returned.
+        """
+        if ordered is None:
+            ordered = returnnum == inf
+        if returnnum != inf and kwargs.get('chunksize',None) is None:
+            kwargs['chunksize'] = max(1,int(returnnum))
+        validgrasps = []
+        validindices = []
+        for grasp,i in self.validGraspIterator(startindex=startindex,checkcollision=checkcollision,checkik=checkik,checkgrasper=checkgrasper,backupdist=backupdist,indices=indices,ordered=ordered,**kwargs):
+            validgrasps.append(grasp)
+            validindices.append(i)
+            if len(validgrasps) == returnnum:
+                break
+        return validgrasps,validindices
+
 def run(args,*margs,**kwargs):
     """Command-line execution of the example. ``args`` specifies a list of the arguments to the script.
     """
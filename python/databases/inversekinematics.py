@@ -149,15 +149,18 @@ else:
     from numpy import array
 
 from ..openravepy_ext import openrave_exception, RobotStateSaver
-from ..openravepy_int import RaveCreateModule, RaveCreateIkSolver, IkParameterization, IkParameterizationType, RaveFindDatabaseFile, RaveDestroy, Environment, openravepyCompilerVersion, IkFilterOptions
+from ..openravepy_int import RaveCreateModule, RaveCreateIkSolver, RaveGetHomeDirectory, IkParameterization, IkParameterizationType, RaveFindDatabaseFile, RaveDestroy, Environment, openravepyCompilerVersion, IkFilterOptions, poseFromMatrices, CloningOptions
 from . import DatabaseGenerator
-from ..misc import relpath, TSP
-import time,platform,shutil,sys
+from ..misc import relpath, TSP, OrderedDict
+import time,platform,shutil,sys,subprocess
 import os.path
 from os import getcwd, remove
 import distutils
 from distutils import ccompiler
 from optparse import OptionParser
+import hashlib
+import ctypes
+import tempfile
 
 try:
     import cPickle as pickle
@@ -167,6 +170,296 @@ except:
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 
+class IkResultCache(object):
+    """Least-recently-used cache of Manipulator.FindIKSolution results.
+
+    Queries are keyed by the manipulator kinematics hash, the ik type, the filter options, a stamp of the environment state the result depends on, and the target pose quantized by translationres and rotationres. Targets falling in the same quantization cell share the solution of the first query, so the resolutions should be below the tolerances of the caller.
+
+    If filename is given, the cache is loaded from it on creation and :meth:`save` writes it back.
+    """
+    def __init__(self,maxsize=100000,translationres=1e-4,rotationres=1e-4,filename=None):
+        self.maxsize = maxsize
+        self.translationres = translationres
+        self.rotationres = rotationres
+        self.filename = filename
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.filename is not None and os.path.exists(self.filename):
+            self.load()
+
+    def __len__(self):
+        return len(self.results)
+
+    def clear(self):
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def computeEnvironmentStamp(self,robot,filteroptions):
+        """Returns a stamp of the state the ik results depend on. The robot transform and joint values are always used. The geometry and state of all other bodies are only used when checking environment collisions.
+        """
+        names = [robot.GetName()]
+        values = [robot.GetTransform().flatten(),robot.GetDOFValues()]
+        if int(filteroptions) & int(IkFilterOptions.CheckEnvCollisions):
+            grabbed = robot.GetGrabbed()
+            for body in robot.GetEnv().GetBodies():
+                if body == robot:
+                    continue
+                names.append((body.GetName(),body.GetKinematicsGeometryHash(),body.IsEnabled()))
+                if not body in grabbed: # grabbed bodies move with the robot
+                    values.append(body.GetTransform().flatten())
+                    values.append(body.GetDOFValues())
+        digest = hashlib.md5(pickle.dumps(names))
+        digest.update(around(concatenate(values)/self.translationres).astype(int64).tostring())
+        return digest.hexdigest()
+
+    def getKey(self,manip,ikparam,filteroptions):
+        if isinstance(ikparam,IkParameterization):
+            iktype = int(ikparam.GetType())
+            values = around(array(ikparam.GetValues())/self.translationres)
+        else:
+            T = asarray(ikparam)
+            iktype = int(IkParameterizationType.Transform6D)
+            values = r_[around(T[0:3,0:3].flatten()/self.rotationres),around(T[0:3,3]/self.translationres)]
+        return (manip.GetKinematicsStructureHash(),manip.GetName(),iktype,int(filteroptions),self.computeEnvironmentStamp(manip.GetRobot(),filteroptions),values.astype(int64).tostring())
+
+    def FindIKSolution(self,manip,ikparam,filteroptions):
+        """Same as manip.FindIKSolution(ikparam,filteroptions), but returns the cached result if the query was seen before."""
+        key = self.getKey(manip,ikparam,filteroptions)
+        if key in self.results:
+            self.hits += 1
+            solution = self.results.pop(key)
+        else:
+            self.misses += 1
+            solution = manip.FindIKSolution(ikparam,filteroptions)
+            if len(self.results) >= self.maxsize:
+                self.results.popitem(last=False)
+        self.results[key] = solution
+        return array(solution) if solution is not None else None
+
+    def save(self,filename=None):
+        if filename is None:
+            filename = self.filename
+        try:
+            os.makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        tempfilename = filename+'.tmp'
+        pickle.dump(self.results.items(),open(tempfilename,'wb'),pickle.HIGHEST_PROTOCOL)
+        os.rename(tempfilename,filename)
+        log.info('saved %d ik results to %s',len(self.results),filename)
+
+    def load(self,filename=None):
+        if filename is None:
+            filename = self.filename
+        try:
+            items = pickle.load(open(filename,'rb'))
+            self.results = OrderedDict(items[-self.maxsize:] if self.maxsize > 0 else [])
+            log.info('loaded %d ik results from %s',len(self.results),filename)
+            return True
+        except Exception,e:
+            log.warn('failed to load ik cache %s: %s',filename,e)
+            return False
+
+class IkFastCompiler(object):
+    """Compiles generated ikfast sources into shared objects and caches them.
+
+    Every shared object is stored in cachedir under a hash of the source, ikfast.h, the compiler, and all the compile and link options, so a byte-identical source is only compiled once no matter which database directory it was generated into. The default cachedir is $OPENRAVE_IKFAST_CACHE, or ikfastcache inside the openrave home directory.
+
+    Profile-guided optimization (gcc only) is done in two steps: compile with profile='generate', run the ik solver on a representative set of queries, then compile with profile='use'. The profile data is kept in cachedir/profiles/ indexed by the source hash.
+    """
+    def __init__(self,cachedir=None):
+        if cachedir is None:
+            cachedir = os.environ.get('OPENRAVE_IKFAST_CACHE',None)
+            if cachedir is None:
+                cachedir = os.path.join(RaveGetHomeDirectory(),'ikfastcache')
+        self.cachedir = cachedir
+
+    @staticmethod
+    def _hashfile(filename,h):
+        f = open(filename,'rb')
+        try:
+            while True:
+                data = f.read(1<<20)
+                if len(data) == 0:
+                    break
+                h.update(data)
+        finally:
+            f.close()
+
+    def getProfileDirectory(self,sourcefilename):
+        h = hashlib.sha1()
+        self._hashfile(sourcefilename,h)
+        return os.path.join(self.cachedir,'profiles',h.hexdigest())
+
+    def getCompileOptions(self,sourcefilename,usinglapack=False,profile=None):
+        """Returns (compiler,compile_flags,link_flags,libraries) used to compile sourcefilename"""
+        compiler,compile_flags = InverseKinematicsModel.getcompiler()
+        link_flags = []
+        if profile is not None:
+            if compiler.compiler_type != 'unix':
+                log.warn('profile-guided optimization is not supported by the %s compiler, ignoring it',compiler.compiler_type)
+            elif profile == 'generate':
+                profiledir = self.getProfileDirectory(sourcefilename)
+                compile_flags = compile_flags + ['-fprofile-generate=%s'%profiledir]
+                link_flags = ['-fprofile-generate=%s'%profiledir]
+            elif profile == 'use':
+                profiledir = self.getProfileDirectory(sourcefilename)
+                if not os.path.isdir(profiledir):
+                    log.warn('no profile data in %s, compile with profile=generate and run the solver first',profiledir)
+                else:
+                    compile_flags = compile_flags + ['-fprofile-use=%s'%profiledir,'-fprofile-correction']
+            else:
+                raise ValueError('unknown profile mode %s'%profile)
+        iswindows = sys.platform.startswith('win') or platform.system().lower() == 'windows'
+        libraries = None
+        if usinglapack or not iswindows:
+            # because some parts of ikfast require lapack, always try to link with it
+            libraries = ['lapack']
+        return compiler,compile_flags,link_flags,libraries
+
+    _compilerversions = dict()
+    @staticmethod
+    def getCompilerVersion(compiler):
+        """Returns the output of 'compiler --version' for the executable of the distutils compiler, or an empty string if it cannot be run (ie msvc)."""
+        executable = getattr(compiler,'compiler_so',None)
+        if executable is None or len(executable) == 0:
+            return ''
+        executable = executable[0]
+        version = IkFastCompiler._compilerversions.get(executable,None)
+        if version is None:
+            try:
+                version = subprocess.Popen([executable,'--version'],stdout=subprocess.PIPE,stderr=subprocess.STDOUT).communicate()[0]
+            except OSError,e:
+                log.warn('failed to get the version of compiler %s: %s',executable,e)
+                version = ''
+            IkFastCompiler._compilerversions[executable] = version
+        return version
+
+    def getCacheFilename(self,sourcefilename,compiler,compile_flags,link_flags,libraries):
+        h = hashlib.sha1()
+        self._hashfile(sourcefilename,h)
+        headerfilename = os.path.join(os.path.split(sourcefilename)[0],'ikfast.h')
+        if os.path.isfile(headerfilename):
+            self._hashfile(headerfilename,h)
+        h.update(repr((compiler.compiler_type,getattr(compiler,'compiler_so',None),getattr(compiler,'linker_so',None),compiler.libraries,compile_flags,link_flags,libraries,sys.platform,platform.machine())))
+        # the executable name stays the same across compiler upgrades
+        h.update(self.getCompilerVersion(compiler))
+        for flag in compile_flags:
+            if flag.startswith('-fprofile-use='):
+                # recompile whenever the profile changes
+                profiledir = flag[len('-fprofile-use='):]
+                for root,dirs,files in os.walk(profiledir):
+                    for filename in sorted(files):
+                        self._hashfile(os.path.join(root,filename),h)
+        return os.path.join(self.cachedir,compiler.shared_object_filename(basename=h.hexdigest()))
+
+    def compile(self,sourcefilename,output_filename,usinglapack=False,profile=None):
+        """Compiles sourcefilename into the shared object output_filename, or copies it from the cache if it was already compiled with the same options.
+
+        output_filename is replaced by a rename, so a library that is already loaded from it stays valid.
+        :param profile: None, 'generate', or 'use' for profile-guided optimization
+        :return: True if the shared object was taken from the cache
+        """
+        compiler,compile_flags,link_flags,libraries = self.getCompileOptions(sourcefilename,usinglapack,profile)
+        cachedfilename = self.getCacheFilename(sourcefilename,compiler,compile_flags,link_flags,libraries)
+        try:
+            os.makedirs(os.path.split(output_filename)[0])
+        except OSError:
+            pass
+        if os.path.isfile(cachedfilename):
+            log.info('using cached shared object %s for %s',cachedfilename,sourcefilename)
+            self._copyfile(cachedfilename,output_filename)
+            return True
+
+        starttime = time.time()
+        try:
+            output_dir = os.path.relpath('/',getcwd())
+        except AttributeError: # python 2.5 does not have os.path.relpath
+            output_dir = relpath('/',getcwd())
+        # the object files are named after the source, so copy it next to the output to prevent interference between different architectures and parallel jobs
+        platformsourcefilename = os.path.splitext(output_filename)[0]+'.cpp'
+        if os.path.abspath(platformsourcefilename) != os.path.abspath(sourcefilename):
+            shutil.copyfile(sourcefilename, platformsourcefilename)
+        tempfilename = self._mktemp(output_filename)
+        # the temporary output file already exists, so distutils would skip the link as up-to-date
+        compiler.force = True
+        objectfiles=[]
+        try:
+            objectfiles = compiler.compile(sources=[platformsourcefilename],macros=[('IKFAST_CLIBRARY',1),('IKFAST_NO_MAIN',1)],include_dirs=[os.path.split(sourcefilename)[0]],extra_postargs=compile_flags,output_dir=output_dir)
+            try:
+                compiler.link_shared_object(objectfiles,output_filename=tempfilename, libraries=libraries, extra_postargs=link_flags)
+            except distutils.errors.LinkError,e:
+                log.warn(e)
+                if libraries is not None and 'lapack' in libraries:
+                    libraries.remove('lapack')
+                    if len(libraries) == 0:
+                        libraries = None
+                log.info('linking again with %r... (MSVC bug?)',libraries)
+                compiler.link_shared_object(objectfiles,output_filename=tempfilename, libraries=libraries, extra_postargs=link_flags)
+            os.rename(tempfilename,output_filename)
+        finally:
+            # cleanup intermediate files
+            if os.path.abspath(platformsourcefilename) != os.path.abspath(sourcefilename) and os.path.isfile(platformsourcefilename):
+                remove(platformsourcefilename)
+            for filename in objectfiles+[tempfilename]:
+                try:
+                    remove(filename)
+                except:
+                    pass
+        log.info('compiled %s in %fs',output_filename,time.time()-starttime)
+        try:
+            self._copyfile(output_filename,cachedfilename)
+        except (IOError,OSError),e:
+            log.warn('failed to cache %s: %s',output_filename,e)
+        return False
+
+    def compileMany(self,jobs,numprocesses=None,profile=None):
+        """Compiles several sources in parallel.
+
+        :param jobs: list of (sourcefilename,output_filename,usinglapack)
+        :param numprocesses: number of simultaneous compiler processes, default is the number of cpus
+        :return: list of the :meth:`compile` results in the order of jobs
+        """
+        from multiprocessing import cpu_count
+        from multiprocessing.pool import ThreadPool
+        if numprocesses is None:
+            numprocesses = cpu_count()
+        if numprocesses <= 1 or len(jobs) <= 1:
+            return [self.compile(sourcefilename,output_filename,usinglapack,profile) for sourcefilename,output_filename,usinglapack in jobs]
+        # the work is done by the compiler processes, so threads are enough to run them in parallel
+        pool = ThreadPool(min(numprocesses,len(jobs)))
+        try:
+            return pool.map(lambda job: self.compile(job[0],job[1],job[2],profile),jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _mktemp(filename):
+        """returns a new temporary filename in the directory of filename, unique across processes and threads"""
+        fd,tempfilename = tempfile.mkstemp(suffix='.tmp',prefix=os.path.split(filename)[1]+'.',dir=os.path.split(filename)[0])
+        os.close(fd)
+        return tempfilename
+
+    @staticmethod
+    def _copyfile(srcfilename,dstfilename):
+        """copies through a temporary file and a rename, so that readers never see a partial file"""
+        try:
+            os.makedirs(os.path.split(dstfilename)[0])
+        except OSError:
+            pass
+        tempfilename = IkFastCompiler._mktemp(dstfilename)
+        shutil.copyfile(srcfilename,tempfilename)
+        shutil.copymode(srcfilename,tempfilename)
+        try:
+            os.rename(tempfilename,dstfilename)
+        except OSError:
+            # windows cannot rename over an existing file
+            remove(dstfilename)
+            os.rename(tempfilename,dstfilename)
+
 class InverseKinematicsModel(DatabaseGenerator):
     """Generates analytical inverse-kinematics solutions, compiles them into a shared object/DLL, and sets the robot's iksolver. Only generates the models for the robot's active manipulator. To generate IK models for each manipulator in the robot, mulitple InverseKinematicsModel classes have to be created.
     """
@@ -204,6 +497,8 @@ class InverseKinematicsModel(DatabaseGenerator):
         :param forceikfast: if set will always force the ikfast solver
         """
         self.ikfastproblem = None
+        self._iklibrary = None # (filename,ctypes library,dtype) returned by getIkLibrary
+        self.ikcompiler = IkFastCompiler()
         if manip is not None:
             robot = manip.GetRobot()
         else:
@@ -431,6 +726,10 @@ class InverseKinematicsModel(DatabaseGenerator):
         basename += '.' + outputlang
         return RaveFindDatabaseFile(os.path.join('kinematics.'+self.manip.GetKinematicsStructureHash(),basename),read)
 
+    def getmemofilename(self,read=False):
+        """returns the file of memoized ikfast symbolic results, shared by all robots"""
+        return RaveFindDatabaseFile(os.path.join('kinematics.memo','ikfast%s.memo.pp'%self.getversion()),read)
+
     def getstatsfilename(self,read=False):
         if self.iktype is None:
             raise ValueError('ik type is not set')
@@ -477,7 +776,15 @@ class InverseKinematicsModel(DatabaseGenerator):
         outputlang = None
         ipython = None
         freeinc = None
+        parallelsearch = None
+        usememocache = False
+        profileoptimization = False
         if options is not None:
+            if getattr(options,'numthreads',None) is not None:
+                self.numthreads = options.numthreads
+            parallelsearch = getattr(options,'parallelsearch',None)
+            usememocache = getattr(options,'memocache',False)
+            profileoptimization = getattr(options,'profileoptimization',False)
             forceikbuild=options.force
             precision=options.precision
             if options.freejoints is not None:
@@ -514,7 +821,9 @@ class InverseKinematicsModel(DatabaseGenerator):
                 freejoints = [self.robot.GetJoints()[ind].GetName() for ind in self.manip.GetArmIndices()[3:]]
             if iktype==None:
                 iktype == IkParameterizationType.TranslationDirection5D
-        self.generate(iktype=iktype,freejoints=freejoints,precision=precision,forceikbuild=forceikbuild,outputlang=outputlang,ipython=ipython)
+        self.generate(iktype=iktype,freejoints=freejoints,precision=precision,forceikbuild=forceikbuild,outputlang=outputlang,ipython=ipython,parallelsearch=parallelsearch,usememocache=usememocache)
+        if profileoptimization and self.ikfeasibility is None:
+            self.compileWithProfile()
         self.save()
 
     def getIndicesFromJointNames(self,freejoints):
@@ -533,11 +842,181 @@ class InverseKinematicsModel(DatabaseGenerator):
         print 'getIndicesFromJointNames',freeindices,freejoints
         return freeindices
 
-    def generate(self,iktype=None,freejoints=None,freeinc=None,freeindices=None,precision=None,forceikbuild=True,outputlang=None,ipython=False):
+    def generate(self,iktype=None,freejoints=None,freeinc=None,freeindices=None,precision=None,forceikbuild=True,outputlang=None,ipython=False,parallelsearch=None,usememocache=False,compilesource=True,profile=None):
+        """
+        :param compilesource: if False, only writes the generated source, which can then be compiled with :meth:`compile` or :meth:`CompileParallel`
+        :param profile: profile-guided optimization mode passed to :meth:`IkFastCompiler.compile`
+        :param usememocache: if True, loads the memoized symbolic results of previous ikfast runs from the database directory before generating and saves them back afterwards
+        :param parallelsearch: if 'first' or 'simplest', runs ikfast for the candidate free indices and coupled variable solve methods in parallel worker processes (see :attr:`numthreads`) and keeps either the first successful solver or the one with the smallest generated code. If the free indices are not specified, all possible free indices are candidates.
+        """
         if iktype is not None:
             self.iktype = iktype
         if self.iktype is None:
             self.iktype = iktype = IkParameterizationType.Transform6D
+        solvefn = self._getSolveFn()
+
+        dofexpected = IkParameterization.GetDOFFromType(self.iktype)
+        if freeindices is not None:
+            self.freeindices = freeindices
+        memocache = None
+        if usememocache and hasattr(self.ikfast,'MemoCache'):
+            # memoization is only enabled for the duration of this generation
+            memocache = self.ikfast.MemoCache()
+            memofilename = self.getmemofilename(False)
+            if os.path.isfile(memofilename):
+                memocache.load(memofilename)
+            self.ikfast.IKFastSolver.memocache = memocache
+        try:
+            searchresult = None
+            if parallelsearch is not None and forceikbuild and not ipython:
+                if self.freeindices is None and freejoints is not None:
+                    self.freeindices = self.getIndicesFromJointNames(freejoints)
+                searchresult = self._searchIkSolverParallel(precision,outputlang if outputlang is not None else 'cpp',parallelsearch)
+                if searchresult is not None:
+                    self.freeindices = searchresult[0]
+            if self.freeindices is None:
+                if freejoints is not None:
+                    self.freeindices = self.getIndicesFromJointNames(freejoints)
+                else:
+                    self.solveindices,self.freeindices = self.getDefaultIndices()
+            self.solveindices = [i for i in self.manip.GetArmIndices() if not i in self.freeindices]
+            if len(self.solveindices) != dofexpected:
+                raise ValueError('number of joints to solve for is not equal to required joints %d!=%d'%(len(self.solveindices),dofexpected))
+
+            if freeinc is not None:
+                self.freeinc = freeinc
+            if self.freeinc is None:
+                self.freeinc = self.getDefaultFreeIncrements(0.1,0.01)
+        
+            log.info('Generating inverse kinematics for manip %s: %s %s (this might take up to 10 min)',self.manip.GetName(),self.iktype,self.solveindices)
+            if outputlang is None:
+                outputlang = 'cpp'
+            sourcefilename = self.getsourcefilename(False,outputlang)
+            statsfilename = self.getstatsfilename(False)
+            output_filename = self.getfilename(False)
+            sourcedir = os.path.split(sourcefilename)[0]
+            if forceikbuild or not os.path.isfile(sourcefilename):
+                log.info('creating ik file %s',sourcefilename)
+                try:
+                    os.makedirs(sourcedir)
+                except OSError:
+                    pass
+            
+                solver = self.ikfast.IKFastSolver(kinbody=self.robot,kinematicshash=self.manip.GetKinematicsStructureHash(),precision=precision)
+                solver.useleftmultiply = self._useLeftMultiply()
+                baselink=self.manip.GetBase().GetIndex()
+                eelink=self.manip.GetEndEffector().GetIndex()
+                if ipython:
+                    # requires ipython v0.11+
+                    IPython = __import__('IPython')
+                    if IPython.__version__.startswith("0.10"):
+                        ipshell = IPython.Shell.IPShellEmbed(argv='',banner = 'inversekinematics dropping into ipython',exit_msg = 'Leaving Interpreter and continuing solver.')
+                        ipshell(local_ns=locals())
+                    else:
+                        m=__import__('IPython.config.loader',fromlist=['Config'])
+                        Config = getattr(m,'Config')
+                        cfg = Config()
+                        cfg.InteractiveShellEmbed.local_ns = locals()
+                        cfg.InteractiveShellEmbed.global_ns = globals()
+                        IPython.embed(config=cfg, banner2 = 'inversekinematics dropping into ipython')
+                        from IPython.frontend.terminal.embed import InteractiveShellEmbed
+                        ipshell = InteractiveShellEmbed(config=cfg)
+                    reload(self.ikfast) # in case changes occurred
+                
+                try:
+                    generationstart = time.time()
+                    if searchresult is not None:
+                        freeindices,code,usinglapack,generationtime = searchresult
+                    else:
+                        chaintree = solver.generateIkSolver(baselink=baselink,eelink=eelink,freeindices=self.freeindices,solvefn=solvefn)
+                        code = solver.writeIkSolver(chaintree,lang=outputlang)
+                        usinglapack = solver.usinglapack
+                        generationtime = time.time()-generationstart
+                    self.ikfeasibility = None
+                    if len(code) == 0:
+                        raise ValueError('failed to generate ik solver for robot %s:%s'%(self.robot.GetName(),self.manip.GetName()))
+                
+                    self.statistics['generationtime'] = generationtime
+                    self.statistics['usinglapack'] = usinglapack
+                    open(sourcefilename,'w').write(code)
+                    try:
+                        from pkg_resources import resource_filename
+                        shutil.copyfile(resource_filename('openravepy','ikfast.h'), os.path.join(sourcedir,'ikfast.h'))
+                    except ImportError,e:
+                        log.warn(e)                    
+                except self.ikfast.IKFastSolver.IKFeasibilityError, e:
+                    self.ikfeasibility = str(e)
+                    log.warn(e)
+        finally:
+            if memocache is not None:
+                memocache.save(memofilename)
+                self.ikfast.IKFastSolver.memocache = None
+
+        if self.ikfeasibility is None:
+            if outputlang == 'cpp':
+                if compilesource:
+                    self.compile(profile=profile)
+                    if not self.setrobot():
+                        return ValueError('failed to generate ik solver')
+            else:
+                log.warn('cannot continue further if outputlang %s is not cpp',outputlang)
+        
+    def compile(self,profile=None):
+        """Compiles the generated cpp source into the shared object through :attr:`ikcompiler`, reusing a cached shared object if the source did not change.
+
+        :return: True if the shared object was taken from the cache
+        """
+        sourcefilename,output_filename,usinglapack = self._getCompileJob()
+        return self.ikcompiler.compile(sourcefilename,output_filename,usinglapack,profile)
+
+    def _getCompileJob(self):
+        sourcefilename = self.getsourcefilename(False,'cpp')
+        if not os.path.isfile(sourcefilename):
+            sourcefilename = self.getsourcefilename(True,'cpp')
+        return sourcefilename,self.getfilename(False),self.statistics.get('usinglapack',False)
+
+    def compileWithProfile(self,num=2000):
+        """Recompiles the generated source with profile-guided optimization. Builds an instrumented shared object, records the profile by timing num random ik queries with it, and builds the final shared object using the profile.
+
+        The instrumented shared object is timed from a copy with a temporary filename, since loading it from the path of the already loaded solver would return the uninstrumented library. It is still compiled to the output filename so that its object file, which names the profile data, matches the one of the final build.
+        """
+        sourcefilename,output_filename,usinglapack = self._getCompileJob()
+        profiledir = self.ikcompiler.getProfileDirectory(sourcefilename)
+        if os.path.isdir(profiledir):
+            # stale profile data would hide a run that did not write any
+            shutil.rmtree(profiledir)
+        self.ikcompiler.compile(sourcefilename,output_filename,usinglapack,'generate')
+        basename,ext = os.path.splitext(os.path.split(output_filename)[1])
+        fd,instrumentedfilename = tempfile.mkstemp(suffix=ext,prefix=basename+'.profile.',dir=os.path.split(output_filename)[0])
+        os.close(fd)
+        try:
+            shutil.copyfile(output_filename,instrumentedfilename)
+            # PerfTiming loads and unloads its own copy of the library, which writes out the profile
+            self.perftiming(num,filename=instrumentedfilename)
+        finally:
+            try:
+                remove(instrumentedfilename)
+            except OSError:
+                pass
+        if not os.path.isdir(profiledir) or not any(len(files) > 0 for root,dirs,files in os.walk(profiledir)):
+            raise ValueError('running the instrumented ik solver %s did not write any profile data to %s'%(instrumentedfilename,profiledir))
+        self.compile(profile='use')
+        return self.setrobot()
+
+    @staticmethod
+    def CompileParallel(ikmodels,numprocesses=None,profile=None):
+        """Compiles the generated sources of several models (ie models generated with compilesource=False) with parallel compiler processes and sets their ik solvers."""
+        if len(ikmodels) == 0:
+            return []
+        jobs = [ikmodel._getCompileJob() for ikmodel in ikmodels]
+        cached = ikmodels[0].ikcompiler.compileMany(jobs,numprocesses,profile)
+        for ikmodel in ikmodels:
+            if not ikmodel.setrobot():
+                log.warn('failed to set ik solver of manipulator %s',ikmodel.manip.GetName())
+        return cached
+
+    def _getSolveFn(self):
+        """returns the ikfast solve function for :attr:`iktype`"""
         if self.iktype == IkParameterizationType.Rotation3D:
             Rbaseraw=self.manip.GetLocalToolTransform()[0:3,0:3]
             def solveFullIK_Rotation3D(*args,**kwargs):
@@ -665,129 +1144,183 @@ class InverseKinematicsModel(DatabaseGenerator):
             solvefn=solveFullIK_TranslationZAxisAngleYNorm4D
         else:
             raise ValueError('bad type')
+        return solvefn
 
-        dofexpected = IkParameterization.GetDOFFromType(self.iktype)
-        if freeindices is not None:
-            self.freeindices = freeindices
-        if self.freeindices is None:
-            if freejoints is not None:
-                self.freeindices = self.getIndicesFromJointNames(freejoints)
-            else:
-                self.solveindices,self.freeindices = self.getDefaultIndices()
-        self.solveindices = [i for i in self.manip.GetArmIndices() if not i in self.freeindices]
-        if len(self.solveindices) != dofexpected:
-            raise ValueError('number of joints to solve for is not equal to required joints %d!=%d'%(len(self.solveindices),dofexpected))
+    def _useLeftMultiply(self):
+        return not self.iktype in [IkParameterizationType.TranslationXAxisAngle4D, IkParameterizationType.TranslationYAxisAngle4D, IkParameterizationType.TranslationZAxisAngle4D, IkParameterizationType.TranslationXAxisAngleZNorm4D, IkParameterizationType.TranslationYAxisAngleXNorm4D, IkParameterizationType.TranslationZAxisAngleYNorm4D]
 
-        if freeinc is not None:
-            self.freeinc = freeinc
-        if self.freeinc is None:
-            self.freeinc = self.getDefaultFreeIncrements(0.1,0.01)
+    def _searchIkSolverParallel(self,precision,outputlang,parallelsearch):
+        """Generates the ik solver for every candidate (freeindices, coupledsolvemethods) pair in worker processes.
+
+        The workers are fresh python processes of :class:`_ParallelWorkerPool` that load a saved copy of the environment and construct their own model, so only the ik type name, kinematics hash, precision, output language and candidates are sent to them. Every worker generates one candidate at a time and the results come back in candidate order.
+
+        :param parallelsearch: 'first' keeps the first successful candidate (in the candidate order) and terminates the rest, 'simplest' waits for all candidates and keeps the one with the smallest generated code
+        :return: (freeindices,code,usinglapack,generationtime) of the chosen candidate, None if all candidates failed.
+        """
+        from multiprocessing import cpu_count
+        from . import _ParallelWorkerPool
+        if not parallelsearch in ['first','simplest']:
+            raise ValueError('unknown parallel search mode %s'%parallelsearch)
         
-        log.info('Generating inverse kinematics for manip %s: %s %s (this might take up to 10 min)',self.manip.GetName(),self.iktype,self.solveindices)
-        if outputlang is None:
-            outputlang = 'cpp'
-        sourcefilename = self.getsourcefilename(False,outputlang)
-        statsfilename = self.getstatsfilename(False)
-        output_filename = self.getfilename(False)
-        sourcedir = os.path.split(sourcefilename)[0]
-        if forceikbuild or not os.path.isfile(sourcefilename):
-            log.info('creating ik file %s',sourcefilename)
-            try:
-                os.makedirs(sourcedir)
-            except OSError:
-                pass
-            
-            solver = self.ikfast.IKFastSolver(kinbody=self.robot,kinematicshash=self.manip.GetKinematicsStructureHash(),precision=precision)
-            if self.iktype == IkParameterizationType.TranslationXAxisAngle4D or self.iktype == IkParameterizationType.TranslationYAxisAngle4D or self.iktype == IkParameterizationType.TranslationZAxisAngle4D or self.iktype == IkParameterizationType.TranslationXAxisAngleZNorm4D or self.iktype == IkParameterizationType.TranslationYAxisAngleXNorm4D or self.iktype == IkParameterizationType.TranslationZAxisAngleYNorm4D:
-                solver.useleftmultiply = False
-            baselink=self.manip.GetBase().GetIndex()
-            eelink=self.manip.GetEndEffector().GetIndex()
-            if ipython:
-                # requires ipython v0.11+
-                IPython = __import__('IPython')
-                if IPython.__version__.startswith("0.10"):
-                    ipshell = IPython.Shell.IPShellEmbed(argv='',banner = 'inversekinematics dropping into ipython',exit_msg = 'Leaving Interpreter and continuing solver.')
-                    ipshell(local_ns=locals())
-                else:
-                    m=__import__('IPython.config.loader',fromlist=['Config'])
-                    Config = getattr(m,'Config')
-                    cfg = Config()
-                    cfg.InteractiveShellEmbed.local_ns = locals()
-                    cfg.InteractiveShellEmbed.global_ns = globals()
-                    IPython.embed(config=cfg, banner2 = 'inversekinematics dropping into ipython')
-                    from IPython.frontend.terminal.embed import InteractiveShellEmbed
-                    ipshell = InteractiveShellEmbed(config=cfg)
-                reload(self.ikfast) # in case changes occurred
-                
+        dofexpected = IkParameterization.GetDOFFromType(self.iktype)
+        if self.freeindices is not None:
+            allfreeindices = [list(self.freeindices)]
+        else:
+            # start with the default indices since they are the most likely to succeed
+            allfreeindices = [self.getDefaultIndices()[1]]
+            for freeindices in self.ikfast.permutations(self.manip.GetArmIndices(),len(self.manip.GetArmIndices())-dofexpected):
+                if not sorted(freeindices) in [sorted(f) for f in allfreeindices]:
+                    allfreeindices.append(list(freeindices))
+        allsolvemethods = [None]
+        if self.iktype == IkParameterizationType.Transform6D or self.iktype == IkParameterizationType.TranslationDirection5D:
+            # try every method first for the coupled variables
+            defaultsolvemethods = ['solveLiWoernleHiller','solveKohliOsvatic','solveManochaCanny']
+            allsolvemethods = [defaultsolvemethods[i:]+defaultsolvemethods[:i] for i in range(len(defaultsolvemethods))]
+        candidates = [(list(freeindices),solvemethods) for freeindices in allfreeindices for solvemethods in allsolvemethods]
+        numprocesses = min(len(candidates),self.numthreads if self.numthreads is not None and self.numthreads > 1 else cpu_count())
+        log.info('searching %d ik candidates for manip %s with %d processes',len(candidates),self.manip.GetName(),numprocesses)
+        searchstart = time.time()
+        best = None
+        errors = []
+        pool = _ParallelWorkerPool(self,numprocesses,(self.iktype.name,self.manip.GetKinematicsStructureHash(),precision,outputlang),{})
+        try:
+            for (candidate,code,usinglapack,error), in pool.imap([candidate] for candidate in candidates):
+                if code is None or len(code) == 0:
+                    log.info('ik candidate free=%s methods=%s failed: %s',candidate[0],candidate[1],error)
+                    errors.append(error)
+                    continue
+                log.info('ik candidate free=%s methods=%s succeeded with %d bytes of code',candidate[0],candidate[1],len(code))
+                if best is None or len(code) < len(best[1]):
+                    best = (candidate[0],code,usinglapack)
+                if parallelsearch == 'first':
+                    break
+        finally:
+            pool.terminate()
+        if best is None:
+            log.warn('all %d ik candidates failed, generating serially: %s',len(candidates),errors)
+            return None
+        return best+(time.time()-searchstart,)
+
+    def generateconsumer(self,iktypename,kinematicshash,precision,outputlang):
+        """Returns the function generating the ik solver code of one (freeindices, coupledsolvemethods) candidate. Used by the worker processes of :meth:`_searchIkSolverParallel`.
+
+        :param iktypename: the name of the IkParameterizationType to generate
+        :param kinematicshash: the kinematics hash of the manipulator in the generating process, which the worker's copy of the environment might not reproduce exactly
+        """
+        self.iktype = IkParameterizationType.names[iktypename]
+        solvefn = self._getSolveFn()
+        baselink = self.manip.GetBase().GetIndex()
+        eelink = self.manip.GetEndEffector().GetIndex()
+        def consumer(freeindices,solvemethods):
             try:
-                generationstart = time.time()
-                chaintree = solver.generateIkSolver(baselink=baselink,eelink=eelink,freeindices=self.freeindices,solvefn=solvefn)
-                self.ikfeasibility = None
+                solver = self.ikfast.IKFastSolver(kinbody=self.robot,kinematicshash=kinematicshash,precision=precision)
+                solver.useleftmultiply = self._useLeftMultiply()
+                if solvemethods is not None:
+                    solver.coupledsolvemethods = solvemethods
+                chaintree = solver.generateIkSolver(baselink=baselink,eelink=eelink,freeindices=freeindices,solvefn=solvefn)
                 code = solver.writeIkSolver(chaintree,lang=outputlang)
-                if len(code) == 0:
-                    raise ValueError('failed to generate ik solver for robot %s:%s'%(self.robot.GetName(),self.manip.GetName()))
-                
-                self.statistics['generationtime'] = time.time()-generationstart
-                self.statistics['usinglapack'] = solver.usinglapack
-                open(sourcefilename,'w').write(code)
-                try:
-                    from pkg_resources import resource_filename
-                    shutil.copyfile(resource_filename('openravepy','ikfast.h'), os.path.join(sourcedir,'ikfast.h'))
-                except ImportError,e:
-                    log.warn(e)                    
-            except self.ikfast.IKFastSolver.IKFeasibilityError, e:
-                self.ikfeasibility = str(e)
-                log.warn(e)
-
-        if self.ikfeasibility is None:
-            if outputlang == 'cpp':
-                # compile the code and create the shared object
-                compiler,compile_flags = self.getcompiler()
-                try:
-                   output_dir = os.path.relpath('/',getcwd())
-                except AttributeError: # python 2.5 does not have os.path.relpath
-                   output_dir = relpath('/',getcwd())
+                return (freeindices,solvemethods),code,solver.usinglapack,None
+            except Exception, e:
+                return (freeindices,solvemethods),None,False,str(e)
+        return consumer
 
-                platformsourcefilename = os.path.splitext(output_filename)[0]+'.cpp' # needed in order to prevent interference with machines with different architectures 
-                shutil.copyfile(sourcefilename, platformsourcefilename)
-                objectfiles=[]
-                try:
-                    objectfiles = compiler.compile(sources=[platformsourcefilename],macros=[('IKFAST_CLIBRARY',1),('IKFAST_NO_MAIN',1)],extra_postargs=compile_flags,output_dir=output_dir)
-                    # because some parts of ikfast require lapack, always try to link with it
-                    try:
-                        iswindows = sys.platform.startswith('win') or platform.system().lower() == 'windows'
-                        libraries = None
-                        if self.statistics.get('usinglapack',False) or not iswindows:
-                            libraries = ['lapack']
-                        compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
-                    except distutils.errors.LinkError,e:
-                        log.warn(e)
-                        if libraries is not None and 'lapack' in libraries:
-                            libraries.remove('lapack')
-                            if len(libraries) == 0:
-                                libraries = None
-                        log.info('linking again with %r... (MSVC bug?)',libraries)
-                        compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
-                        
-                    if not self.setrobot():
-                        return ValueError('failed to generate ik solver')
-                finally:
-                    # cleanup intermediate files
-                    if os.path.isfile(platformsourcefilename):
-                        remove(platformsourcefilename)
-                    for objectfile in objectfiles:
-                        try:
-                            remove(objectfile)
-                        except:
-                            pass
-            else:
-                log.warn('cannot continue further if outputlang %s is not cpp',outputlang)
-        
-    def perftiming(self,num):
+    def perftiming(self,num,batch=0,filename=None):
+        """:param batch: if > 0, times ComputeIkBatch on batches of this many poses and returns the average time of one pose for every batch
+        :param filename: the ikfast shared object to time, by default the one of this model
+        """
+        if filename is None:
+            filename = self.getfilename(True)
         with self.env:
-            results = self.ikfastproblem.SendCommand('PerfTiming num %d %s'%(num,self.getfilename(True)))
+            results = self.ikfastproblem.SendCommand('PerfTiming num %d batch %d %s'%(num,batch,filename))
             return [double(s)*1e-9 for s in results.split()]
+
+    def getIkLibrary(self):
+        """Returns (library,dtype), where library is a ctypes handle of the compiled ikfast shared object and dtype is the numpy type of its IkReal.
+        """
+        filename = self.getfilename(True)
+        if len(filename) == 0:
+            raise ValueError('ikfast shared object of manipulator %s has not been generated'%self.manip.GetName())
+        if self._iklibrary is None or self._iklibrary[0] != filename:
+            library = ctypes.CDLL(filename)
+            if not hasattr(library,'ComputeIkBatch') or not hasattr(library,'ComputeFkBatch'):
+                raise ValueError('%s does not export ComputeIkBatch and ComputeFkBatch, it needs to be regenerated'%filename)
+            library.GetNumJoints.restype = ctypes.c_int
+            library.GetNumFreeParameters.restype = ctypes.c_int
+            library.GetIkRealSize.restype = ctypes.c_int
+            library.ComputeIkBatch.restype = ctypes.c_int
+            library.ComputeFkBatch.restype = None
+            self._iklibrary = (filename,library,float32 if library.GetIkRealSize() == 4 else float64)
+        return self._iklibrary[1:]
+
+    def computeIkBatch(self,eetrans,eerot,free=None,maxsolutions=16):
+        """Calls ComputeIkBatch of the ikfast shared object on N end effector coordinates in one call.
+
+        The coordinates are in the frame of the manipulator base and the solutions are not checked for joint limits or collisions, ie the same as calling the raw ikfast ComputeIk for every pose. Use :meth:`solveBatch` for solutions filtered by the ik solver.
+        :param eetrans: (N,3) translations
+        :param eerot: (N,9) or (N,3,3) rotation values
+        :param free: (N,numfree) free joint values, can be None if there are no free joints
+        :return: (numsolutions,solutions). numsolutions is an array of the number of solutions of every pose, solutions is a (N,maxsolutions,numjoints) array (nan where there is no solution).
+        """
+        library,dtype = self.getIkLibrary()
+        eetrans = reshape(array(eetrans,dtype),(-1,3))
+        num = len(eetrans)
+        numjoints = library.GetNumJoints()
+        numfree = library.GetNumFreeParameters()
+        # ComputeIkBatch takes structure-of-arrays
+        eetranssoa = ascontiguousarray(transpose(eetrans))
+        eerotsoa = ascontiguousarray(transpose(reshape(array(eerot,dtype),(num,9))))
+        freesoa = ascontiguousarray(transpose(reshape(array(free,dtype),(num,numfree)))) if numfree > 0 else None
+        numsolutions = zeros(num,int32)
+        solutions = tile(array(nan,dtype),(num,maxsolutions,numjoints))
+        library.ComputeIkBatch(ctypes.c_int(num),eetranssoa.ctypes.data_as(ctypes.c_void_p),eerotsoa.ctypes.data_as(ctypes.c_void_p),freesoa.ctypes.data_as(ctypes.c_void_p) if freesoa is not None else None,ctypes.c_int(maxsolutions),solutions.ctypes.data_as(ctypes.c_void_p),numsolutions.ctypes.data_as(ctypes.c_void_p))
+        return numsolutions,solutions
+
+    def computeFkBatch(self,joints):
+        """Calls ComputeFkBatch of the ikfast shared object on a (N,numjoints) array of joint values.
+
+        :return: (eetrans,eerot) as (N,3) and (N,9) arrays in the frame of the manipulator base
+        """
+        library,dtype = self.getIkLibrary()
+        numjoints = library.GetNumJoints()
+        joints = reshape(array(joints,dtype),(-1,numjoints))
+        num = len(joints)
+        jointssoa = ascontiguousarray(transpose(joints))
+        eetranssoa = zeros((3,num),dtype)
+        eerotsoa = zeros((9,num),dtype)
+        library.ComputeFkBatch(ctypes.c_int(num),jointssoa.ctypes.data_as(ctypes.c_void_p),eetranssoa.ctypes.data_as(ctypes.c_void_p),eerotsoa.ctypes.data_as(ctypes.c_void_p))
+        return transpose(eetranssoa),transpose(eerotsoa)
         
+    def solveBatch(self,poses,filteroptions=0,firstonly=True,returnsolutions=False):
+        """Solves the ik of many targets with Manipulator.FindIKSolutionsBatch, which reads the poses straight from the numpy array and loops over them in C++ with the GIL released.
+
+        :param poses: (N,4,4) array of transforms, (N,7) array of quaternion+translation poses, or a list of IkParameterization
+        :param firstonly: if True, only searches for the first solution of every target (like FindIKSolution), otherwise finds all the solutions of every target (like FindIKSolutions)
+        :param returnsolutions: if True, also returns the solutions, otherwise they are never copied out of the ik solver
+        :return: (numsolutions,solutions). numsolutions is an array of the number of solutions found for every target. If returnsolutions is False, solutions is None. Otherwise if firstonly is True, solutions is a (N,len(arm indices)) array holding the first solution of every target (nan if none), and if firstonly is False, it is a (sum(numsolutions),len(arm indices)) array of the solutions of all the targets in order.
+        """
+        if len(poses) > 0 and isinstance(poses[0],IkParameterization):
+            # other ik types cannot be packed into an array, so solve them one by one
+            numarm = len(self.manip.GetArmIndices())
+            numsolutions = zeros(len(poses),int32)
+            solutions = []
+            with self.env:
+                for i,ikparam in enumerate(poses):
+                    if firstonly:
+                        solution = self.manip.FindIKSolution(ikparam,filteroptions)
+                        numsolutions[i] = solution is not None
+                        solutions.append(solution if solution is not None else tile(nan,numarm))
+                    else:
+                        allsolutions = self.manip.FindIKSolutions(ikparam,filteroptions)
+                        numsolutions[i] = len(allsolutions)
+                        solutions += list(allsolutions)
+            if not returnsolutions:
+                return numsolutions,None
+            return numsolutions,reshape(array(solutions,float64),(-1,numarm))
+        poses = array(poses,float64)
+        if len(poses.shape) == 3:
+            poses = poseFromMatrices(poses)
+        return self.manip.FindIKSolutionsBatch(reshape(poses,(-1,7)),filteroptions,firstonly,returnsolutions)
+
     def testik(self,iktests):
         """Tests the iksolver.
         """
@@ -891,6 +1424,12 @@ class InverseKinematicsModel(DatabaseGenerator):
                           help='If specified, will output the generated code in that language (ie --outputlang=cpp).')
         parser.add_option('--ipython', '-i',action="store_true",dest='ipython',default=False,
                           help='if true will drop into the ipython interpreter right before ikfast is called')
+        parser.add_option('--memocache', action='store_true',dest='memocache',default=False,
+                          help='If set, reuses the symbolic results of previous ikfast runs stored in the database directory and stores the new ones.')
+        parser.add_option('--parallelsearch', action='store',type='string',dest='parallelsearch',default=None,
+                          help="If 'first' or 'simplest', generates the ik for all candidate free joints and solve methods in parallel processes (--numthreads) and keeps the first successful one or the one with the smallest code.")
+        parser.add_option('--profileoptimization', action='store_true',dest='profileoptimization',default=False,
+                          help='If set, recompiles the generated ik with profile-guided optimization using the timings of random ik queries (gcc only).')
         parser.add_option('--iktype', action='store',type='string',dest='iktype',default=None,
                           help='The ik type to build the solver current types are: %s'%(', '.join(iktype.name for iktype in IkParameterizationType.values.values() if not int(iktype) & IkParameterizationType.VelocityDataBit )))
         return parser
@@ -49,7 +49,7 @@ __author__ = 'Rosen Diankov'
 __copyright__ = 'Copyright (C) 2009-2010 Rosen Diankov (rosen.diankov@gmail.com)'
 __license__ = 'Apache License, Version 2.0'
 
-import time,bisect
+import time
 
 if not __openravepy_build_doc__:
     from numpy import *
@@ -65,6 +65,7 @@ from . import kinematicreachability, linkstatistics, inversekinematics
 import numpy
 import os.path
 from optparse import OptionParser
+from ..misc import OrderedDict
 
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
@@ -74,6 +75,61 @@ try:
 except ImportError:
     print 'could not import scipy.optimize.leastsq'
 
+class BaseDistributionCache(object):
+    """LRU cache of the equivalence class samples of :class:`InverseReachabilityModel` rotated around the z axis, along with their cumulative weights and kdtrees.
+
+    The rotation angles are bucketed by anglebucket, so one rotated point set serves all the grasps whose z rotation falls in the same bucket. The angles of the samples stay exact, only their xy offsets are rotated by the bucket angle. At most maxpoints samples are kept, counting the rotated samples of every entry along with the two copies (the scaled points and the kdtree's own storage) held by each of its kdtrees.
+    """
+    def __init__(self,maxpoints=2000000,anglebucket=0.001):
+        self.maxpoints = maxpoints
+        self.anglebucket = anglebucket
+        self.entries = OrderedDict()
+        self.numpoints = 0
+        self.hits = 0
+        self.misses = 0
+    def __len__(self):
+        return len(self.entries)
+    def clear(self):
+        self.entries.clear()
+        self.numpoints = 0
+    def get(self,equivalenceclasses,classindex,angle):
+        """returns the cache entry of the samples of equivalenceclasses[classindex] rotated by angle"""
+        angle = float(numpy.reshape(angle,-1)[0])
+        key = (classindex,int(round(angle/self.anglebucket)))
+        entry = self.entries.pop(key,None)
+        if entry is None:
+            self.misses += 1
+            bucketangle = key[1]*self.anglebucket
+            samples = equivalenceclasses[classindex][2]
+            cumweights = cumsum(samples[:,3])
+            entry = {'angle':bucketangle,
+                     'points':c_[samples[:,0]+bucketangle,dot(samples[:,1:3],transpose(rotationMatrixFromAxisAngle([0,0,1],bucketangle)[0:2,0:2]))],
+                     'cumweights':cumweights[1:]/cumweights[-1],
+                     'kdtrees':dict(),
+                     'numpoints':len(samples)}
+            self.numpoints += entry['numpoints']
+            self._evict()
+        else:
+            self.hits += 1
+        self.entries[key] = entry
+        return entry
+    def getKDTree(self,entry,rotweight):
+        """returns (kdtree,points) where points are the entry samples with the angle scaled by rotweight"""
+        if not rotweight in entry['kdtrees']:
+            points = array(entry['points'])
+            points[:,0] *= rotweight
+            entry['kdtrees'][rotweight] = (pyANN.KDTree(points),points)
+            entry['numpoints'] += 2*len(points)
+            # entry is the most recently used, so it is only evicted once it is the last one left, in which case it is still returned
+            self.numpoints += 2*len(points)
+            self._evict()
+        return entry['kdtrees'][rotweight]
+    def _evict(self):
+        """removes the least recently used entries until at most maxpoints samples are kept"""
+        while len(self.entries) > 0 and self.numpoints > self.maxpoints:
+            oldkey,oldentry = self.entries.popitem(last=False)
+            self.numpoints -= oldentry['numpoints']
+
 class InverseReachabilityModel(DatabaseGenerator):
     """Inverts the reachability and computes probability distributions of the robot's base given an end effector position"""
     def __init__(self,robot,id=None):
@@ -82,6 +138,7 @@ class InverseReachabilityModel(DatabaseGenerator):
         self.ikmodel = inversekinematics.InverseKinematicsModel(robot=robot,iktype=IkParameterization.Type.Transform6D)
         self.equivalenceclasses = None
         self.rotweight = 0.2 # in-plane rotation weight with respect to xy offset
+        self.basecache = BaseDistributionCache() # reuses the rotated equivalence classes across base distribution queries, set to None to disable
         self.id=id
         with self.robot:
             self.jointvalues = self.robot.GetDOFValues(self.getdofindices(self.manip))
@@ -117,6 +174,19 @@ class InverseReachabilityModel(DatabaseGenerator):
         samplingbandwidth = array([self.quatdelta*0.1,self.xyzdelta*0.1])
         self.equivalenceweights = array([-0.5/(e[1]+samplingbandwidth)**2 for e in self.equivalenceclasses])
         self.equivalenceoffset = array([self.classnormalizationconst(e[1]+samplingbandwidth) for e in self.equivalenceclasses])
+        if self.basecache is not None:
+            self.basecache.clear()
+
+    def _getEquivalenceClassPoints(self,classindex,angle):
+        """Returns (points,cumweights,entry) where points are the (angle,x,y) samples of the equivalence class rotated by angle around the z axis. If basecache is set, the rotated samples come from it and entry is its cache entry, otherwise entry is None."""
+        if self.basecache is not None:
+            entry = self.basecache.get(self.equivalenceclasses,classindex,angle)
+            points = array(entry['points'])
+            points[:,0] += angle-entry['angle']
+            return points,entry['cumweights'],entry
+        samples = self.equivalenceclasses[classindex][2]
+        cumweights = cumsum(samples[:,3])
+        return c_[samples[:,0]+angle,dot(samples[:,1:3],transpose(rotationMatrixFromAxisAngle([0,0,1],angle)[0:2,0:2]))],cumweights[1:]/cumweights[-1],None
 
     def save(self):
         DatabaseGenerator.save(self,(self.equivalenceclasses,self.rotweight,self.xyzdelta,self.quatdelta,self.jointvalues))
@@ -210,25 +280,30 @@ class InverseReachabilityModel(DatabaseGenerator):
             basetrans[:,0:7] = poseMultArrayT(poseFromMatrix(Tbase),basetrans[:,0:7])
             # find the density of the points
             searchtrans = c_[basetrans[:,0:4],basetrans[:,6:7]]
+            # the kdtree is built once, its indices are mapped to the density order and clustered points are marked as consumed
             kdtree = kinematicreachability.ReachabilityModel.QuaternionKDTree(searchtrans,1.0/self.rotweight)
-            transdensity = kdtree.kFRSearchArray(searchtrans,0.25*quateucdist2,0,quatthresh*0.2)[2]
-            basetrans = basetrans[argsort(-transdensity),:]
+            transdensity = kdtree.kFRSearchArray(array(searchtrans),0.25*quateucdist2,0,quatthresh*0.2)[2]
+            order = argsort(-transdensity)
+            basetrans = basetrans[order,:]
+            searchtrans = searchtrans[order,:]
+            densityrank = zeros(len(order),int)
+            densityrank[order] = arange(len(order))
+            consumed = zeros(len(basetrans),bool)
+            numleft = len(basetrans)
+            iseed = 0
             Nminimum = max(Nminimum,4)
             # find all equivalence classes
             quatrolls = array([quatFromAxisAngle(array((0,0,1)),roll) for roll in arange(0,2*pi,quatthresh*0.5)])
             self.equivalenceclasses = []
-            while len(basetrans) > 0:
-                searchtrans = c_[basetrans[:,0:4],basetrans[:,6:7]]
-                kdtree = kinematicreachability.ReachabilityModel.QuaternionKDTree(searchtrans,1.0/self.rotweight)
-                querypoints = c_[quatArrayTMult(quatrolls, searchtrans[0][0:4]),tile(searchtrans[0][4:],(len(quatrolls),1))]
-                foundindices = zeros(len(searchtrans),bool)
-                for querypoint in querypoints:
-                    k = min(len(searchtrans),1000)
-                    neighs,dists,kball = kdtree.kFRSearchArray(reshape(querypoint,(1,5)),quateucdist2,k,quatthresh*0.01)
-                    if k < kball:
-                        neighs,dists,kball = kdtree.kFRSearchArray(reshape(querypoint,(1,5)),quateucdist2,kball,quatthresh*0.01)
-                    foundindices[neighs] = True
-                equivalenttrans = basetrans[flatnonzero(foundindices),:]
+            while numleft > 0:
+                while consumed[iseed]:
+                    iseed += 1
+                querypoints = c_[quatArrayTMult(quatrolls, searchtrans[iseed][0:4]),tile(searchtrans[iseed][4:],(len(quatrolls),1))]
+                foundindices = densityrank[self._FindAllNeighbors(kdtree,querypoints,quateucdist2,quatthresh*0.01)]
+                foundindices = sort(foundindices[~consumed[foundindices]])
+                consumed[foundindices] = True
+                numleft -= len(foundindices)
+                equivalenttrans = basetrans[foundindices,:]
                 normalizedqarray,zangles = normalizeZRotation(equivalenttrans[:,0:4])
                 # get the 'mean' of the normalized quaternions best describing the distribution
                 # for initialization, make sure all quaternions are on the same hemisphere
@@ -237,8 +312,7 @@ class InverseReachabilityModel(DatabaseGenerator):
                 q0 = sum(normalizedqarray,axis=0)
                 q0 /= sqrt(sum(q0**2))
                 if len(normalizedqarray) >= Nminimum:
-                    qmean,success = leastsq(lambda q: quatArrayTDist(q/sqrt(sum(q**2)),normalizedqarray), normalizedqarray[0],maxfev=10000)
-                    qmean /= sqrt(sum(qmean**2))
+                    qmean = self.ComputeQuaternionMean(normalizedqarray,refinethresh=quatthresh)
                 else:
                     qmean = q0
                 qstd = sqrt(sum(quatArrayTDist(qmean,normalizedqarray)**2)/len(normalizedqarray))
@@ -250,14 +324,43 @@ class InverseReachabilityModel(DatabaseGenerator):
                                     r_[qstd,std(equivalenttrans[:,6])],
                                     c_[-zangles,equivalenttransinv,equivalenttrans[:,7:]])
                 self.equivalenceclasses.append(equivalenceclass)
-                basetrans = basetrans[flatnonzero(foundindices==False),:]
-                log.info('new equivalence class outliers: %d/%d, left over trans: %d',self.testEquivalenceClass(equivalenceclass)*len(zangles),len(zangles),len(basetrans))
+                log.info('new equivalence class outliers: %d/%d, left over trans: %d',self.testEquivalenceClass(equivalenceclass)*len(zangles),len(zangles),numleft)
         finally:
             statesaver.Release()
             for b,enable in bodies:
                 b.Enable(enable)
         self.preprocess()
         
+    @staticmethod
+    def _FindAllNeighbors(kdtree,querypoints,radiussq,eps,k=1000):
+        """returns the indices of all the poses of the QuaternionKDTree within radiussq of any of the querypoints with batched searches"""
+        k = min(k,2*kdtree.numposes)
+        neighs,dists,kball = kdtree.kFRSearchArray(array(querypoints),radiussq,k,eps)
+        allneighs = [neighs.flatten()]
+        # search again the query points that have more neighbors than k
+        redo = flatnonzero(kball > k)
+        if len(redo) > 0:
+            kredo = min(int(numpy.max(kball[redo])),2*kdtree.numposes)
+            neighs,dists,kball = kdtree.kFRSearchArray(array(querypoints[redo]),radiussq,kredo,eps)
+            allneighs.append(neighs.flatten())
+        allneighs = numpy.concatenate(allneighs)
+        return unique(allneighs[allneighs>=0])
+
+    @staticmethod
+    def ComputeQuaternionMean(qarray,refinethresh=None):
+        """Returns the mean of the quaternions (on the same hemisphere) as the principal eigenvector of sum(q*q^T), the closed-form minimizer of the chordal distance.
+
+        :param refinethresh: If not None and the standard deviation of the angles to the mean is larger, the mean is refined by minimizing quatArrayTDist with leastsq.
+        """
+        eigvalues,eigvectors = linalg.eigh(dot(transpose(qarray),qarray))
+        qmean = eigvectors[:,argmax(eigvalues)]
+        if dot(qmean,sum(qarray,axis=0)) < 0:
+            qmean = -qmean
+        if refinethresh is not None and sqrt(mean(quatArrayTDist(qmean,qarray)**2)) > refinethresh:
+            qmean,success = leastsq(lambda q: quatArrayTDist(q/sqrt(sum(q**2)),qarray), qmean,maxfev=10000)
+            qmean /= sqrt(sum(qmean**2))
+        return qmean
+
     def getEquivalenceClass(self,Tgrasp):
         with self.env:
             Tbase = self.manip.GetBase().GetTransform()
@@ -272,8 +375,11 @@ class InverseReachabilityModel(DatabaseGenerator):
         bestindex = argmax(logll)
         return self.equivalenceclasses[bestindex],logll[bestindex]
 
-    def computeBaseDistribution(self,Tgrasp,logllthresh=2.0,zaxis=None):
-        """Return a function of the distribution of possible positions of the robot such that Tgrasp is reachable. Also returns a sampler function"""
+    def computeBaseDistribution(self,Tgrasp,logllthresh=2.0,zaxis=None,griddelta=None):
+        """Return a function of the distribution of possible positions of the robot such that Tgrasp is reachable. Also returns a sampler function
+
+        :param griddelta: If not None, the density is precomputed on a grid of this resolution (angle,x,y) over the bounds and the returned density function interpolates it, which is faster for many repeated queries. See :meth:`ComputeGridDensity`
+        """
         if zaxis is not None:
             raise NotImplementedError('cannot specify a custom zaxis yet')
         with self.env:
@@ -304,12 +410,12 @@ class InverseReachabilityModel(DatabaseGenerator):
 
         # transform the equivalence class to the global coord system and create a kdtree for faster retrieval
         equivalenceclass = self.equivalenceclasses[bestindex]
-        points = array(equivalenceclass[2][:,0:3])
         # transform points by the base and grasp pose
         Tbaserot = c_[rotationMatrixFromAxisAngle([0,0,1],zbaseangle)[0:2,0:2],posebase[4:6]]
         Ttargetrot = c_[rotationMatrixFromAxisAngle([0,0,1],znormangle)[0:2,0:2],posetarget[4:6]]
         Trot = dot(Tbaserot, r_[Ttargetrot,[[0,0,1]]])
-        points = c_[equivalenceclass[2][:,0]+znormangle+zbaseangle,dot(equivalenceclass[2][:,1:3],transpose(Trot[0:2,0:2]))+ tile(Trot[0:2,2], (len(equivalenceclass[2]),1))]
+        points,cumweights,entry = self._getEquivalenceClassPoints(bestindex,znormangle+zbaseangle)
+        points[:,1:3] += Trot[0:2,2]
         bounds = array((numpy.min(points,0)-bandwidth,numpy.max(points,0)+bandwidth))
         if bounds[1,0]-bounds[0,0] > 2*pi:
            # already covering entire circle, so limit to 2*pi
@@ -317,34 +423,39 @@ class InverseReachabilityModel(DatabaseGenerator):
            bounds[1,0] = pi
 
         points[:,0] *= rotweight
-        kdtree = pyANN.KDTree(points)
+        if entry is not None:
+            # reuse the cached kdtree of the untranslated samples by moving the query points instead
+            kdtree,kdtreepoints = self.basecache.getKDTree(entry,rotweight)
+            kdtreeoffset = r_[(znormangle+zbaseangle-entry['angle'])*rotweight,Trot[0:2,2]]
+        else:
+            kdtree = pyANN.KDTree(points)
+            kdtreepoints = points
+            kdtreeoffset = zeros(3)
         searchradius=9.0*sum(bandwidth**2)
         searcheps=bandwidth[0]*0.2
         weights=equivalenceclass[2][:,3]*normalizationconst
-        cumweights = cumsum(weights)
-        cumweights = cumweights[1:]/cumweights[-1]
 
         def gaussiankerneldensity(poses):
             """returns the density"""
             qposes,zposeangles = normalizeZRotation(poses[:,0:4])
-            p = c_[zposeangles*rotweight,poses[:,4:6]]
+            p = c_[zposeangles*rotweight,poses[:,4:6]]-kdtreeoffset
             neighs,dists,kball = kdtree.kFRSearchArray(p,searchradius,16,searcheps)
-            probs = zeros(p.shape[0])
-            for i in range(p.shape[0]):
-                inds = neighs[i,neighs[i,:]>=0]
-                if len(inds) > 0:
-                    probs[i] = dot(weights[inds],numpy.exp(dot((points[inds,:]-tile(p[i,:],(len(inds),1)))**2,ibandwidth)))
-            return probs
+            return self.EvaluateKernelDensity(p,neighs,kdtreepoints,weights,ibandwidth)
         def gaussiankernelsampler(N=1,weight=1.0):
             """samples the distribution and returns a transform as a pose"""
-            samples = random.normal(array([points[bisect.bisect(cumweights,random.rand()),:]  for i in range(N)]),bandwidth*weight)
+            samples = random.normal(points[searchsorted(cumweights,random.rand(N),side='right')],bandwidth*weight)
             samples[:,0] *= 0.5*irotweight
             return poseMultArrayT(poserobot,c_[cos(samples[:,0]),zeros((N,2)),sin(samples[:,0]),samples[:,1:3],tile(Tbase[2,3],N)]),self.necessaryjointstate()
+        if griddelta is not None:
+            return self.ComputeGridDensity(gaussiankerneldensity,bounds,griddelta),gaussiankernelsampler,bounds
         return gaussiankerneldensity,gaussiankernelsampler,bounds
 
-    def computeAggregateBaseDistribution(self,Tgrasps,logllthresh=2.0,zaxis=None):
+    def computeAggregateBaseDistribution(self,Tgrasps,logllthresh=2.0,zaxis=None,griddelta=None):
         """Return a function of the distribution of possible positions of the robot such that any grasp from Tgrasps is reachable.
-        Also computes a sampler function that returns a random position of the robot along with the index into Tgrasps"""
+        Also computes a sampler function that returns a random position of the robot along with the index into Tgrasps
+
+        :param griddelta: see :meth:`computeBaseDistribution`
+        """
         if zaxis is not None:
             raise NotImplementedError('cannot specify a custom zaxis yet')
         with self.env:
@@ -384,7 +495,8 @@ class InverseReachabilityModel(DatabaseGenerator):
             # transform the equivalence class to the global coord system and create a kdtree for faster retrieval
             equivalenceclass = self.equivalenceclasses[bestindex]
             # transform points by the grasp pose
-            newpoints = c_[equivalenceclass[2][:,0]+znormangle,dot(equivalenceclass[2][:,1:3],transpose(rotationMatrixFromAxisAngle([0,0,1],znormangle)[0:2,0:2])) + tile(posetarget[4:6], (len(equivalenceclass[2]),1))]
+            newpoints,newcumweights,entry = self._getEquivalenceClassPoints(bestindex,znormangle)
+            newpoints[:,1:3] += posetarget[4:6]
             points = r_[points,newpoints]
             weights = r_[weights,equivalenceclass[2][:,3]*normalizationconst]
 
@@ -411,23 +523,16 @@ class InverseReachabilityModel(DatabaseGenerator):
             qposes,zposeangles = normalizeZRotation(poses[:,0:4])
             p = c_[zposeangles*rotweight,poses[:,4:6]]
             neighs,dists,kball = kdtree.kFRSearchArray(p,searchradius,16,searcheps)
-            probs = zeros(p.shape[0])
-            for i in range(p.shape[0]):
-                inds = neighs[i,neighs[i,:]>=0]
-                if len(inds) > 0:
-                    probs[i] = dot(weights[inds],numpy.exp(dot((points[inds,:]-tile(p[i,:],(len(inds),1)))**2,ibandwidth)))
-            return probs
+            return self.EvaluateKernelDensity(p,neighs,points,weights,ibandwidth)
         def gaussiankernelsampler(N=1,weight=1.0):
             """samples the distribution and returns a transform as a pose"""
-            sampledgraspindices = []
-            sampledpoints = zeros((N,3))
-            for i in range(N):
-                pointindex = bisect.bisect(cumweights,random.rand())
-                sampledgraspindices.append(graspindices[bisect.bisect(graspindexoffsets,pointindex)-1])
-                sampledpoints[i,:] = points[pointindex,:]
-            samples = random.normal(sampledpoints,bandwidth*weight)
+            pointindices = searchsorted(cumweights,random.rand(N),side='right')
+            sampledgraspindices = [graspindices[i] for i in searchsorted(graspindexoffsets,pointindices,side='right')-1]
+            samples = random.normal(points[pointindices],bandwidth*weight)
             samples[:,0] *= 0.5*irotweight
             return poseMultArrayT(poserobot,c_[cos(samples[:,0]),zeros((N,2)),sin(samples[:,0]),samples[:,1:3],tile(Tbase[2,3],N)]),sampledgraspindices,self.necessaryjointstate()
+        if griddelta is not None:
+            return self.ComputeGridDensity(gaussiankerneldensity,bounds,griddelta),gaussiankernelsampler,bounds
         return gaussiankerneldensity,gaussiankernelsampler,bounds
 
     def sampleBaseDistributionIterator(self,Tgrasps,logllthresh=2.0,weight=1.0,Nprematuresamples=1,zaxis=None):
@@ -460,22 +565,20 @@ class InverseReachabilityModel(DatabaseGenerator):
             bestindex = argmax(logll)
             if logll[bestindex] < logllthresh:
                 continue
-            # transform the equivalence class to the global coord system and create a kdtree for faster retrieval
+            # transform the equivalence class to the global coord system
             equivalenceclass = self.equivalenceclasses[bestindex]
             # transform points by the grasp pose
             Ttargetrot = c_[rotationMatrixFromAxisAngle([0,0,1],znormangle)[0:2,0:2],posetarget[4:6]]
             Trot = dot(Tbaserot, r_[Ttargetrot,[[0,0,1]]])
-            newpoints = c_[equivalenceclass[2][:,0]+znormangle+zbaseangle,dot(equivalenceclass[2][:,1:3],transpose(Trot[0:2,0:2]))+ tile(Trot[0:2,2], (len(equivalenceclass[2]),1))]
+            newpoints,cumweights,entry = self._getEquivalenceClassPoints(bestindex,znormangle+zbaseangle)
+            newpoints[:,1:3] += Trot[0:2,2]
+            newpoints[:,0] *= rotweight
             newweights = equivalenceclass[2][:,3]*normalizationconst
             if Nprematuresamples > 0:
-                newpoints[:,0] *= rotweight
-                kdtree = pyANN.KDTree(newpoints)
-                cumweights = cumsum(newweights)
-                cumweights = cumweights[1:]/cumweights[-1]
-                for i in range(Nprematuresamples):
-                    sample = random.normal(newpoints[bisect.bisect(cumweights,random.rand()),:],bandwidth*weight)
-                    sample[0] *= 0.5*irotweight
-                    yield poseMult(poserobot,r_[cos(sample[0]),0,0,sin(sample[0]),sample[1:3],Tbase[2,3]]),graspindex,self.necessaryjointstate()
+                samples = random.normal(newpoints[searchsorted(cumweights,random.rand(Nprematuresamples),side='right')],bandwidth*weight)
+                samples[:,0] *= 0.5*irotweight
+                for pose in poseMultArrayT(poserobot,c_[cos(samples[:,0]),zeros((len(samples),2)),sin(samples[:,0]),samples[:,1:3],tile(Tbase[2,3],len(samples))]):
+                    yield pose,graspindex,self.necessaryjointstate()
             graspindices.append(graspindex)
             graspindexoffsets.append(len(points))
             points = r_[points,newpoints]
@@ -484,15 +587,16 @@ class InverseReachabilityModel(DatabaseGenerator):
         if len(points) == 0:
             raise planning_error('could not find base distribution')
         
-        kdtree = pyANN.KDTree(points)
         cumweights = cumsum(weights)
         cumweights = cumweights[1:]/cumweights[-1]
         while True:
-            pointindex = bisect.bisect(cumweights,random.rand())
-            sampledgraspindex = graspindices[bisect.bisect(graspindexoffsets,pointindex)-1]
-            sample = random.normal(points[pointindex,:],bandwidth*weight)
-            sample[0] *= 0.5*irotweight
-            yield poseMult(poserobot,r_[cos(sample[0]),0,0,sin(sample[0]),sample[1:3],Tbase[2,3]]),sampledgraspindex,self.necessaryjointstate()
+            # draw the samples in batches
+            pointindices = searchsorted(cumweights,random.rand(1000),side='right')
+            samples = random.normal(points[pointindices],bandwidth*weight)
+            samples[:,0] *= 0.5*irotweight
+            poses = poseMultArrayT(poserobot,c_[cos(samples[:,0]),zeros((len(samples),2)),sin(samples[:,0]),samples[:,1:3],tile(Tbase[2,3],len(samples))])
+            for pose,offsetindex in zip(poses,searchsorted(graspindexoffsets,pointindices,side='right')-1):
+                yield pose,graspindices[offsetindex],self.necessaryjointstate()
 
     def randomBaseDistributionIterator(self,Tgrasps,Nprematuresamples=1,bounds=None,**kwargs):
         """randomly sample base positions given the grasps. This is mostly used for comparison"""
@@ -549,7 +653,7 @@ class InverseReachabilityModel(DatabaseGenerator):
                 Tmanip = matrixFromAxisAngle([0,0,1],sample[0])
                 Tmanip[0:2,3] = sample[1:3]
                 self.robot.SetTransform(Tmanip)
-                solution = self.manip.FindIKSolution(Tgrasp,0)
+                solution = self._FindIKSolution(Tgrasp,0)
                 if solution is None:
                     failed += 1
             return float(failed)/len(equivalenceclass[2])
@@ -564,6 +668,54 @@ class InverseReachabilityModel(DatabaseGenerator):
                 Tgrasp[0:3,0:3] = dot(Torggrasp[0:3,0:3],rotationMatrixFromAxisAngle(random.rand(3)*0.05))
             return solution
     @staticmethod
+    def EvaluateKernelDensity(p,neighs,points,weights,ibandwidth,chunksize=100000):
+        """Evaluates the gaussian kernel density at all the rows of p at once.
+
+        :param neighs: padded (len(p),K) array of the indices into points of the neighbors of every row of p, negative indices are ignored
+        :param ibandwidth: -0.5/bandwidth**2
+        """
+        probs = zeros(len(p))
+        for i in range(0,len(p),chunksize):
+            chunkneighs = neighs[i:(i+chunksize)]
+            valid = chunkneighs >= 0
+            inds = numpy.where(valid,chunkneighs,0)
+            contributions = weights[inds]*numpy.exp(dot((points[inds]-p[i:(i+chunksize),newaxis,:])**2,ibandwidth))
+            probs[i:(i+chunksize)] = sum(numpy.where(valid,contributions,0),1)
+        return probs
+
+    @staticmethod
+    def ComputeGridDensity(densityfn,bounds,griddelta):
+        """Precomputes densityfn on a grid over bounds (angle,x,y) and returns a density function of poses that linearly interpolates the grid. Poses outside of bounds have 0 density.
+
+        :param griddelta: grid resolution, a scalar or (angle,x,y)
+        """
+        griddelta = griddelta*ones(3)
+        shape = array(ceil((bounds[1]-bounds[0])/griddelta),int)+1
+        A,X,Y = mgrid[0:shape[0],0:shape[1],0:shape[2]]
+        gridpoints = c_[A.flat,X.flat,Y.flat]*griddelta+bounds[0]
+        N = len(gridpoints)
+        grid = zeros(N)
+        for i in range(0,N,500000):
+            chunk = gridpoints[i:(i+500000)]
+            grid[i:(i+500000)] = densityfn(c_[cos(chunk[:,0]*0.5),zeros((len(chunk),2)),sin(chunk[:,0]*0.5),chunk[:,1:3],zeros((len(chunk),1))])
+        grid = reshape(grid,shape)
+        def griddensity(poses):
+            """returns the density interpolated from the precomputed grid"""
+            qposes,zposeangles = normalizeZRotation(poses[:,0:4])
+            gridpositions = (c_[zposeangles,poses[:,4:6]]-bounds[0])/griddelta
+            lower = array(floor(gridpositions),int)
+            fractions = gridpositions-lower
+            probs = zeros(len(poses))
+            for offset in array([[i,j,k] for i in range(2) for j in range(2) for k in range(2)]):
+                inds = lower+offset
+                inside = flatnonzero(numpy.all(logical_and(inds >= 0,inds < shape),1))
+                if len(inside) > 0:
+                    cornerweights = prod(numpy.where(offset,fractions[inside],1-fractions[inside]),1)
+                    probs[inside] += cornerweights*grid[inds[inside,0],inds[inside,1],inds[inside,2]]
+            return probs
+        return griddensity
+
+    @staticmethod
     def showBaseDistribution(env,densityfn,bounds,zoffset=0,thresh=1.0,maxprob=None,marginalizeangle=True):
         discretization = [0.1,0.04,0.04]
         A,Y,X = mgrid[bounds[0,0]:bounds[1,0]:discretization[0], bounds[0,2]:bounds[1,2]:discretization[2], bounds[0,1]:bounds[1,1]:discretization[1]]
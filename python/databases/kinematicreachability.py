@@ -57,7 +57,7 @@ if not __openravepy_build_doc__:
 else:
     from numpy import array
 
-from ..openravepy_int import RaveFindDatabaseFile, IkParameterization, rotationMatrixFromQArray, poseFromMatrix
+from ..openravepy_int import RaveFindDatabaseFile, IkParameterization, rotationMatrixFromQArray, poseFromMatrix, poseFromMatrices
 from ..openravepy_ext import transformPoints, quatArrayTDist
 from .. import metaclass, pyANN
 from ..misc import SpaceSamplerExtra
@@ -65,8 +65,13 @@ from . import DatabaseGenerator
 from . import convexdecomposition, inversekinematics
 
 import numpy
+from numpy.lib.format import open_memmap
 import time
 import os.path
+try:
+    import cPickle as pickle
+except:
+    import pickle
 from os import makedirs
 from heapq import nsmallest # for nth smallest element
 from optparse import OptionParser
@@ -90,12 +95,13 @@ class ReachabilityModel(DatabaseGenerator):
             allposes[self.numposes:,0:4] *= -1
             self.nnposes = pyANN.KDTree(allposes)
         def kSearch(self,poses,k,eps):
-            """returns distance squared"""
-            poses[:,4:] *= self.transmult
-#            neighs,dists = self.nnposes.kSearch(poses,k,eps)
-            neighs,dists = zip(*[self.nnposes.kSearch(pose,k,eps) for pose in poses])
+            """Batched k-nearest neighbor search of a Nx7 array of poses.
+
+            Returns the neighbor indices and distance squared as contiguous Nxk arrays."""
+            searchposes = array(poses,float64)
+            searchposes[:,4:] *= self.transmult
+            neighs,dists = self.nnposes.kSearchArray(searchposes,k,eps)
             neighs[neighs>=self.numposes] -= self.numposes
-            poses[:,4:] *= self.itransmult
             return neighs,dists
         def kFRSearch(self,pose,radiussq,k,eps):
             """returns distance squared"""
@@ -112,6 +118,62 @@ class ReachabilityModel(DatabaseGenerator):
             poses[:,4:] *= self.itransmult
             return neighs,dists,kball
 
+    class AppendOnlyArray(object):
+        """Append-only float64 array of rows of numcolumns stored in a raw segment file on disk.
+
+        Rows are kept in a bounded in-memory buffer of buffersize rows and written to the end of the file whenever it fills up, so the memory use does not depend on the number of rows. The file is only overwritten starting from the first flush, so an existing file can be resumed with :meth:`truncate`.
+        """
+        def __init__(self,filename,numcolumns,buffersize=100000):
+            self.filename = filename
+            self.numcolumns = numcolumns
+            self.buffersize = buffersize
+            self.numrows = 0 # rows written to the file
+            self.buffer = zeros((buffersize,numcolumns))
+            self.numbuffered = 0
+        def __len__(self):
+            return self.numrows+self.numbuffered
+        def append(self,rows):
+            rows = reshape(array(rows,float64),(-1,self.numcolumns))
+            while len(rows) > 0:
+                numcopy = self.buffersize-self.numbuffered
+                if numcopy > len(rows):
+                    numcopy = len(rows)
+                self.buffer[self.numbuffered:self.numbuffered+numcopy] = rows[:numcopy]
+                self.numbuffered += numcopy
+                rows = rows[numcopy:]
+                if self.numbuffered == self.buffersize:
+                    self.flush()
+        def flush(self):
+            """writes the buffered rows at the end of the file and returns the total number of rows"""
+            if self.numbuffered > 0 or not os.path.exists(self.filename):
+                try:
+                    makedirs(os.path.split(self.filename)[0])
+                except OSError:
+                    pass
+                f = open(self.filename,'r+b' if os.path.exists(self.filename) else 'wb')
+                try:
+                    f.seek(self.numrows*self.numcolumns*8)
+                    self.buffer[:self.numbuffered].tofile(f)
+                    f.truncate()
+                finally:
+                    f.close()
+                self.numrows += self.numbuffered
+                self.numbuffered = 0
+            return self.numrows
+        def truncate(self,numrows):
+            """discards the buffer and all rows after numrows. Used to resume from a checkpoint returned by :meth:`flush`"""
+            self.numbuffered = 0
+            self.numrows = numrows
+        def getArray(self):
+            """flushes and returns a read-only memory-map of all the rows"""
+            self.flush()
+            if self.numrows == 0:
+                return zeros((0,self.numcolumns))
+            return numpy.memmap(self.filename,dtype=float64,mode='r',shape=(self.numrows,self.numcolumns))
+        def remove(self):
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+
     def __init__(self,robot):
         DatabaseGenerator.__init__(self,robot=robot)
         self.ikmodel = inversekinematics.InverseKinematicsModel(robot=robot,iktype=IkParameterization.Type.Transform6D)
@@ -123,8 +185,11 @@ class ReachabilityModel(DatabaseGenerator):
         self.quatdelta = None
         self.kdtree6d = None
         self.kdtree3d = None
+        self.reachabilitycells = None # (cellorigin,cellsize,cellshape,celloffsets) spatial index into reachabilitystats
+        self._statswriter = None # AppendOnlyArray that reachabilitystats is streamed to during generation
     def clone(self,envother):
         clone = DatabaseGenerator.clone(self,envother)
+        clone.ikmodel = self.ikmodel.clone(envother)
         return clone
     def has(self):
         return len(self.reachabilitydensity3d) > 0 and len(self.reachability3d) > 0 and len(self.reachabilitystats) > 0
@@ -132,18 +197,26 @@ class ReachabilityModel(DatabaseGenerator):
     def getversion(self):
         return 5
     
-    def save(self):
-        try:
-            self.SaveHDF5()
-        except ImportError:
-            log.warn('python h5py library not found, will not be able to speedup database access')
-            self.SavePickle()
+    def save(self,legacyformat=True):
+        """Saves the memory-mapped format of :meth:`SaveMemoryMapped`, which :meth:`load` prefers.
+
+        :param legacyformat: If True, also writes the HDF5 (or pickled if h5py is not found) .pp file that tools reading the database file expect.
+        """
+        self.SaveMemoryMapped()
+        if legacyformat:
+            try:
+                self.SaveHDF5()
+            except ImportError:
+                log.warn('python h5py library not found, will not be able to speedup database access')
+                self.SavePickle()
 
     def load(self):
         try:
             if not self.ikmodel.load():
                 self.ikmodel.autogenerate()
 
+            if self.LoadMemoryMapped():
+                return True
             try:
                 return self.LoadHDF5()
             except ImportError:
@@ -163,7 +236,8 @@ class ReachabilityModel(DatabaseGenerator):
         self.reachabilitystats,self.reachabilitydensity3d,self.reachability3d,self.pointscale,self.xyzdelta,self.quatdelta = params
         return self.has()
 
-    def SaveHDF5(self):
+    def SaveHDF5(self,chunksize=1000000):
+        """:param chunksize: reachabilitystats is copied chunksize rows at a time, so it can be a memory-mapped array larger than the available memory"""
         import h5py
         filename=self.getfilename(False)
         log.info('saving model to %s',filename)
@@ -175,7 +249,12 @@ class ReachabilityModel(DatabaseGenerator):
         f=h5py.File(filename,'w')
         try:
             f['version'] = self.getversion()
-            f['reachabilitystats'] = self.reachabilitystats
+            reachabilitystats = self._GetValue(self.reachabilitystats)
+            if not isinstance(reachabilitystats,ndarray):
+                reachabilitystats = array(reachabilitystats)
+            dataset = f.create_dataset('reachabilitystats',(len(reachabilitystats),8),float64)
+            for start in range(0,len(reachabilitystats),chunksize):
+                dataset[start:start+chunksize] = reachabilitystats[start:start+chunksize]
             f['reachabilitydensity3d'] = self.reachabilitydensity3d
             f['reachability3d'] = self.reachability3d
             f['pointscale'] = self.pointscale
@@ -214,9 +293,171 @@ class ReachabilityModel(DatabaseGenerator):
             if f is not None:
                 f.close()
 
+    def getcheckpointstate(self):
+        if isinstance(self.reachabilitystats,ReachabilityModel.AppendOnlyArray):
+            # the rows are already on disk, so only store how many are valid
+            return self.reachabilitystats.flush(),self.reachabilitydensity3d,self.reachability3d
+        return self.reachabilitystats,self.reachabilitydensity3d,self.reachability3d
+
+    def setcheckpointstate(self,state):
+        reachabilitystats,self.reachabilitydensity3d,self.reachability3d = state
+        if isinstance(self.reachabilitystats,ReachabilityModel.AppendOnlyArray):
+            if isinstance(reachabilitystats,(int,long)):
+                self.reachabilitystats.truncate(reachabilitystats)
+            else:
+                self.reachabilitystats.truncate(0)
+                self.reachabilitystats.append(reachabilitystats)
+        else:
+            self.reachabilitystats = reachabilitystats
+
     def getfilename(self,read=False):
         return RaveFindDatabaseFile(os.path.join('robot.'+self.robot.GetKinematicsGeometryHash(), 'reachability.' + self.manip.GetStructureHash() + '.pp'),read)
 
+    def getmmapfilename(self,name,read=False):
+        """filename of the memory-mapped array called name. The 'header' name holds the pickled parameters"""
+        ext = '.pp' if name == 'header' else '.npy'
+        return RaveFindDatabaseFile(os.path.join('robot.'+self.robot.GetKinematicsGeometryHash(), 'reachability.' + self.manip.GetStructureHash() + '.mmap.' + name + ext),read)
+
+    def SaveMemoryMapped(self,cellsize=None,chunksize=1000000):
+        """Saves the arrays as raw .npy files that can be memory-mapped and shared between processes.
+
+        The reachabilitystats rows are sorted by spatial cells of size cellsize (default is 4*xyzdelta), so that all the poses of one cell are contiguous and can be read on demand with :meth:`GetCellReachabilityStats`.
+        The rows are processed in chunks of chunksize, so reachabilitystats can be a memory-mapped array larger than the available memory.
+        """
+        reachabilitystats = self._GetValue(self.reachabilitystats)
+        if not isinstance(reachabilitystats,ndarray):
+            reachabilitystats = array(reachabilitystats)
+        if cellsize is None:
+            cellsize = 4*self.xyzdelta
+        numrows = len(reachabilitystats)
+        filename = self.getmmapfilename('header',False)
+        log.info('saving model to %s',filename)
+        try:
+            makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        statsfilename = self.getmmapfilename('reachabilitystats',False)
+        if numrows > 0:
+            chunks = [(i,i+chunksize if i+chunksize < numrows else numrows) for i in range(0,numrows,chunksize)]
+            cellorigin = numpy.min([numpy.min(reachabilitystats[start:end,4:7],0) for start,end in chunks],0)
+            cellshape = numpy.max([numpy.max(floor((reachabilitystats[start:end,4:7]-cellorigin)/cellsize),0) for start,end in chunks],0).astype(int)+1
+            cellids = zeros(numrows,int64)
+            for start,end in chunks:
+                cellcoords = array(floor((reachabilitystats[start:end,4:7]-cellorigin)/cellsize),int64)
+                cellids[start:end] = (cellcoords[:,0]*cellshape[1]+cellcoords[:,1])*cellshape[2]+cellcoords[:,2]
+            order = argsort(cellids,kind='mergesort')
+            celloffsets = searchsorted(cellids[order],arange(prod(cellshape)+1))
+            cellids = None
+            # write to a temporary file since reachabilitystats can be a memory-map of statsfilename
+            sortedstats = open_memmap(statsfilename+'.tmp',mode='w+',dtype=float64,shape=(numrows,reachabilitystats.shape[1]))
+            for start,end in chunks:
+                sortedstats[start:end] = reachabilitystats[order[start:end]]
+            sortedstats.flush()
+            del sortedstats
+            os.rename(statsfilename+'.tmp',statsfilename)
+            reachabilitystats = numpy.load(statsfilename,mmap_mode='r')
+        else:
+            cellorigin = zeros(3)
+            cellshape = zeros(3,int)
+            celloffsets = zeros(1,int)
+            numpy.save(statsfilename,zeros((0,8)))
+        if self._statswriter is not None:
+            self._statswriter.remove()
+            self._statswriter = None
+        numpy.save(self.getmmapfilename('reachabilitydensity3d',False),self._GetValue(self.reachabilitydensity3d))
+        numpy.save(self.getmmapfilename('reachability3d',False),self._GetValue(self.reachability3d))
+        numpy.save(self.getmmapfilename('celloffsets',False),celloffsets)
+        # write the header last so that an incomplete save is never loaded
+        pickle.dump((self.getversion(),self.pointscale,self.xyzdelta,self.quatdelta,cellorigin,cellsize,cellshape), open(filename,'wb'))
+        self.reachabilitystats = reachabilitystats
+        self.reachabilitycells = (cellorigin,cellsize,cellshape,celloffsets)
+
+    def LoadMemoryMapped(self):
+        """Memory-maps the arrays saved by :meth:`SaveMemoryMapped`. Nothing is read until it is accessed, and all processes on the host share the same page-cached copy."""
+        filename = self.getmmapfilename('header',True)
+        if len(filename) == 0:
+            return False
+        try:
+            modelversion,self.pointscale,self.xyzdelta,self.quatdelta,cellorigin,cellsize,cellshape = pickle.load(open(filename,'rb'))
+            if modelversion != self.getversion():
+                log.error('version is wrong %s!=%s ',modelversion,self.getversion())
+                return False
+            self._CloseDatabase()
+            self.reachabilitystats = numpy.load(self.getmmapfilename('reachabilitystats',True),mmap_mode='r')
+            self.reachabilitydensity3d = numpy.load(self.getmmapfilename('reachabilitydensity3d',True),mmap_mode='r')
+            self.reachability3d = numpy.load(self.getmmapfilename('reachability3d',True),mmap_mode='r')
+            celloffsets = numpy.load(self.getmmapfilename('celloffsets',True),mmap_mode='r')
+            self.reachabilitycells = (cellorigin,cellsize,cellshape,celloffsets)
+            self.kdtree3d = self.kdtree6d = None
+            return self.has()
+        except Exception,e:
+            log.debug('LoadMemoryMapped for %s: %s',filename,e)
+            return False
+
+    def GetCellReachabilityStats(self,position,radius=0.0):
+        """Returns the reachabilitystats rows of all the spatial cells overlapping the box of half-extents radius around position.
+
+        The position is in the same coordinate system as the stored poses. When the database is memory-mapped, only the rows of the touched cells are read from disk.
+        """
+        reachabilitystats = self._GetValue(self.reachabilitystats)
+        if self.reachabilitycells is None:
+            inside = numpy.all(abs(reachabilitystats[:,4:7]-position) <= radius+0.5*self.xyzdelta,1)
+            return array(reachabilitystats[flatnonzero(inside)])
+        cellorigin,cellsize,cellshape,celloffsets = self.reachabilitycells
+        if len(celloffsets) <= 1:
+            return zeros((0,reachabilitystats.shape[1]))
+        lower = numpy.maximum(array(floor((array(position)-radius-cellorigin)/cellsize),int),0)
+        upper = numpy.minimum(array(floor((array(position)+radius-cellorigin)/cellsize),int),cellshape-1)
+        if any(lower > upper):
+            return zeros((0,reachabilitystats.shape[1]))
+        slices = []
+        for cx in range(lower[0],upper[0]+1):
+            for cy in range(lower[1],upper[1]+1):
+                # cells along z are contiguous, so read them as one slice
+                cellid = (cx*cellshape[1]+cy)*cellshape[2]
+                startoffset = celloffsets[cellid+lower[2]]
+                endoffset = celloffsets[cellid+upper[2]+1]
+                if endoffset > startoffset:
+                    slices.append(reachabilitystats[startoffset:endoffset])
+        if len(slices) == 0:
+            return zeros((0,reachabilitystats.shape[1]))
+        return numpy.concatenate(slices)
+
+    def ComputeTranslationDensity(self,positions,radius):
+        """Returns the number of reachabilitystats poses whose translation is within radius of each of the (N,3) positions.
+
+        If the database is memory-mapped, only the rows of the cells around every position are read through :meth:`GetCellReachabilityStats`. Otherwise uses the kdtree of :meth:`ComputeNN`, which needs all the rows in memory.
+        """
+        positions = reshape(positions,(-1,3))
+        if self.reachabilitycells is None:
+            return self.ComputeNN(True).kFRSearchArray(positions,radius**2,0,radius*0.01)[2]
+        density = zeros(len(positions),int)
+        for i,position in enumerate(positions):
+            stats = self.GetCellReachabilityStats(position,radius)
+            density[i] = sum(sum((stats[:,4:7]-position)**2,1) <= radius**2)
+        return density
+
+    def GetReachabilityAtPositions(self,positions):
+        """Returns the reachability3d values at global end effector positions (N,3) given the current robot transform.
+
+        Every position takes the maximum of the 8 grid samples surrounding it, positions outside of the sampled volume are 0.
+        """
+        reachability3d = self._GetValue(self.reachability3d)
+        with self.robot:
+            Tbaseinv = linalg.inv(self.manip.GetBase().GetTransform())
+            baseanchor = dot(Tbaseinv[0:3,0:3],self.getOrderedArmJoints()[0].GetAnchor())+Tbaseinv[0:3,3]
+        localpositions = dot(reshape(positions,(-1,3)),transpose(Tbaseinv[0:3,0:3]))+Tbaseinv[0:3,3]
+        gridpositions = self.pointscale[0]*(localpositions-baseanchor)+self.pointscale[1]
+        lower = array(floor(gridpositions),int)
+        shape = array(reachability3d.shape)
+        values = zeros(len(gridpositions))
+        for offset in array([[i,j,k] for i in range(2) for j in range(2) for k in range(2)]):
+            inds = lower+offset
+            inside = flatnonzero(numpy.all(logical_and(inds >= 0,inds < shape),1))
+            if len(inside) > 0:
+                values[inside] = maximum(values[inside],reachability3d[inds[inside,0],inds[inside,1],inds[inside,2]])
+        return values
+
     def autogenerateparams(self,options=None):
         maxradius=None
         translationonly=False
@@ -265,8 +506,10 @@ class ReachabilityModel(DatabaseGenerator):
                     links.append(newlink)
         return links
 
-    def generatepcg(self,maxradius=None,translationonly=False,xyzdelta=None,quatdelta=None,usefreespace=False):
+    def generatepcg(self,maxradius=None,translationonly=False,xyzdelta=None,quatdelta=None,usefreespace=False,statsbuffersize=100000):
         """Generate producer, consumer, and gatherer functions allowing parallelization
+
+        :param statsbuffersize: if not None, the reachabilitystats rows are streamed to a segment file in the database directory through a buffer of this many rows instead of being accumulated in memory. The final reachabilitystats is a memory-map of that file.
         """
         if not self.ikmodel.load():
             self.ikmodel.autogenerate()
@@ -311,50 +554,68 @@ class ReachabilityModel(DatabaseGenerator):
             
         self.reachabilitydensity3d = zeros(prod(shape))
         self.reachability3d = zeros(prod(shape))
-        self.reachabilitystats = []
+        if self._statswriter is not None:
+            self._statswriter.remove()
+            self._statswriter = None
+        if statsbuffersize is not None:
+            self.reachabilitystats = ReachabilityModel.AppendOnlyArray(self.getmmapfilename('reachabilitystats',False)+'.partial',8,statsbuffersize)
+        else:
+            self.reachabilitystats = []
 
         def producer():
-            T = eye(4)
             for i,ind in enumerate(insideinds):
+                T = eye(4) # new matrix for every item since work can be queued to other processes
                 T[0:3,3] = allpoints[ind]+baseanchor
                 if mod(i,1000)==0:
                     log.info('%s/%d', i,len(insideinds))
                 yield ind,T
-        def consumer(ind,T):
-            with self.robot:
-                self.robot.SetTransform(Trobot)
-                reachabilitystats = []
-                numvalid = 0
-                numrotvalid = 0
-                T = array(T)
-                for rotation in rotations:
-                    T[0:3,0:3] = rotation
-                    if usefreespace:
-                        solutions = self.manip.FindIKSolutions(T,0)
-                        if solutions is not None:
-                            reachabilitystats.append(r_[poseFromMatrix(T),len(solutions)])
-                            numvalid += len(solutions)
-                            numrotvalid += 1
-                    else:
-                        solution = self.manip.FindIKSolution(T,0)
-                        if solution is not None:
-                            reachabilitystats.append(r_[poseFromMatrix(T),1])
-                            numvalid += 1
-                            numrotvalid += 1
-                return ind,reachabilitystats, numvalid, numrotvalid
+        consumer = self._getConsumer(Trobot,rotations,usefreespace)
 
         def gatherer(ind=None,reachabilitystats=None,numvalid=None,numrotvalid=None):
             if ind is not None:
-                self.reachabilitystats += reachabilitystats
+                if isinstance(self.reachabilitystats,ReachabilityModel.AppendOnlyArray):
+                    self.reachabilitystats.append(reachabilitystats)
+                else:
+                    self.reachabilitystats += reachabilitystats
                 self.reachabilitydensity3d[ind] = numvalid/float(len(rotations))
                 self.reachability3d[ind] = numrotvalid/float(len(rotations))
             else:
                 self.reachability3d = reshape(self.reachability3d,shape)
                 self.reachabilitydensity3d = reshape(self.reachabilitydensity3d,shape)
-                self.reachabilitystats = array(self.reachabilitystats)
+                if isinstance(self.reachabilitystats,ReachabilityModel.AppendOnlyArray):
+                    self._statswriter = self.reachabilitystats
+                    self.reachabilitystats = self._statswriter.getArray()
+                else:
+                    self.reachabilitystats = array(self.reachabilitystats)
 
         return producer, consumer, gatherer, len(insideinds)
 
+    def generateconsumer(self,maxradius=None,translationonly=False,xyzdelta=None,quatdelta=None,usefreespace=False,statsbuffersize=100000):
+        """Returns the consumer function of :meth:`generatepcg` without sampling the workspace or resetting the generated arrays. The ik solver has to be generated already.
+        """
+        if not self.ikmodel.load():
+            raise ValueError('failed to load ik model %s'%self.ikmodel.getfilename(True))
+        if quatdelta is None:
+            quatdelta=0.5
+        with self.robot:
+            Trobot=dot(linalg.inv(self.manip.GetBase().GetTransform()),self.robot.GetTransform())
+        rotations = [eye(3)] if translationonly else rotationMatrixFromQArray(SpaceSamplerExtra().sampleSO3(quatdelta=quatdelta))
+        return self._getConsumer(Trobot,rotations,usefreespace)
+
+    def _getConsumer(self,Trobot,rotations,usefreespace):
+        def consumer(ind,T):
+            with self.robot:
+                self.robot.SetTransform(Trobot)
+                Ts = tile(T,(len(rotations),1,1))
+                Ts[:,0:3,0:3] = rotations
+                numsolutions,solutions = self.ikmodel.solveBatch(Ts,0,firstonly=not usefreespace)
+                valid = flatnonzero(numsolutions)
+                reachabilitystats = list(c_[poseFromMatrices(Ts[valid]),numsolutions[valid]]) if len(valid) > 0 else []
+                numvalid = sum(numsolutions)
+                numrotvalid = len(valid)
+                return ind,reachabilitystats, numvalid, numrotvalid
+        return consumer
+
 
     def show(self,showrobot=True,contours=[0.01,0.1,0.2,0.5,0.8,0.9,0.99],opacity=None,figureid=1, xrange=None,options=None):
         try:
@@ -399,6 +660,7 @@ class ReachabilityModel(DatabaseGenerator):
         return allpoints,insideinds,X.shape,array((1.0/delta,nsteps))
 
     def ComputeNN(self,translationonly=False):
+        """builds a kdtree over all the reachabilitystats rows, so reads the entire array even if it is memory-mapped"""
         if translationonly:
             if self.kdtree3d is None:
                 self.kdtree3d = pyANN.KDTree(self._GetValue(self.reachabilitystats)[:,4:7])
@@ -81,6 +81,64 @@ from os import makedirs
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 
+class VoxelPointSet(object):
+    """Incrementally built point set that keeps at most one point per voxel of the given resolution.
+
+    Voxels are indexed by a sorted array of packed integer keys, so inserting N points into a set of M points costs O(N log N + M) and no spatial tree needs to be rebuilt. The voxel indices of all the axes are packed into one int64, so at most 3 dimensions are supported.
+    """
+    def __init__(self,resolution,dim=3,points=None):
+        if dim > 3:
+            raise ValueError('VoxelPointSet supports at most 3 dimensions, got %d'%dim)
+        self.resolution = float(resolution)
+        self.dim = dim
+        self.keybits = 63//dim
+        self.keys = zeros(0,int64)
+        self.pointchunks = []
+        if points is not None:
+            self.insert(points)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def computeKeys(self,points):
+        """returns the packed voxel key of every point"""
+        indices = floor(asarray(points)/self.resolution)
+        # indices out of range would wrap around and alias other voxels, checked before casting since the cast itself can overflow
+        if len(indices) > 0 and not numpy.max(abs(indices)) < (1<<(self.keybits-1)):
+            raise ValueError('points are too far from the origin for %d bits of voxel index per axis at resolution %f'%(self.keybits,self.resolution))
+        indices = indices.astype(int64)+(1<<(self.keybits-1))
+        keys = zeros(len(indices),int64)
+        for i in range(self.dim):
+            keys = (keys<<self.keybits)|indices[:,i]
+        return keys
+
+    def insert(self,points):
+        """Inserts the points whose voxels are not occupied yet. Returns the indices of the inserted points.
+        """
+        if len(points) == 0:
+            return zeros(0,int)
+        newkeys,inds = unique(self.computeKeys(points),return_index=True)
+        if len(self.keys) > 0:
+            pos = searchsorted(self.keys,newkeys)
+            occupied = self.keys[minimum(pos,len(self.keys)-1)] == newkeys
+            newkeys = newkeys[~occupied]
+            inds = inds[~occupied]
+            self.keys = numpy.insert(self.keys,pos[~occupied],newkeys)
+        else:
+            self.keys = newkeys
+        inds = sort(inds)
+        if len(inds) > 0:
+            self.pointchunks.append(array(points[inds]))
+        return inds
+
+    def getPoints(self):
+        """returns all the inserted points in insertion order"""
+        if len(self.pointchunks) == 0:
+            return zeros((0,self.dim))
+        if len(self.pointchunks) > 1:
+            self.pointchunks = [r_[tuple(self.pointchunks)]]
+        return self.pointchunks[0]
+
 class LinkStatisticsModel(DatabaseGenerator):
     """Computes the convex decomposition of all of the robot's links"""
     def __init__(self,robot):
@@ -102,7 +160,7 @@ class LinkStatisticsModel(DatabaseGenerator):
             return value
 
     def getversion(self):
-        return 4
+        return 5
     
     def save(self):
         try:
@@ -368,7 +426,7 @@ class LinkStatisticsModel(DatabaseGenerator):
                     volumeinertia = zeros((3,3))
                     crossarea = zeros((0,2))
                 if len(crossarea) > 0:
-                    crossarea = crossarea[self.PrunePointsKDTree(crossarea, density**2, 1,k=50),:]
+                    crossarea = crossarea[self.PrunePointsVoxelGrid(crossarea, density, 1),:]
                     volumedelta = sum(crossarea[:,0])*density**2
                 else:
                     volumedelta = 0
@@ -379,26 +437,18 @@ class LinkStatisticsModel(DatabaseGenerator):
 
             log.info('Computing statistics for the entire robot volume...')
             Trobot = self.robot.GetTransform()
-            robotvolume = None
+            robotvolumeset = VoxelPointSet(self.samplingdelta)
             for link,linkstat in izip(self.robot.GetLinks(),self.linkstats):
-                points = transformPoints(dot(linalg.inv(Trobot), link.GetTransform()),linkstat['volumepoints'])
-                if robotvolume is None or len(robotvolume) == 0:
-                    robotvolume = points
-                elif len(points) > 0:
-                    kdtree = pyANN.KDTree(robotvolume)
-                    neighs,dists,kball = kdtree.kFRSearchArray(points,self.samplingdelta**2,0,self.samplingdelta*0.01)
-                    robotvolume = r_[robotvolume, points[kball==0]]
-                    del kdtree
+                robotvolumeset.insert(transformPoints(dot(linalg.inv(Trobot), link.GetTransform()),linkstat['volumepoints']))
             # since jointvolumes were removed as soon as they were used, only consider ones that are still initialized
             for joint,jointvolume in izip(self.robot.GetJoints(),jointvolumes_points):
                 if jointvolume is not None:
                     points = self.TransformJointPoints(joint,jointvolume)
                     if len(points) > 1:
-                        kdtree = pyANN.KDTree(robotvolume)
-                        neighs,dists,kball = kdtree.kFRSearchArray(points,self.samplingdelta**2,0,self.samplingdelta*0.01)
-                        robotvolume = r_[robotvolume, points[kball==0]]
-                        del kdtree
+                        robotvolumeset.insert(points)
             del jointvolumes_points # not used anymore, so free memory
+            robotvolume = robotvolumeset.getPoints()
+            del robotvolumeset
             self.affinevolumes = [None]*6
             # compute for rotation around axes
             for i in [2]:
@@ -409,7 +459,7 @@ class LinkStatisticsModel(DatabaseGenerator):
                 volume = dot(robotvolume,transpose(R))
                 # get the cross sections and a dV/dAngle measure
                 crossarea = c_[sqrt(sum(volume[:,0:2]**2,1)),volume[:,2:]]
-                crossarea = crossarea[self.PrunePointsKDTree(crossarea, density**2, 1,k=50),:]
+                crossarea = crossarea[self.PrunePointsVoxelGrid(crossarea, density, 1),:]
                 # compute simple statistics and compress the joint volume
                 volumedelta = sum(crossarea[:,0])*density**2
                 volumecom = r_[tile(mean(crossarea[:,0]),2),mean(crossarea[:,1])]
@@ -420,7 +470,7 @@ class LinkStatisticsModel(DatabaseGenerator):
                 indices = range(3)
                 indices.remove(i)
                 crossarea = robotvolume[:,indices]
-                crossarea = crossarea[self.PrunePointsKDTree(crossarea, density**2, 1,k=50),:]
+                crossarea = crossarea[self.PrunePointsVoxelGrid(crossarea, density, 1),:]
                 volumedelta = len(crossarea)*density**2
                 volumecom = mean(robotvolume,0)
                 volume = len(robotvolume)*self.samplingdelta**3
@@ -443,25 +493,22 @@ class LinkStatisticsModel(DatabaseGenerator):
             # compute all points inside the swept volume
             maxbit = int(log2(numangles))
             for i in range(maxbit):
-                kdtree = pyANN.KDTree(volumepoints_pow[-1])
                 R = rotationMatrixFromAxisAngle(axis,angles[2**i])
-                newpoints = dot(volumepoints_pow[-1],transpose(R))
-                # only choose points that do not have neighbors
-                neighs,dists,kball = kdtree.kFRSearchArray(newpoints,samplingdelta**2,0,samplingdelta*0.01)
-                volumepoints_pow.append(r_[volumepoints_pow[-1],newpoints[kball==0]])
+                # only add the rotated points whose voxels are not occupied
+                pointset = VoxelPointSet(samplingdelta,points=volumepoints_pow[-1])
+                pointset.insert(dot(volumepoints_pow[-1],transpose(R)))
+                volumepoints_pow.append(pointset.getPoints())
+                del pointset
+            sweptvolumeset = VoxelPointSet(samplingdelta)
             curangle = 0
             for i in range(maxbit+1):
                 if numangles&(1<<i):
                     R = rotationMatrixFromAxisAngle(axis,curangle)
-                    newpoints = dot(volumepoints_pow[i],transpose(R))
-                    if sweptvolume is None:
-                        sweptvolume = newpoints
-                    else:
-                        kdtree = pyANN.KDTree(sweptvolume)
-                        neighs,dists,kball = kdtree.kFRSearchArray(newpoints,samplingdelta**2,0,samplingdelta*0.01)
-                        sweptvolume = r_[sweptvolume,newpoints[kball==0]]
+                    sweptvolumeset.insert(dot(volumepoints_pow[i],transpose(R)))
                     curangle += angles[2**i]
                 volumepoints_pow[i] = None # free precious memory
+            sweptvolume = sweptvolumeset.getPoints()
+            del sweptvolumeset
         else:
             sweptvolume = volumepoints_pow[0]
         del volumepoints_pow
@@ -496,25 +543,40 @@ class LinkStatisticsModel(DatabaseGenerator):
             return {'com':zeros(3),'inertia':zeros((3,3)),'volume':0,'volumepoints':zeros((0,3))}
         minpoint = numpy.min([numpy.min(hull[0],axis=0) for hull in hulls],axis=0)
         maxpoint = numpy.max([numpy.max(hull[0],axis=0) for hull in hulls],axis=0)
-        X,Y,Z = mgrid[minpoint[0]:maxpoint[0]:self.samplingdelta,minpoint[1]:maxpoint[1]:self.samplingdelta,minpoint[2]:maxpoint[2]:self.samplingdelta]
         volumepoints = SpaceSamplerExtra().sampleR3(self.samplingdelta,boxdims=maxpoint-minpoint)
         volumepoints[:,0] += minpoint[0]
         volumepoints[:,1] += minpoint[1]
         volumepoints[:,2] += minpoint[2]
-        insidepoints = zeros(len(volumepoints),bool)
-        for i,point in enumerate(volumepoints):
-            if mod(i,10000) == 0:
-                log.debug('%d/%d'%(i,len(volumepoints)))
-            for hull in hulls:
-                if all(dot(hull[2][:,0:3],point)+hull[2][:,3] <= 0):
-                    insidepoints[i] = True
-                    break
+        insidepoints = self.ComputePointsInsideHulls(volumepoints,hulls)
         volumepoints = volumepoints[insidepoints,:]
         volume = len(volumepoints)*self.samplingdelta**3
         com = mean(volumepoints,0)
         inertia = cov(volumepoints,rowvar=0,bias=1)*(len(volumepoints)*self.samplingdelta**3)
         return {'com':com,'inertia':inertia,'volume':volume,'volumepoints':volumepoints}
 
+    @staticmethod
+    def ComputePointsInsideHulls(points,hulls,chunksize=20000):
+        """Returns a boolean mask of the Nx3 points that are inside at least one of the convex hulls.
+
+        Each hull is (vertices,indices,planes). Points are first culled with the bounding box of the hull vertices and points already found inside are skipped, the remaining ones are tested against all the planes of the hull in chunks of chunksize points.
+        """
+        insidepoints = zeros(len(points),bool)
+        for ihull,hull in enumerate(hulls):
+            log.debug('hull %d/%d',ihull,len(hulls))
+            planes = hull[2]
+            hullmin = numpy.min(hull[0],axis=0)-1e-7
+            hullmax = numpy.max(hull[0],axis=0)+1e-7
+            candidates = flatnonzero(logical_and(logical_not(insidepoints),logical_and(numpy.all(points>=hullmin,axis=1),numpy.all(points<=hullmax,axis=1))))
+            if len(planes) == 0:
+                insidepoints[candidates] = True
+                continue
+            normals = transpose(planes[:,0:3])
+            for i in range(0,len(candidates),chunksize):
+                inds = candidates[i:(i+chunksize)]
+                inside = numpy.all(dot(points[inds],normals)+planes[:,3] <= 0,axis=1)
+                insidepoints[inds[inside]] = True
+        return insidepoints
+
     @staticmethod
     def PrunePointsKDTree(points, thresh2, neighsize,k=20):
         """Prunes the poses so that every pose has at most neighsize neighbors within sqrt(thresh2) distance. In order to successfully compute the nearest neighbors, each pose's quaternion is also negated.
@@ -556,6 +618,29 @@ class LinkStatisticsModel(DatabaseGenerator):
             inds = [inds[i] for i in newinds]
         return inds
 
+    @staticmethod
+    def PrunePointsVoxelGrid(points, cellsize, neighsize):
+        """Prunes the points so that at most neighsize points remain in every cubic cell of size cellsize, keeping the first points of every cell. Returns the sorted indices of the kept points.
+
+        Unlike :meth:`PrunePointsKDTree`, which bounds the number of neighbors within a Euclidean radius, kept points of adjacent cells can be closer than cellsize. It does not need a kdtree, so it is much faster on large point sets.
+        Input:
+        points - Nxdim array with dim <= 3, see VoxelPointSet
+        """
+        N = points.shape[0]
+        if N <= 1:
+            return range(N)
+        pointset = VoxelPointSet(cellsize,dim=points.shape[1])
+        if neighsize <= 1:
+            return pointset.insert(points)
+        # keep the first neighsize points of every voxel
+        keys = pointset.computeKeys(points)
+        order = argsort(keys,kind='mergesort')
+        sortedkeys = keys[order]
+        groupstarts = r_[0,flatnonzero(sortedkeys[1:]!=sortedkeys[:-1])+1]
+        groupsizes = diff(r_[groupstarts,N])
+        ranks = arange(N)-repeat(groupstarts,groupsizes)
+        return sort(order[ranks<neighsize])
+
     @staticmethod
     def CreateOptionParser():
         parser = DatabaseGenerator.CreateOptionParser(useManipulator=False)
@@ -304,7 +304,7 @@ class VisibilityModel(DatabaseGenerator):
                 Trelative = dot(linalg.inv(self.attachedsensor.GetTransform()),self.manip.GetEndEffectorTransform())
                 Tcamera = dot(self.target.GetTransform(),matrixFromPose(pose))
                 Tgrasp = dot(Tcamera,Trelative)
-                s = self.manip.FindIKSolution(Tgrasp,checkcollision)
+                s = self._FindIKSolution(Tgrasp,checkcollision)
                 if s is not None:
                     self.robot.SetDOFValues(s,self.manip.GetArmIndices())
                     if computevisibility and not self.visualprob.ComputeVisibility():
@@ -322,14 +322,13 @@ class VisibilityModel(DatabaseGenerator):
                 # do not autogenerate since that would force this model to depend on the reachability
                 self.rmodel = None
                 return array(visibilitytransforms)
-        kdtree=self.rmodel.ComputeNN(translationonly)
         if maxdist is not None:
             visibilitytransforms = self.visibilitytransforms[invertPoses(self.visibilitytransforms)[:,6]<maxdist]
         else:
             visibilitytransforms = self.visibilitytransforms
         newtrans = poseMultArrayT(poseFromMatrix(dot(linalg.inv(self.manip.GetBase().GetTransform()),self.target.GetTransform())),visibilitytransforms)
         if translationonly:
-            transdensity = kdtree.kFRSearchArray(newtrans[:,4:7],thresh**2,0,thresh*0.01)[2]
+            transdensity = self.rmodel.ComputeTranslationDensity(newtrans[:,4:7],thresh)
             I=flatnonzero(transdensity>numminneighs)
             return visibilitytransforms[I[argsort(-transdensity[I])]]
         raise ValueError('not supported')
@@ -118,7 +118,7 @@ template <typename T>
 class IkFastFunctions
 {
 public:
-    IkFastFunctions() : _ComputeIk(NULL), _ComputeFk(NULL), _GetNumFreeParameters(NULL), _GetFreeParameters(NULL), _GetNumJoints(NULL), _GetIkRealSize(NULL), _GetIkFastVersion(NULL), _GetIkType(NULL), _GetKinematicsHash(NULL) {
+    IkFastFunctions() : _ComputeIk(NULL), _ComputeFk(NULL), _GetNumFreeParameters(NULL), _GetFreeParameters(NULL), _GetNumJoints(NULL), _GetIkRealSize(NULL), _GetIkFastVersion(NULL), _GetIkType(NULL), _GetKinematicsHash(NULL), _ComputeIkBatch(NULL), _ComputeFkBatch(NULL) {
     }
     virtual ~IkFastFunctions() {
     }
@@ -140,6 +140,12 @@ public:
     GetIkTypeFn _GetIkType;
     typedef const char* (*GetKinematicsHashFn)();
     GetKinematicsHashFn _GetKinematicsHash;
+    /// optional, NULL if the library was generated without batch functions
+    typedef int (*ComputeIkBatchFn)(int, const T*, const T*, const T*, int, T*, int*);
+    ComputeIkBatchFn _ComputeIkBatch;
+    /// optional, NULL if the library was generated without batch functions
+    typedef void (*ComputeFkBatchFn)(int, const T*, T*, T*);
+    ComputeFkBatchFn _ComputeFkBatch;
 };
 
 // Implementations of the abstract classes, user doesn't need to use them
@@ -301,6 +307,21 @@ IKFAST_API bool ComputeIk(const IkReal* eetrans, const IkReal* eerot, const IkRe
 /// \brief Computes the end effector coordinates given the joint values. This function is used to double check ik.
 IKFAST_API void ComputeFk(const IkReal* joints, IkReal* eetrans, IkReal* eerot);
 
+/** \brief Computes the IK solutions of num end effector coordinates given as structure-of-arrays, ie value k of pose i is at index k*num+i.
+
+   - ``eetrans`` - 3*num translation values.
+   - ``eerot`` - 9*num rotation values, the same values as \ref ComputeIk for every pose.
+   - ``pfree`` - GetNumFreeParameters()*num free joint values.
+   - ``psolutions`` - num*maxsolutions*GetNumJoints() values, solution j of pose i starts at (i*maxsolutions+j)*GetNumJoints().
+   - ``pnumsolutions`` - num values, the number of solutions of every pose.
+
+   Returns the number of poses with at least one solution.
+ */
+IKFAST_API int ComputeIkBatch(int num, const IkReal* eetrans, const IkReal* eerot, const IkReal* pfree, int maxsolutions, IkReal* psolutions, int* pnumsolutions);
+
+/// \brief Computes the end effector coordinates of num joint configurations given as structure-of-arrays, ie value k of configuration i is at index k*num+i.
+IKFAST_API void ComputeFkBatch(int num, const IkReal* joints, IkReal* eetrans, IkReal* eerot);
+
 /// \brief returns the number of free parameters users has to set apriori
 IKFAST_API int GetNumFreeParameters();
 
@@ -182,8 +182,16 @@ __copyright__ = 'Copyright (C) 2009-2012 Rosen Diankov <rosen.diankov@gmail.com>
 __license__ = 'Lesser GPL, Version 3'
 __version__ = '62' # also in ikfast.h
 
-import sys, copy, time, math, datetime
+import sys, copy, time, math, datetime, os
 import __builtin__
+try:
+    import cPickle as pickle
+except:
+    import pickle
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5 # python 2.4
 from optparse import OptionParser
 try:
     from openravepy.metaclass import AutoReloader
@@ -216,6 +224,36 @@ except ImportError:
 
 from operator import itemgetter
 from itertools import izip, chain
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6, supports the operations of MemoCache
+    class OrderedDict(dict):
+        def __init__(self,items=()):
+            dict.__init__(self)
+            self._keys = []
+            self.update(items)
+        def __setitem__(self,key,value):
+            if not key in self:
+                self._keys.append(key)
+            dict.__setitem__(self,key,value)
+        def __iter__(self):
+            return iter(self._keys)
+        def __reduce__(self):
+            return self.__class__,([(key,self[key]) for key in self._keys],)
+        def update(self,items):
+            if hasattr(items,'keys'):
+                items = [(key,items[key]) for key in items.keys()]
+            for key,value in items:
+                self[key] = value
+        def pop(self,key):
+            self._keys.remove(key)
+            return dict.pop(self,key)
+        def popitem(self,last=True):
+            if len(self._keys) == 0:
+                raise KeyError('dictionary is empty')
+            key = self._keys.pop() if last else self._keys.pop(0)
+            return key,dict.pop(self,key)
 try:
     from itertools import combinations, permutations
 except ImportError:
@@ -979,6 +1017,68 @@ class atan2check(atan2):
     is_real = True
     is_Function = True
 
+class MemoCache:
+    """Content-addressed cache of the results of pure symbolic subproblems (simplification, determinants, etc).
+
+    Results are indexed by the md5 of the srepr of the function name and its arguments, so the same subproblems are shared across solver branches and robots. The cache can be saved to a file and is only loaded back if the ikfast and sympy versions match. At most maxentries results are kept, the least recently used are evicted first.
+    """
+    def __init__(self,maxentries=20000):
+        self.results = OrderedDict()
+        self.maxentries = maxentries
+        self.hits = 0
+        self.misses = 0
+
+    def getkey(self,name,*args):
+        return md5(srepr((name,)+args)).hexdigest()
+
+    def call(self,name,keyargs,fn,*args,**kwargs):
+        """returns fn(*args,**kwargs), or its previous result if one was computed for the same name and keyargs"""
+        key = self.getkey(name,*keyargs)
+        if key in self.results:
+            self.hits += 1
+            # move to the most recently used end
+            result = self.results.pop(key)
+            self.results[key] = result
+        else:
+            self.misses += 1
+            result = fn(*args,**kwargs)
+            self.results[key] = result
+            self.evict()
+        if isinstance(result,list):
+            return list(result)
+        return result
+
+    def evict(self):
+        while len(self.results) > self.maxentries:
+            self.results.popitem(last=False)
+
+    def load(self,filename):
+        try:
+            version,sympyversion,results = pickle.load(open(filename,'rb'))
+            if version != __version__ or sympyversion != sympy_version:
+                log.info('ignoring memo cache %s from ikfast %s, sympy %s',filename,version,sympyversion)
+                return False
+            self.results.update(results)
+            self.evict()
+            log.info('loaded %d memoized results from %s',len(results),filename)
+            return True
+        except Exception, e:
+            log.warn('failed to load memo cache %s: %s',filename,e)
+            return False
+
+    def save(self,filename):
+        try:
+            try:
+                os.makedirs(os.path.split(filename)[0])
+            except OSError:
+                pass
+            tempfilename = filename+'.tmp'
+            pickle.dump((__version__,sympy_version,self.results),open(tempfilename,'wb'),pickle.HIGHEST_PROTOCOL)
+            os.rename(tempfilename,filename)
+            log.info('saved %d memoized results to %s (%d hits, %d misses)',len(self.results),filename,self.hits,self.misses)
+        except Exception, e:
+            log.warn('failed to save memo cache %s: %s',filename,e)
+
 class IKFastSolver(AutoReloader):
     """Solves the analytical inverse kinematics equations. The symbol naming conventions are as follows:
 
@@ -995,6 +1095,8 @@ class IKFastSolver(AutoReloader):
     tjX - tan of joint angle    
     """
 
+    memocache = None # if set to a MemoCache, shared by all the solvers of the process to memoize symbolic subproblems
+
     class CannotSolveError(Exception):
         """thrown when ikfast fails to solve a particular set of equations with the given knowns and unknowns
         """
@@ -1064,6 +1166,7 @@ class IKFastSolver(AutoReloader):
     def __init__(self, kinbody=None,kinematicshash='',precision=None):
         self.usinglapack = False
         self.useleftmultiply = True
+        self.coupledsolvemethods = ['solveLiWoernleHiller','solveKohliOsvatic','solveManochaCanny'] # methods tried in order for solving coupled variables
         self.freevarsubs = []
         self.degeneratecases = None
         self.kinematicshash = kinematicshash
@@ -1335,6 +1438,11 @@ class IKFastSolver(AutoReloader):
         return any([eq.has(*sym) for eq in eqs]) if len(sym) > 0 else False
 
     def trigsimp(self, eq,trigvars):
+        if self.memocache is not None:
+            return self.memocache.call('trigsimp',(eq,[(v,self.isHinge(v.name)) for v in trigvars]),self._trigsimp,eq,trigvars)
+        return self._trigsimp(eq,trigvars)
+
+    def _trigsimp(self, eq,trigvars):
         trigsubs = [(sin(v)**2,1-cos(v)**2) for v in trigvars if self.isHinge(v.name)]
         eq=expand(eq)
         curcount = eq.count_ops()
@@ -1367,20 +1475,25 @@ class IKFastSolver(AutoReloader):
     def checkForDivideByZero(self,eq):
         """returns the equations to check for zero
         """
+        if self.memocache is not None:
+            return self.memocache.call('checkForDivideByZero',(eq,),self._checkForDivideByZero,eq)
+        return self._checkForDivideByZero(eq)
+
+    def _checkForDivideByZero(self,eq):
         checkforzeros = []
         try:
             if eq.is_Function:
                 for arg in eq.args:
-                    checkforzeros += self.checkForDivideByZero(arg)
+                    checkforzeros += self._checkForDivideByZero(arg)
             elif eq.is_Add:
                 for arg in eq.args:
-                    checkforzeros += self.checkForDivideByZero(arg)
+                    checkforzeros += self._checkForDivideByZero(arg)
             elif eq.is_Mul:
                 for arg in eq.args:
-                    checkforzeros += self.checkForDivideByZero(arg)
+                    checkforzeros += self._checkForDivideByZero(arg)
             elif eq.is_Pow:
                 for arg in eq.args:
-                    checkforzeros += self.checkForDivideByZero(arg)
+                    checkforzeros += self._checkForDivideByZero(arg)
                 if eq.exp.is_number and eq.exp < 0:
                     checkforzeros.append(eq.base)
         except AssertionError,e:
@@ -2014,7 +2127,7 @@ class IKFastSolver(AutoReloader):
             rawpolyeqs2 = [None]*len(solvejointvars)
             coupledsolutions = None
             endbranchtree2 = []
-            for solvemethod in [self.solveLiWoernleHiller, self.solveKohliOsvatic, self.solveManochaCanny]:
+            for solvemethod in [getattr(self,name) for name in self.coupledsolvemethods]:
                 if coupledsolutions is not None:
                     break
                 for index in [2,3]:
@@ -2352,7 +2465,7 @@ class IKFastSolver(AutoReloader):
         coupledsolutions = None
         leftovervarstree = []
         origendbranchtree = endbranchtree
-        for solvemethod in [self.solveLiWoernleHiller, self.solveKohliOsvatic, self.solveManochaCanny]:
+        for solvemethod in [getattr(self,name) for name in self.coupledsolvemethods]:
             if coupledsolutions is not None:
                 break
             for j in range(2):
@@ -4067,6 +4180,11 @@ class IKFastSolver(AutoReloader):
         - dot products of combinations of rows/columns are 0
         - cross products of combinations of rows/columns yield the left over row/column
         """
+        if self.memocache is not None:
+            return self.memocache.call('simplifyTransform',(eq,othervars,getattr(self,'Tee',None)),self._simplifyTransform,eq,othervars)
+        return self._simplifyTransform(eq,othervars)
+
+    def _simplifyTransform(self,eq,othervars=None):
         if othervars is not None:
             peq = Poly(eq,*othervars)
             if peq == S.Zero:
@@ -6091,6 +6209,12 @@ class IKFastSolver(AutoReloader):
 
     @staticmethod
     def det_bareis(M,*vars,**kwargs):
+        if IKFastSolver.memocache is not None:
+            return IKFastSolver.memocache.call('det_bareis',(M,vars,sorted(kwargs.items())),IKFastSolver._det_bareis,M,*vars,**kwargs)
+        return IKFastSolver._det_bareis(M,*vars,**kwargs)
+
+    @staticmethod
+    def _det_bareis(M,*vars,**kwargs):
         """Function from sympy with a couple of improvements.
            Compute matrix determinant using Bareis' fraction-free
            algorithm which is an extension of the well known Gaussian
@@ -6243,6 +6367,8 @@ python ikfast.py --robot=robots/barrettwam.robot.xml --baselink=0 --eelink=7 --s
                       help='The language to generate the code in (default=%default), available=('+','.join(name for name,value in CodeGenerators.iteritems())+')')
     parser.add_option('--debug','-d', action='store', type='int',dest='debug',default=logging.INFO,
                       help='Debug level for python nose (smaller values allow more text).')
+    parser.add_option('--memocache', action='store', type='string', dest='memocache',default=None,
+                      help='If set, memoizes the pure symbolic subproblems, loading and saving the results to this file.')
     
     (options, args) = parser.parse_args()
     if options.robot is None or options.baselink is None or options.eelink is None:
@@ -6261,8 +6387,14 @@ python ikfast.py --robot=robots/barrettwam.robot.xml --baselink=0 --eelink=7 --s
             env=openravepy.Environment()
             kinbody=env.ReadRobotXMLFile(options.robot)
             env.Add(kinbody)
+            if options.memocache is not None:
+                IKFastSolver.memocache = MemoCache()
+                if os.path.isfile(options.memocache):
+                    IKFastSolver.memocache.load(options.memocache)
             solver = IKFastSolver(kinbody,kinbody)
             chaintree = solver.generateIkSolver(options.baselink,options.eelink,options.freeindices,solvefn=solvefn)
+            if options.memocache is not None:
+                IKFastSolver.memocache.save(options.memocache)
             code=solver.writeIkSolver(chaintree,lang=options.lang)
         finally:
             openravepy.RaveDestroy()
@@ -157,14 +157,16 @@ class CodeGenerator(AutoReloader):
         self.functions = dict()
         self.kinematicshash=kinematicshash
         self.resetequations() # dictionary of symbols already written
+        self.equationstats = [0,0,0.0] # number of emitted subexpressions, number of reused subexpressions, time spent emitting equations
         self.version=version
 
     def resetequations(self):
-        self.dictequations = [[],[]]
+        """dictequations holds the emitted (symbol,expression) list, a dictionary from canonical expression to emitted symbol, and a dictionary from cse symbols to the emitted symbols they equal"""
+        self.dictequations = [[],{},{}]
     def copyequations(self,dictequations=None):
         if dictequations is None:
             dictequations=self.dictequations
-        return [copy.copy(dictequations[0]),copy.copy(dictequations[1])]
+        return [copy.copy(dictequations[0]),copy.copy(dictequations[1]),copy.copy(dictequations[2])]
 
     def generate(self, solvertree):
         code = """/// autogenerated analytical inverse kinematics code from ikfast program part of OpenRAVE
@@ -375,8 +377,11 @@ inline double IKsign(double f) {
 }
 
 """%(self.version,str(datetime.datetime.now()),self.version)
+        self.equationstats = [0,0,0.0]
+        starttime = time.time()
         code += solvertree.generate(self)
         code += solvertree.end(self)
+        log.info('generated code in %fs, %fs writing equations: %d subexpressions emitted, %d reused',time.time()-starttime,self.equationstats[2],self.equationstats[0],self.equationstats[1])
 
         code += """
 
@@ -387,6 +392,72 @@ IKSolver solver;
 return solver.ComputeIk(eetrans,eerot,pfree,solutions);
 }
 
+/// solves the inverse kinematics equations of num poses given as structure-of-arrays.
+/// \param eetrans 3*num values, eetrans[k*num+i] is the kth translation value of pose i.
+/// \param eerot 9*num values, eerot[k*num+i] is the kth rotation value of pose i.
+/// \param pfree GetNumFreeParameters()*num values with the same layout, can be NULL if there are no free parameters.
+/// \param maxsolutions the max number of solutions stored for every pose.
+/// \param psolutions num*maxsolutions*GetNumJoints() values, solution j of pose i starts at (i*maxsolutions+j)*GetNumJoints(). Free parameters of a solution are set to 0.
+/// \param pnumsolutions num values, the number of solutions found for every pose (can be greater than maxsolutions).
+/// \return the number of poses with at least one solution
+IKFAST_API int ComputeIkBatch(int num, const IkReal* eetrans, const IkReal* eerot, const IkReal* pfree, int maxsolutions, IkReal* psolutions, int* pnumsolutions) {
+IKSolver solver;
+IkSolutionList<IkReal> solutions;
+const int numjoints = GetNumJoints(), numfree = GetNumFreeParameters();
+std::vector<IkReal> vfree(numfree > 0 ? numfree : 1), vsolfree(numjoints);
+IkReal curtrans[3], currot[9];
+int numsolved = 0;
+for(int i = 0; i < num; ++i) {
+    for(int k = 0; k < 3; ++k) {
+        curtrans[k] = eetrans[k*num+i];
+    }
+    for(int k = 0; k < 9; ++k) {
+        currot[k] = eerot[k*num+i];
+    }
+    for(int k = 0; k < numfree; ++k) {
+        vfree[k] = pfree[k*num+i];
+    }
+    solutions.Clear();
+    solver.ComputeIk(curtrans,currot,numfree > 0 ? &vfree[0] : NULL,solutions);
+    int numsolutions = (int)solutions.GetNumSolutions();
+    pnumsolutions[i] = numsolutions;
+    if( numsolutions > 0 ) {
+        ++numsolved;
+    }
+    for(int j = 0; j < numsolutions && j < maxsolutions; ++j) {
+        std::fill(vsolfree.begin(),vsolfree.end(),IkReal(0));
+        solutions.GetSolution(j).GetSolution(&psolutions[((size_t)i*maxsolutions+j)*numjoints],&vsolfree[0]);
+    }
+}
+return numsolved;
+}
+
+/// computes the end effector coordinates of num joint configurations given as structure-of-arrays.
+/// \param joints GetNumJoints()*num values, joints[k*num+i] is the kth joint value of configuration i.
+/// \param eetrans 3*num output values with the same layout.
+/// \param eerot 9*num output values with the same layout.
+IKFAST_API void ComputeFkBatch(int num, const IkReal* joints, IkReal* eetrans, IkReal* eerot) {
+const int numjoints = GetNumJoints();
+std::vector<IkReal> vjoints(numjoints);
+IkReal curtrans[3], currot[9];
+for(int i = 0; i < num; ++i) {
+    for(int k = 0; k < numjoints; ++k) {
+        vjoints[k] = joints[k*num+i];
+    }
+    for(int k = 0; k < 9; ++k) {
+        currot[k] = 0;
+    }
+    curtrans[0] = curtrans[1] = curtrans[2] = 0;
+    ComputeFk(&vjoints[0],curtrans,currot);
+    for(int k = 0; k < 3; ++k) {
+        eetrans[k*num+i] = curtrans[k];
+    }
+    for(int k = 0; k < 9; ++k) {
+        eerot[k*num+i] = currot[k];
+    }
+}
+}
+
 IKFAST_API const char* GetKinematicsHash() { return "%s"; }
 
 IKFAST_API const char* GetIkFastVersion() { return IKFAST_STRINGIZE(IKFAST_VERSION); }
@@ -1548,32 +1619,41 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
         assert(len(exprs)==0)
         return code
     def _writeEquations(self, varnamefn, exprs,ioffset):
+        starttime = time.time()
         code = ''
         replacements,reduced_exprs = customcse(exprs,symbols=self.symbolgen)
-        N = len(self.dictequations[0])
+        emitted,canonicalexprs,aliases = self.dictequations
         for rep in replacements:
-            comparerep = rep[1].subs(self.dictequations[0]).expand()
-            found = False
-            complexity = rep[1].count_ops()
-            maxcomplexity = 3 if N > 1000 else 2
-            if complexity > maxcomplexity: # check only long expressions
-                for i in range(N):
-                    if self.dictequations[1][i] is not None and comparerep-self.dictequations[1][i]==S.Zero:
-                        #self.dictequations.append((rep[0],self.dictequations[0][i][0],self.dictequations[1][i]))
-                        code += 'IkReal %s=%s;\n'%(rep[0],self.dictequations[0][i][0])
-                        found = True
-                        break
-            else:
-                comparerep = None
-            if not found:
-                self.dictequations[0].append(rep)
-                self.dictequations[1].append(comparerep)
-                code2,sepcode2 = self.writeExprCode(rep[1])
-                code += sepcode2+'IkReal %s=%s;\n'%(rep[0],code2)
+            # every symbol that was already found equal to an emitted one is replaced by it, so
+            # structurally equal subexpressions end up with the same canonical form
+            value = self._replaceAliases(rep[1],aliases)
+            if value.is_Symbol:
+                aliases[rep[0]] = value
+                self.equationstats[1] += 1
+                continue
+            canonicalexpr = value.expand()
+            symbol = canonicalexprs.get(canonicalexpr,None)
+            if symbol is not None:
+                aliases[rep[0]] = symbol
+                self.equationstats[1] += 1
+                continue
+            canonicalexprs[canonicalexpr] = rep[0]
+            emitted.append((rep[0],value))
+            self.equationstats[0] += 1
+            code2,sepcode2 = self.writeExprCode(value)
+            code += sepcode2+'IkReal %s=%s;\n'%(rep[0],code2)
         for i,rexpr in enumerate(reduced_exprs):
+            rexpr = self._replaceAliases(rexpr,aliases)
             code2,sepcode2 = self.writeExprCode(rexpr)
             code += sepcode2+'%s=%s;\n'%(varnamefn(i+ioffset), code2)
+        self.equationstats[2] += time.time()-starttime
         return code
+    @staticmethod
+    def _replaceAliases(expr,aliases):
+        # aliases never map to other aliased symbols, so substituting them one after the other is the same as replacing them all at once
+        if len(aliases) == 0:
+            return expr
+        return expr.subs([(symbol,aliases[symbol]) for symbol in expr.atoms(Symbol) if symbol in aliases])
 
     def writeExprCode(self, expr):
         # go through all arguments and chop them
@@ -57,6 +57,54 @@ except ImportError:
         rel_list = [pardir] * (len(start_list)-i) + path_list[i:]
         return curdir if not rel_list else join(*rel_list)
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    # OrderedDict is not present in python 2.6 and below, so hold a minimal implementation of it with a list of the keys in insertion order.
+    class OrderedDict(dict):
+        """Supports the operations used by the database caches, removing a key is linear in the number of keys"""
+        def __init__(self,items=()):
+            dict.__init__(self)
+            self._keys = []
+            self.update(items)
+        def __setitem__(self,key,value):
+            if not key in self:
+                self._keys.append(key)
+            dict.__setitem__(self,key,value)
+        def __delitem__(self,key):
+            dict.__delitem__(self,key)
+            self._keys.remove(key)
+        def __iter__(self):
+            return iter(self._keys)
+        def __reduce__(self):
+            return self.__class__,(self.items(),)
+        def keys(self):
+            return list(self._keys)
+        def values(self):
+            return [self[key] for key in self._keys]
+        def items(self):
+            return [(key,self[key]) for key in self._keys]
+        def update(self,items):
+            if hasattr(items,'keys'):
+                items = [(key,items[key]) for key in items.keys()]
+            for key,value in items:
+                self[key] = value
+        def pop(self,key,*default):
+            if key in self:
+                self._keys.remove(key)
+                return dict.pop(self,key)
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(key)
+        def popitem(self,last=True):
+            if len(self._keys) == 0:
+                raise KeyError('dictionary is empty')
+            key = self._keys.pop() if last else self._keys.pop(0)
+            return key,dict.pop(self,key)
+        def clear(self):
+            dict.clear(self)
+            del self._keys[:]
+
 def LoadTrajectoryFromFile(env,trajfile,trajtype=''):
     return openravepy_int.RaveCreateTrajectory(env,trajtype).deserialize(open(trajfile,'r').read())
 
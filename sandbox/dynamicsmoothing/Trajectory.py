@@ -40,6 +40,15 @@ def Execute(robot,sample_traj,t_sleep,stepsize=1):
 
 def CheckCollisionTraj(robot,sample_traj):
     n=robot.GetDOF()
+    if sample_traj.dim==n:
+        q=transpose(sample_traj.q_vect[:,0:sample_traj.n_steps])
+        envcoll=flatnonzero(robot.CheckConfigurationsCollision(q,selfcollision=False,stopatfirst=True))
+        selfcoll=flatnonzero(robot.CheckConfigurationsCollision(q,envcollision=False,stopatfirst=True))
+        if len(envcoll)>0 and (len(selfcoll)==0 or envcoll[0]<=selfcoll[0]):
+            return [True,'env',envcoll[0]]
+        if len(selfcoll)>0:
+            return [True,'self',selfcoll[0]]
+        return [False,None,None]
     for i in range(sample_traj.n_steps):
         with robot:
             if sample_traj.dim==n+6:
@@ -250,13 +259,10 @@ def CastTrajRave(traj,dof_list,t_step):
     t_step=t_vect[1]-t_vect[0]
     t_step2=2*t_step
 
-    q_vect=zeros((dim,n))
+    q_vect=transpose(traj.SampleRange(t_vect)[:,dof_list])
     qd_vect=zeros((dim,n))
     qdd_vect=zeros((dim,n))
 
-    for i in range(n):
-        q_vect[:,i]=traj.Sample(t_vect[i])[dof_list]
-
     for i in range(1,n-1):
         qd_vect[:,i]=(q_vect[:,i+1]-q_vect[:,i-1])/t_step2
     qd_vect[:,0]=(q_vect[:,1]-q_vect[:,0])/t_step
@@ -73,6 +73,15 @@ def Execute(robot,sample_traj,t_sleep,stepsize=1,drawcom=0,wait_end=0):
 
 def CheckCollisionTraj(robot,sample_traj):
     n=robot.GetDOF()
+    if sample_traj.dim==n:
+        q=transpose(sample_traj.q_vect[:,0:sample_traj.n_steps])
+        envcoll=flatnonzero(robot.CheckConfigurationsCollision(q,selfcollision=False,stopatfirst=True))
+        selfcoll=flatnonzero(robot.CheckConfigurationsCollision(q,envcollision=False,stopatfirst=True))
+        if len(envcoll)>0 and (len(selfcoll)==0 or envcoll[0]<=selfcoll[0]):
+            return [True,'env',envcoll[0]]
+        if len(selfcoll)>0:
+            return [True,'self',selfcoll[0]]
+        return [False,None,None]
     for i in range(sample_traj.n_steps):
         with robot:
             if sample_traj.dim==n+6:
@@ -312,13 +321,10 @@ def CastTrajRave(traj,dof_list,t_step):
     t_step=t_vect[1]-t_vect[0]
     t_step2=2*t_step
 
-    q_vect=zeros((dim,n))
+    q_vect=transpose(traj.SampleRange(t_vect)[:,dof_list])
     qd_vect=zeros((dim,n))
     qdd_vect=zeros((dim,n))
 
-    for i in range(n):
-        q_vect[:,i]=traj.Sample(t_vect[i])[dof_list]
-
     for i in range(1,n-1):
         qd_vect[:,i]=(q_vect[:,i+1]-q_vect[:,i-1])/t_step2
     qd_vect[:,0]=(q_vect[:,1]-q_vect[:,0])/t_step
@@ -445,15 +451,13 @@ def linear_smooth_dichotomy(robot,vp_list,coll_check_step):
         p2=vp_list[-1]
         d=norm(p2-p1)
         v_unit=(p2-p1)/d
-        for t in linspace(0,d,d/coll_check_step+1):
-            p=p1+t*v_unit
-            with robot:
-                robot.SetDOFValues(p)
-                if robot.GetEnv().CheckCollision(robot):
-                    l1=linear_smooth_dichotomy(robot,vp_list[0:len(vp_list)/2+1],coll_check_step)
-                    l2=linear_smooth_dichotomy(robot,vp_list[len(vp_list)/2:len(vp_list)],coll_check_step)
-                    l1.extend(l2[1:])
-                    return l1
+        t_vect=linspace(0,d,d/coll_check_step+1)
+        p_vect=p1+outer(t_vect,v_unit)
+        if any(robot.CheckConfigurationsCollision(p_vect,selfcollision=False,stopatfirst=True)):
+            l1=linear_smooth_dichotomy(robot,vp_list[0:len(vp_list)/2+1],coll_check_step)
+            l2=linear_smooth_dichotomy(robot,vp_list[len(vp_list)/2:len(vp_list)],coll_check_step)
+            l1.extend(l2[1:])
+            return l1
         return [p1,p2]
 
 
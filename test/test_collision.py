@@ -50,6 +50,29 @@ class RunCollision(EnvironmentSetup):
                 assert(check==robot.CheckSelfCollision())
                 env.Remove(robot)
 
+    def test_configurationscollision(self):
+        env=self.env
+        with env:
+            self.LoadEnv('data/lab1.env.xml')
+            robot=env.GetRobots()[0]
+            lower,upper = robot.GetDOFLimits()
+            configs = random.rand(20,robot.GetDOF())*(upper-lower)+lower
+            origvalues = robot.GetDOFValues()
+            mask,pairs = robot.CheckConfigurationsCollision(configs,returnpairs=True)
+            assert(transdist(robot.GetDOFValues(),origvalues) <= g_epsilon)
+            assert(mask.shape == (len(configs),) and len(pairs) == len(configs))
+            for i,config in enumerate(configs):
+                robot.SetDOFValues(config)
+                assert(mask[i] == (env.CheckCollision(robot) or robot.CheckSelfCollision()))
+                assert((pairs[i] is not None) == mask[i])
+            robot.SetDOFValues(origvalues)
+            firstmask = robot.CheckConfigurationsCollision(configs,stopatfirst=True)
+            if any(mask):
+                assert(sum(firstmask) == 1 and argmax(firstmask) == argmax(mask))
+            indices = robot.GetManipulators()[0].GetArmIndices()
+            armmask = robot.CheckConfigurationsCollision(configs[:,indices],indices)
+            assert(armmask.shape == (len(configs),))
+
     def test_selfcollision(self):
         with self.env:
             self.LoadEnv('data/lab1.env.xml')
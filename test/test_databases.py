@@ -12,6 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from common_test_openrave import *
+import tempfile, shutil, re, ctypes
+from openravepy import pyANN
+
+class CheckpointTestModel(databases.DatabaseGenerator):
+    """squares the integers below num, failing at failat"""
+    def __init__(self,robot,filename,failat=None):
+        databases.DatabaseGenerator.__init__(self,robot=robot)
+        self.filename = filename
+        self.failat = failat
+        self.squares = None
+        self.consumed = []
+    def getfilename(self,read=False):
+        return self.filename
+    def getcheckpointstate(self):
+        return list(self.squares)
+    def setcheckpointstate(self,state):
+        self.squares = state
+    def generatepcg(self,num):
+        self.squares = []
+        def producer():
+            for i in range(num):
+                yield (i,)
+        def consumer(i):
+            if i == self.failat:
+                raise ValueError('failing at %d'%i)
+            self.consumed.append(i)
+            return (i*i,)
+        def gatherer(square=None):
+            if square is not None:
+                self.squares.append(square)
+        return producer,consumer,gatherer,num
+
 
 class TestDatabases(EnvironmentSetup):
     def test_ikmodulegeneration(self):
@@ -38,5 +70,813 @@ class TestDatabases(EnvironmentSetup):
             assert(out is not None)
             assert(manip.GetIkSolver() is not None)
             
+    def test_checkpointresume(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir,'squares.pp')
+            model = CheckpointTestModel(robot,filename,failat=12)
+            model.checkpointinterval = -1 # checkpoint after every item
+            assert_raises(ValueError,model.generate,20)
+            assert(os.path.isfile(model.getcheckpointfilename()))
+            # only resumed for the same parameters
+            model2 = CheckpointTestModel(robot,filename)
+            model2.generate(21)
+            assert(model2.consumed == range(21) and model2.squares == [i*i for i in range(21)])
+            assert(not os.path.isfile(model.getcheckpointfilename()))
+
+            assert_raises(ValueError,model.generate,20)
+            model3 = CheckpointTestModel(robot,filename)
+            model3.generate(20)
+            assert(model3.consumed == range(12,20) and model3.squares == [i*i for i in range(20)])
+            assert(not os.path.isfile(model.getcheckpointfilename()))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_quaternionkdtree(self):
+        poses = random.rand(200,7)-0.5
+        poses[:,0:4] /= transpose(tile(sqrt(sum(poses[:,0:4]**2,1)),(4,1)))
+        queries = array(poses[:10])
+        queries[:,4:] += 0.01
+        transmult = 4.0
+        kdtree = databases.kinematicreachability.ReachabilityModel.QuaternionKDTree(poses,transmult)
+        k = 5
+        neighs,dists = kdtree.kSearch(queries,k,0)
+        assert(neighs.shape == (len(queries),k) and dists.shape == (len(queries),k))
+        assert(transdist(queries[:,4:]-0.01,poses[:10,4:]) <= g_epsilon) # queries are not modified
+        for i,query in enumerate(queries):
+            # a quaternion and its negation are the same rotation, so both are searched
+            quatdists = r_[sum((poses[:,0:4]-query[0:4])**2,1),sum((poses[:,0:4]+query[0:4])**2,1)]
+            bruteforcedists = sort(quatdists+transmult**2*tile(sum((poses[:,4:]-query[4:])**2,1),2))[:k]
+            assert(numpy.max(abs(dists[i]-bruteforcedists)) <= g_epsilon)
+            assert(all(neighs[i] >= 0) and all(neighs[i] < len(poses)))
+        assert_raises(pyANN.pyann_exception,kdtree.nnposes.kSearchArray,zeros((2,5)),k,0)
+        assert_raises(pyANN.pyann_exception,kdtree.nnposes.kSearchArray,zeros((2,7)),2*len(poses)+1,0)
+        assert_raises(pyANN.pyann_exception,kdtree.nnposes.kFRSearchArray,zeros((2,6)),0.1,k,0)
+
+    def test_reachabilitymemorymapped(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        rmodel = databases.kinematicreachability.ReachabilityModel(robot)
+        N = 5000
+        # the last column holds the row ids to match rows after they are sorted into cells
+        stats = c_[random.rand(N,4),random.rand(N,3)*0.8-0.4,arange(N)]
+        rmodel.reachabilitystats = array(stats)
+        rmodel.reachabilitydensity3d = random.rand(5,6,7)
+        rmodel.reachability3d = random.rand(5,6,7)
+        rmodel.pointscale = array((25.0,10))
+        rmodel.xyzdelta = 0.04
+        rmodel.quatdelta = 0.5
+        try:
+            rmodel.save()
+            assert(os.path.isfile(rmodel.getfilename(True)))
+            rmodel2 = databases.kinematicreachability.ReachabilityModel(robot)
+            assert(rmodel2.LoadMemoryMapped())
+            loadedstats = array(rmodel2.reachabilitystats)
+            assert(transdist(loadedstats[argsort(loadedstats[:,7])],stats) <= g_epsilon)
+            assert(transdist(rmodel2.reachability3d,rmodel.reachability3d) <= g_epsilon)
+            assert(transdist(rmodel2.reachabilitydensity3d,rmodel.reachabilitydensity3d) <= g_epsilon)
+            radius = 0.1
+            positions = stats[:20,4:7]+0.01
+            for position in positions:
+                # the cells cover at least all the rows in the box around position
+                cellstats = rmodel2.GetCellReachabilityStats(position,radius)
+                insideids = flatnonzero(numpy.all(abs(stats[:,4:7]-position) <= radius,1))
+                assert(len(setdiff1d(insideids,array(cellstats[:,7],int))) == 0)
+            density = rmodel2.ComputeTranslationDensity(positions,radius)
+            assert(all(density == [sum(sum((stats[:,4:7]-position)**2,1) <= radius**2) for position in positions]))
+        finally:
+            for name in ['header','reachabilitystats','reachabilitydensity3d','reachability3d','celloffsets']:
+                filename = rmodel.getmmapfilename(name,False)
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            if os.path.isfile(rmodel.getfilename(False)):
+                os.remove(rmodel.getfilename(False))
+
+    def test_pointsinsidehulls(self):
+        hulls = []
+        for i in range(5):
+            lower = random.rand(3)-0.5
+            upper = lower+0.1+0.4*random.rand(3)
+            vertices = array([[x,y,z] for x in [lower[0],upper[0]] for y in [lower[1],upper[1]] for z in [lower[2],upper[2]]])
+            planes = r_[c_[eye(3),-upper],c_[-eye(3),lower]]
+            hulls.append((vertices,None,planes))
+        points = random.rand(5000,3)*1.6-0.8
+        insidepoints = databases.linkstatistics.LinkStatisticsModel.ComputePointsInsideHulls(points,hulls,chunksize=700)
+        for i,point in enumerate(points):
+            inside = False
+            for hull in hulls:
+                if all(dot(hull[2][:,0:3],point)+hull[2][:,3] <= 0):
+                    inside = True
+                    break
+            assert(insidepoints[i] == inside)
+        assert(any(insidepoints) and not all(insidepoints))
+
+    def test_voxelpointset(self):
+        points = random.rand(2000,3)
+        resolution = 0.05
+        pointset = databases.linkstatistics.VoxelPointSet(resolution)
+        inds0 = pointset.insert(points[:1000])
+        inds1 = pointset.insert(points[1000:])
+        # keep the first point of every voxel
+        voxels = set()
+        keptindices = []
+        for i,point in enumerate(points):
+            voxel = tuple(floor(point/resolution).astype(int))
+            if not voxel in voxels:
+                voxels.add(voxel)
+                keptindices.append(i)
+        assert(len(pointset) == len(voxels))
+        assert(all(r_[inds0,1000+inds1] == keptindices))
+        assert(transdist(pointset.getPoints(),points[keptindices]) <= g_epsilon)
+        assert_raises(ValueError,pointset.insert,array([[1e20,0,0]]))
+        assert_raises(ValueError,databases.linkstatistics.VoxelPointSet,resolution,4)
+
+        neighsize = 3
+        voxelcounts = dict()
+        keptindices = []
+        for i,point in enumerate(points):
+            voxel = tuple(floor(point/resolution).astype(int))
+            voxelcounts[voxel] = voxelcounts.get(voxel,0)+1
+            if voxelcounts[voxel] <= neighsize:
+                keptindices.append(i)
+        inds = databases.linkstatistics.LinkStatisticsModel.PrunePointsVoxelGrid(points,resolution,neighsize)
+        assert(all(inds == keptindices))
+
+    def test_prunepoints(self):
+        # tight clusters of 3 points at the centers of the cells of a grid
+        cellsize = 0.1
+        centers = (array([[x,y] for x in range(6) for y in range(5)])+0.5)*cellsize
+        points = reshape(tile(centers,(1,3)),(-1,2))+(random.rand(3*len(centers),2)-0.5)*0.1*cellsize
+        LinkStatisticsModel = databases.linkstatistics.LinkStatisticsModel
+        # within a cluster both keep the first point, the kdtree radius has to stay below the distance to the other clusters
+        kdtreeinds = LinkStatisticsModel.PrunePointsKDTree(points,(0.5*cellsize)**2,1)
+        voxelinds = LinkStatisticsModel.PrunePointsVoxelGrid(points,cellsize,1)
+        assert(all(array(kdtreeinds) == arange(0,len(points),3)))
+        assert(all(voxelinds == kdtreeinds))
+        assert(all(LinkStatisticsModel.PrunePointsVoxelGrid(points,cellsize,2) == sort(r_[arange(0,len(points),3),arange(1,len(points),3)])))
+        # a cell wide radius also prunes the neighboring clusters, while the cells keep one point each
+        assert(len(LinkStatisticsModel.PrunePointsKDTree(points,(1.5*cellsize)**2,1)) < len(centers))
+        assert(len(LinkStatisticsModel.PrunePointsVoxelGrid(points,cellsize,1)) == len(centers))
+
+    def test_ikresultcache(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        class FakeManipulator:
+            def __init__(self):
+                self.queries = []
+            def GetKinematicsStructureHash(self):
+                return 'hash'
+            def GetName(self):
+                return 'arm'
+            def GetRobot(self):
+                return robot
+            def FindIKSolution(self,ikparam,filteroptions):
+                self.queries.append(array(ikparam))
+                return None if ikparam[0,3] < 0 else ikparam[0:3,3]
+        manip = FakeManipulator()
+        tempdir = tempfile.mkdtemp()
+        try:
+            ikcache = databases.inversekinematics.IkResultCache(maxsize=3,filename=os.path.join(tempdir,'ikcache.pp'))
+            Ts = [matrixFromPose(r_[1,0,0,0,x,0.5,0.5]) for x in [0.1,-0.2,0.3,0.4]]
+            for T in Ts+Ts[-2:]:
+                solution = ikcache.FindIKSolution(manip,T,0)
+                expected = manip.FindIKSolution(T,0)
+                manip.queries.pop()
+                assert((solution is None) == (expected is None))
+                if solution is not None:
+                    assert(transdist(solution,expected) <= g_epsilon)
+            assert(len(manip.queries) == 4 and ikcache.hits == 2 and ikcache.misses == 4 and len(ikcache) == 3)
+            # the least recently used query was evicted
+            ikcache.FindIKSolution(manip,Ts[0],0)
+            assert(len(manip.queries) == 5)
+            # moving the robot changes the environment stamp
+            with robot:
+                robot.SetTransform(matrixFromPose(r_[1,0,0,0,1,0,0]))
+                ikcache.FindIKSolution(manip,Ts[0],0)
+            assert(len(manip.queries) == 6)
+            ikcache.save()
+            ikcache2 = databases.inversekinematics.IkResultCache(maxsize=3,filename=ikcache.filename)
+            assert(len(ikcache2) == 3)
+            ikcache2.FindIKSolution(manip,Ts[0],0)
+            assert(len(manip.queries) == 6 and ikcache2.hits == 1)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_solvebatch(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,IkParameterization.Type.Transform6D)
+        if not ikmodel.load():
+            ikmodel.autogenerate()
+        manip = ikmodel.manip
+        with env:
+            armindices = manip.GetArmIndices()
+            lower,upper = robot.GetDOFLimits(armindices)
+            Ts = []
+            with robot:
+                for i in range(20):
+                    robot.SetDOFValues(random.rand(len(armindices))*(upper-lower)+lower,armindices)
+                    Ts.append(manip.GetTransform())
+            # one unreachable target
+            Ts.append(array(Ts[0]))
+            Ts[-1][0:3,3] += 10.0
+            Ts = array(Ts)
+            firstsolutions = [manip.FindIKSolution(T,0) for T in Ts]
+            allsolutions = [manip.FindIKSolutions(T,0) for T in Ts]
+            assert(firstsolutions[-1] is None)
+
+            numsolutions,solutions = ikmodel.solveBatch(Ts,0,firstonly=True,returnsolutions=True)
+            assert(solutions.shape == (len(Ts),len(armindices)))
+            for i,solution in enumerate(firstsolutions):
+                assert(numsolutions[i] == (solution is not None))
+                if solution is not None:
+                    assert(transdist(solutions[i],solution) <= g_epsilon)
+                else:
+                    assert(all(isnan(solutions[i])))
+            numsolutions,solutions = ikmodel.solveBatch(poseFromMatrices(Ts),0,firstonly=False,returnsolutions=True)
+            assert(all(numsolutions == [len(sols) for sols in allsolutions]))
+            assert(transdist(solutions,[sol for sols in allsolutions for sol in sols]) <= g_epsilon)
+            numsolutions,solutions = ikmodel.solveBatch([IkParameterization(T,IkParameterizationType.Transform6D) for T in Ts],0)
+            assert(solutions is None and all(numsolutions == [solution is not None for solution in firstsolutions]))
+
+    def test_ikbatch(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,IkParameterization.Type.Transform6D)
+        if not ikmodel.load():
+            ikmodel.autogenerate()
+        library,dtype = ikmodel.getIkLibrary()
+        numjoints = library.GetNumJoints()
+        armindices = list(ikmodel.manip.GetArmIndices())
+        freecolumns = [armindices.index(index) for index in ikmodel.freeindices]
+        assert(numjoints == len(armindices) and library.GetNumFreeParameters() == len(freecolumns))
+        lower,upper = robot.GetDOFLimits(armindices)
+        joints = random.rand(50,numjoints)*(upper-lower)+lower
+        free = joints[:,freecolumns]
+        eetrans,eerot = ikmodel.computeFkBatch(joints)
+        assert(eetrans.shape == (len(joints),3) and eerot.shape == (len(joints),9))
+        library.ComputeFk.restype = None
+        for i,values in enumerate(joints):
+            posetrans = zeros(3,dtype)
+            poserot = zeros(9,dtype)
+            library.ComputeFk(array(values,dtype).ctypes.data_as(ctypes.c_void_p),posetrans.ctypes.data_as(ctypes.c_void_p),poserot.ctypes.data_as(ctypes.c_void_p))
+            assert(transdist(eetrans[i],posetrans) <= g_epsilon and transdist(eerot[i],poserot) <= g_epsilon)
+        numsolutions,solutions = ikmodel.computeIkBatch(eetrans,eerot,free)
+        assert(solutions.shape == (len(joints),16,numjoints))
+        for i in range(len(joints)):
+            # the batch gives the same solutions as solving every pose on its own
+            numsolutions2,solutions2 = ikmodel.computeIkBatch(eetrans[i:(i+1)],reshape(eerot[i],(3,3)),free[i:(i+1)])
+            assert(numsolutions2[0] == numsolutions[i])
+            assert(all(isnan(solutions2[0]) == isnan(solutions[i])))
+            validsolutions = solutions[i,0:min(numsolutions[i],16)]
+            assert(transdist(solutions2[0,0:len(validsolutions)],validsolutions) <= g_epsilon)
+            # the configuration the pose came from is one of the solutions, and every solution reaches the pose
+            assert(numsolutions[i] > 0)
+            assert(min(sum(abs(mod(validsolutions-joints[i]+pi,2*pi)-pi),1)) <= g_epsilon)
+            soltrans,solrot = ikmodel.computeFkBatch(validsolutions)
+            assert(transdist(soltrans,tile(eetrans[i],(len(validsolutions),1))) <= g_epsilon)
+            assert(transdist(solrot,tile(eerot[i],(len(validsolutions),1))) <= g_epsilon)
+
+    def test_ikfastcompilecache(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            ikcompiler = databases.inversekinematics.IkFastCompiler(cachedir=os.path.join(tempdir,'cache'))
+            sourcefilenames = []
+            for i in range(2):
+                sourcefilename = os.path.join(tempdir,'source%d'%i,'ik.cpp')
+                os.makedirs(os.path.split(sourcefilename)[0])
+                open(sourcefilename,'w').write('extern "C" int GetValue() { return %d; }\n'%(i+1))
+                sourcefilenames.append(sourcefilename)
+            # only the first compile of a source runs the compiler
+            output_filenames = [os.path.join(tempdir,'output%d'%i,'ik.so') for i in range(3)]
+            assert(not ikcompiler.compile(sourcefilenames[0],output_filenames[0]))
+            assert(ikcompiler.compile(sourcefilenames[0],output_filenames[1]))
+            assert(open(output_filenames[0],'rb').read() == open(output_filenames[1],'rb').read())
+            assert(ctypes.CDLL(output_filenames[1]).GetValue() == 1)
+            # the cache is indexed by the content, so the same source in another directory is found too
+            shutil.copytree(os.path.split(sourcefilenames[0])[0],os.path.join(tempdir,'source2'))
+            assert(ikcompiler.compile(os.path.join(tempdir,'source2','ik.cpp'),output_filenames[2]))
+            # the source, the ikfast.h next to it, and the options are all part of the key
+            compiler,compile_flags,link_flags,libraries = ikcompiler.getCompileOptions(sourcefilenames[0])
+            cachedfilename = ikcompiler.getCacheFilename(sourcefilenames[0],compiler,compile_flags,link_flags,libraries)
+            assert(os.path.isfile(cachedfilename))
+            assert(ikcompiler.getCacheFilename(sourcefilenames[0],compiler,compile_flags,link_flags,libraries) == cachedfilename)
+            assert(ikcompiler.getCacheFilename(sourcefilenames[0],compiler,compile_flags+['-DIKFAST_TEST'],link_flags,libraries) != cachedfilename)
+            assert(ikcompiler.getCacheFilename(sourcefilenames[0],compiler,compile_flags,link_flags,None) != cachedfilename)
+            assert(ikcompiler.getCacheFilename(sourcefilenames[1],compiler,compile_flags,link_flags,libraries) != cachedfilename)
+            open(os.path.join(tempdir,'source0','ikfast.h'),'w').write('// ikfast header\n')
+            assert(ikcompiler.getCacheFilename(sourcefilenames[0],compiler,compile_flags,link_flags,libraries) != cachedfilename)
+            # parallel compiles return the results in the order of the jobs
+            jobs = [(sourcefilename,os.path.join(tempdir,'many%d'%i,'ik.so'),False) for i,sourcefilename in enumerate(sourcefilenames)]
+            assert(ikcompiler.compileMany(jobs,numprocesses=2) == [False,False])
+            assert(ikcompiler.compileMany(jobs,numprocesses=2) == [True,True])
+            assert(ctypes.CDLL(jobs[1][1]).GetValue() == 2)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_iksearchparallel(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,IkParameterization.Type.Translation3D)
+        ikmodel.numthreads = 2 # at least two worker processes
+        for parallelsearch in ['first','simplest']:
+            ikmodel.freeindices = None
+            ikmodel.generate(parallelsearch=parallelsearch)
+            assert(ikmodel.ikfeasibility is None)
+            assert(len(ikmodel.freeindices) == len(ikmodel.manip.GetArmIndices())-3)
+            with env:
+                lower,upper = robot.GetDOFLimits(ikmodel.manip.GetArmIndices())
+                with robot:
+                    # the free joints are kept at their current values, so the target is reachable with them
+                    robot.SetDOFValues(0.5*(lower+upper),ikmodel.manip.GetArmIndices())
+                    ikparam = ikmodel.manip.GetIkParameterization(IkParameterizationType.Translation3D)
+                    solution = ikmodel.manip.FindIKSolution(ikparam,0)
+                    assert(solution is not None)
+                    robot.SetDOFValues(solution,ikmodel.manip.GetArmIndices())
+                    assert(transdist(ikmodel.manip.GetTransform()[0:3,3],ikparam.GetTranslation3D()) <= g_epsilon)
+
+    def test_ikfastgeneration(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,IkParameterization.Type.Translation3D)
+        # generates with the sympy version openrave was configured with, this is the bundled 0.7.1 unless the system one is newer
+        ikmodel.generate(forceikbuild=True)
+        assert(ikmodel.ikfeasibility is None)
+        code = open(ikmodel.getsourcefilename(True)).read()
+        # equal subexpressions are reused directly instead of being aliased to a new temporary
+        assert(re.search('IkReal x[0-9]+=x[0-9]+;',code) is None)
+        with env:
+            armindices = ikmodel.manip.GetArmIndices()
+            lower,upper = robot.GetDOFLimits(armindices)
+            with robot:
+                for i in range(20):
+                    robot.SetDOFValues(random.rand(len(armindices))*(upper-lower)+lower,armindices)
+                    if robot.CheckSelfCollision():
+                        continue
+                    ikparam = ikmodel.manip.GetIkParameterization(IkParameterizationType.Translation3D)
+                    solutions = ikmodel.manip.FindIKSolutions(ikparam,0)
+                    assert(len(solutions) > 0)
+                    for solution in solutions:
+                        robot.SetDOFValues(solution,armindices)
+                        assert(transdist(ikmodel.manip.GetTransform()[0:3,3],ikparam.GetTranslation3D()) <= g_epsilon)
+
+    def test_graspmemorymapped(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=env.GetKinBody('mug1'))
+        gmodel.init(friction=0.4,avoidlinks=[])
+        N = 2000
+        grasps = random.rand(N,gmodel.totaldof)
+        directions = random.randn(N,3)
+        # the approach directions do not have to be normalized
+        grasps[:,gmodel.graspindices['igraspdir']] = directions*(0.5+random.rand(N,1))
+        grasps[:,gmodel.graspindices['igrasppos']] = random.rand(N,3)*0.2-0.1
+        gmodel.grasps = array(grasps)
+        try:
+            gmodel.save()
+            assert(os.path.isfile(gmodel.getfilename(True)))
+            gmodel2 = databases.grasping.GraspingModel(robot=robot,target=env.GetKinBody('mug1'))
+            assert(gmodel2.load())
+            assert(isinstance(gmodel2.grasps,numpy.memmap))
+            assert(transdist(gmodel2.grasps,grasps) <= g_epsilon)
+            assert(transdist(gmodel2.getGraspField('igrasppos'),grasps[:,gmodel.graspindices['igrasppos']]) <= g_epsilon)
+            normdirections = directions/sqrt(sum(directions**2,1))[:,newaxis]
+            positions = grasps[:,gmodel.graspindices['igrasppos']]
+            for direction,angle in [((0,0,1),0.1),((1,1,0),0.5),(random.randn(3),1.0),(random.randn(3),pi)]:
+                normdirection = array(direction,float)/linalg.norm(direction)
+                indices = gmodel2.getGraspIndicesByApproach(direction,angle)
+                assert(all(indices == flatnonzero(dot(normdirections,normdirection) >= cos(angle))))
+                position = array((0.02,-0.01,0.03))
+                indices = gmodel2.getGraspIndicesByApproach(direction,angle,position,0.05)
+                assert(all(indices == flatnonzero(logical_and(dot(normdirections,normdirection) >= cos(angle),sum((positions-position)**2,1) <= 0.05**2))))
+            assert_raises(ValueError,gmodel2.getGraspIndicesByApproach,(0,0,1),0.1,position)
+            # the legacy file is loaded when there are no memory-mapped files
+            os.remove(gmodel.getmmapfilename('header',False))
+            gmodel3 = databases.grasping.GraspingModel(robot=robot,target=env.GetKinBody('mug1'))
+            assert(gmodel3.load())
+            assert(transdist(gmodel3.grasps,grasps) <= g_epsilon)
+        finally:
+            for name in ['header','grasps','approachorder','approachoffsets']:
+                filename = gmodel.getmmapfilename(name,False)
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            if os.path.isfile(gmodel.getfilename(False)):
+                os.remove(gmodel.getfilename(False))
+
+    def test_graspprefilter(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        target=env.GetKinBody('mug1')
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=target)
+        gmodel.init(friction=0.4,avoidlinks=[])
+        manip = gmodel.manip
+        rmodel = databases.kinematicreachability.ReachabilityModel(robot)
+        with env:
+            Ttarget = target.GetTransform()
+            center = Ttarget[0:3,3]
+            obstacle = RaveCreateKinBody(env,'')
+            obstacle.SetName('prefilterobstacle')
+            obstacle.InitFromBoxes(array([r_[center+array((0.1,0.0,0.1)),0.05,0.05,0.05]]),True)
+            env.Add(obstacle)
+            gripperlower,gripperupper = robot.GetDOFLimits(manip.GetGripperIndices())
+            preshapes = [gripperlower,0.5*(gripperlower+gripperupper)]
+            N = 300
+            grasps = zeros((N,gmodel.totaldof))
+            for i in range(N):
+                Tlocal = matrixFromAxisAngle(random.randn(3))
+                Tlocal[0:3,3] = random.rand(3)*0.6-0.3
+                grasps[i,gmodel.graspindices['grasptrans_nocol']] = transpose(Tlocal[0:3,0:4]).flatten()
+                grasps[i,gmodel.graspindices['igraspdir']] = Tlocal[0:3,2]
+                grasps[i,gmodel.graspindices['igrasppreshape']] = preshapes[i%2]
+            gmodel.grasps = grasps
+            backupdist = 0.05
+            workspacebounds = array([center-0.2,center+0.25])
+            workspaceplanes = array([[0,0,1,0.05-center[2]]])
+            # a random 8x8x8 reachability grid of 0.1m cells around the grasps
+            Tbaseinv = linalg.inv(manip.GetBase().GetTransform())
+            baseanchor = transformPoints(Tbaseinv,[rmodel.getOrderedArmJoints()[0].GetAnchor()])[0]
+            rmodel.reachability3d = (random.rand(8,8,8) > 0.8)*random.rand(8,8,8)
+            rmodel.pointscale = array((10.0,4.0))
+            rmodel.pointscale[1] -= rmodel.pointscale[0]*(transformPoints(Tbaseinv,[center])[0]-baseanchor)
+
+            def getpositions(grasp):
+                T = gmodel.getGlobalGraspTransform(grasp,collisionfree=True)
+                return T,[T[0:3,3],T[0:3,3]-backupdist*gmodel.getGlobalApproachDir(grasp)]
+            def inworkspace(grasp):
+                T,positions = getpositions(grasp)
+                return all([all(p >= workspacebounds[0]) and all(p <= workspacebounds[1]) and dot(workspaceplanes[0,0:3],p)+workspaceplanes[0,3] >= 0 for p in positions])
+            def getreachability(p):
+                gridposition = rmodel.pointscale[0]*(transformPoints(Tbaseinv,[p])[0]-baseanchor)+rmodel.pointscale[1]
+                value = 0
+                for offset in [(i,j,k) for i in range(2) for j in range(2) for k in range(2)]:
+                    ind = array(floor(gridposition),int)+offset
+                    if all(ind >= 0) and all(ind < 8):
+                        value = max(value,rmodel.reachability3d[ind[0],ind[1],ind[2]])
+                return value
+            def isreachable(grasp):
+                T,positions = getpositions(grasp)
+                return all([getreachability(p) > 0 for p in positions])
+            obstacleab = obstacle.GetLinks()[0].ComputeAABB()
+            def isobstaclefree(grasp):
+                T,positions = getpositions(grasp)
+                with robot:
+                    gmodel.setPreshape(grasp)
+                    Teeinv = linalg.inv(manip.GetEndEffectorTransform())
+                    corners = []
+                    for link in manip.GetChildLinks():
+                        if len(link.GetGeometries()) > 0:
+                            ab = link.ComputeAABB()
+                            corners += [ab.pos()+ab.extents()*array((i,j,k)) for i in [-1,1] for j in [-1,1] for k in [-1,1]]
+                    localcorners = transformPoints(Teeinv,corners)
+                lower,upper = numpy.min(localcorners,0),numpy.max(localcorners,0)
+                extents = dot(abs(T[0:3,0:3]),0.5*(upper-lower))
+                for p in positions:
+                    boxcenter = dot(T[0:3,0:3],0.5*(lower+upper))+p
+                    if all(abs(boxcenter-obstacleab.pos()) <= extents+obstacleab.extents()):
+                        return False
+                return True
+
+            expectedcounts = dict.fromkeys(gmodel.rejectionstages,0)
+            indices = range(N)
+            for stage,fn in [('workspace',inworkspace),('reachability',isreachable),('obstacles',isobstaclefree)]:
+                survivors = [i for i in indices if fn(grasps[i])]
+                expectedcounts[stage] = len(indices)-len(survivors)
+                indices = survivors
+            assert(len(indices) > 0 and all([expectedcounts[stage] > 0 for stage in ['workspace','reachability']]))
+
+            gmodel.rejectioncounts = dict.fromkeys(gmodel.rejectionstages,0)
+            prefiltered = gmodel.computeGraspPrefilter(None,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=rmodel,obstacles=[obstacle])
+            assert(list(prefiltered) == indices)
+            assert(gmodel.rejectioncounts == expectedcounts)
+            validgrasps,validindices = gmodel.computeValidGrasps(checkik=False,checkcollision=False,checkgrasper=False,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=rmodel,obstacles=[obstacle])
+            assert(list(validindices) == indices)
+            assert(gmodel.rejectioncounts == expectedcounts)
+            assert([i for grasp,i in gmodel.validGraspIterator(checkik=False,checkcollision=False,checkgrasper=False,backupdist=backupdist,workspacebounds=workspacebounds,workspaceplanes=workspaceplanes,reachabilitymodel=rmodel,obstacles=[obstacle])] == indices)
+
+    def test_parallelgraspvalidator(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot=robot,iktype=IkParameterization.Type.Transform6D)
+        if not ikmodel.load():
+            ikmodel.autogenerate()
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=env.GetKinBody('mug1'))
+        if not gmodel.load():
+            gmodel.numthreads = 2
+            gmodel.generate(approachrays=gmodel.computeBoxApproachRays(delta=0.04))
+            gmodel.save()
+        indices = range(min(len(gmodel.grasps),8))
+        validgrasps,validindices = gmodel.computeValidGrasps(indices=indices,backupdist=0.01)
+        rejectioncounts = dict(gmodel.rejectioncounts)
+        validator = databases.grasping.ParallelGraspValidator(gmodel,numprocesses=2)
+        try:
+            for ordered in [True,False]:
+                pvalidgrasps,pvalidindices = validator.computeValidGrasps(indices=indices,backupdist=0.01,ordered=ordered,chunksize=2)
+                if ordered:
+                    assert(list(pvalidindices) == list(validindices))
+                else:
+                    assert(sorted(pvalidindices) == sorted(validindices))
+                assert(transdist(array(pvalidgrasps)[argsort(pvalidindices)],array(validgrasps)[argsort(validindices)]) <= g_epsilon)
+                assert(gmodel.rejectioncounts == rejectioncounts)
+            if len(validindices) > 0:
+                # stopping early leaves the pool usable
+                pvalidgrasps,pvalidindices = validator.computeValidGrasps(indices=indices,backupdist=0.01,returnnum=1)
+                assert(len(pvalidindices) == 1 and pvalidindices[0] in validindices)
+                pvalidgrasps,pvalidindices = validator.computeValidGrasps(indices=indices,backupdist=0.01)
+                assert(list(pvalidindices) == list(validindices))
+        finally:
+            validator.close()
+
+    def test_approachrays(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        normals = r_[[[0,0,1],[0,0,-1],[1,0,0],[0,0,-2]],random.randn(20,3)]
+        approachrays = c_[random.rand(len(normals),3),normals]
+        for normalanglerange in [0,0.5,pi]:
+            # the per-ray loop ExpandApproachRays replaced
+            if normalanglerange > 0:
+                theta,pfi = misc.SpaceSamplerExtra().sampleS2(angledelta=0.4)
+                dirs = c_[cos(theta),sin(theta)*cos(pfi),sin(theta)*sin(pfi)]
+                dirs = array([dir for dir in dirs if arccos(dir[2])<=normalanglerange])
+                if len(dirs) == 0:
+                    dirs = array([[0,0,1]])
+                expandedrays = zeros((0,6))
+                for approachray in approachrays:
+                    R = rotationMatrixFromQuat(quatRotateDirection(array((0,0,1)),approachray[3:6]))
+                    expandedrays = r_[expandedrays,c_[tile(approachray[0:3],(len(dirs),1)),dot(dirs,transpose(R))]]
+            else:
+                expandedrays = approachrays
+            newrays = databases.grasping.GraspingModel.ExpandApproachRays(approachrays,normalanglerange,0.4)
+            assert(newrays.shape == expandedrays.shape)
+            assert(numpy.max(abs(newrays-expandedrays)) <= g_epsilon)
+            maxapproachrays = len(expandedrays)//3
+            newrays = databases.grasping.GraspingModel.ExpandApproachRays(approachrays,normalanglerange,0.4,maxapproachrays)
+            assert(len(newrays) == maxapproachrays)
+            keptrays = expandedrays[array(around(linspace(0,len(expandedrays)-1,maxapproachrays)),int)]
+            # the kept directions are always normalized
+            assert(numpy.max(abs(newrays[:,0:3]-keptrays[:,0:3])) <= g_epsilon)
+            assert(numpy.max(abs(newrays[:,3:6]-keptrays[:,3:6]/sqrt(sum(keptrays[:,3:6]**2,1))[:,newaxis])) <= g_epsilon)
+
+        # sample a box, every ray has to be on a face and point out of it
+        extents = array((0.05,0.03,0.1))
+        with env:
+            box = RaveCreateKinBody(env,'')
+            box.SetName('approachbox')
+            box.InitFromBoxes(array([r_[zeros(3),extents]]),True)
+            env.Add(box)
+            box.SetTransform(matrixFromAxisAngle(random.rand(3)))
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=box)
+        delta = 0.01
+        rays = gmodel.computeMeshApproachRays(delta=delta)
+        area = 8*(extents[0]*extents[1]+extents[1]*extents[2]+extents[0]*extents[2])
+        assert(abs(len(rays)-area/delta**2) <= 1)
+        faceaxes = argmax(abs(rays[:,0:3])/extents,1)
+        for i,ray in enumerate(rays):
+            axis = faceaxes[i]
+            assert(abs(abs(ray[axis])-extents[axis]) <= g_epsilon)
+            assert(all(abs(ray[0:3]) <= extents+g_epsilon))
+            normal = zeros(3)
+            normal[axis] = sign(ray[axis])
+            assert(transdist(ray[3:6],normal) <= g_epsilon)
+        rays = gmodel.computeMeshApproachRays(delta=delta,normalanglerange=0.5,maxapproachrays=100)
+        assert(len(rays) == 100)
+
+    def test_adaptivegrasping(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=env.GetKinBody('mug1'))
+        # a plane of approach rays, only the ones with x > 0.05 give good grasps
+        X,Y = meshgrid(linspace(-0.1,0.1,11),linspace(-0.1,0.1,11))
+        approachrays = c_[X.flatten(),Y.flatten(),zeros(X.size),tile((0,0,1.0),(X.size,1))]
+        rolls = arange(0,2*pi,pi/2)
+        preshape = robot.GetDOFValues(gmodel.manip.GetGripperIndices())
+        def evaluate(approachray,roll,preshape,standoff,manipulatordirection):
+            # same layout as the consumer of generatepcg
+            grasp = zeros(gmodel.totaldof)
+            grasp[gmodel.graspindices['igrasppos']] = approachray[0:3]
+            grasp[gmodel.graspindices['igraspdir']] = -approachray[3:6]
+            grasp[gmodel.graspindices['igrasproll']] = roll
+            grasp[gmodel.graspindices['performance']] = random.rand()
+            return grasp if approachray[0] > 0.05 else None
+        
+        targetgrasps = 8
+        producer,consumer,gatherer,numjobs = gmodel.generatepcg(approachrays=approachrays,rolls=rolls,preshapes=array([preshape]),standoffs=array([0]),adaptive=True,targetgrasps=targetgrasps,coarsefraction=0.1,refineradius=0.025,refineangle=0.1)
+        works = []
+        for work in producer():
+            grasp = evaluate(*work)
+            if grasp is not None:
+                gatherer(grasp)
+            works.append((work[0],grasp is not None))
+        gatherer()
+        assert(len(gmodel.grasps) == targetgrasps)
+        assert(len(works) < numjobs)
+        # once a good grasp is found, its neighborhood is refined before exploring further
+        ifirstgood = [i for i,(approachray,good) in enumerate(works) if good][0]
+        for approachray,good in works[ifirstgood+1:]:
+            assert(approachray[0] > 0.05-0.025-g_epsilon)
+        # no (ray,roll) pair is evaluated twice
+        evaluated = set([tuple(approachray) for approachray,good in works])
+        assert(len(works) <= len(evaluated)*len(rolls))
+
+        timebudget = 0.3
+        producer,consumer,gatherer,numjobs = gmodel.generatepcg(approachrays=approachrays,rolls=rolls,preshapes=array([preshape]),standoffs=array([0]),adaptive=True,timebudget=timebudget)
+        starttime = time.time()
+        numworks = 0
+        for work in producer():
+            time.sleep(0.05)
+            numworks += 1
+        gatherer()
+        assert(numworks < numjobs)
+        assert(time.time()-starttime < timebudget+0.2)
+
+    def test_graspquality(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        target=env.GetKinBody('mug1')
+        gmodel = databases.grasping.GraspingModel(robot=robot,target=target)
+        gmodel.init(friction=0.4,avoidlinks=[])
+        center = target.ComputeAABB().pos()
+        contacts = c_[random.rand(10,3)*0.1+center,random.randn(10,3)]
+        assert(gmodel.computeGraspQuality(contacts,graspquality='centroid') == -min([sum((contact[0:3]-center)**2) for contact in contacts]))
+        assert(gmodel.computeGraspQuality(contacts,0.1,0.2,graspquality='epsilon') == -0.1)
+        assert(gmodel.computeGraspQuality(contacts,0.1,0.2,graspquality='volume') == -0.2)
+        meannormal = mean([contact[3:6]/linalg.norm(contact[3:6]) for contact in contacts],0)
+        assert(abs(gmodel.computeGraspQuality(contacts,graspquality='normalspread')-linalg.norm(meannormal)) <= g_epsilon)
+        assert(gmodel.computeGraspQuality(r_[contacts[0:1],c_[contacts[0:1,0:3],-contacts[0:1,3:6]]],graspquality='normalspread') <= g_epsilon)
+        assert(gmodel.computeGraspQuality(zeros((0,6)),graspquality='centroid') == -inf)
+        assert(gmodel.computeGraspQuality(zeros((0,6)),graspquality='normalspread') == inf)
+        assert(gmodel.computeGraspQuality(contacts.flatten(),graspquality=lambda contacts,center,mindist,volume: len(contacts)) == 10)
+        
+        # the centroid metric on the contacts of the simulated grasp is the same as simulating the grasp again
+        approachrays = gmodel.computeBoxApproachRays(delta=0.02)
+        preshape = robot.GetDOFValues(gmodel.manip.GetGripperIndices())
+        numtested = 0
+        for approachray in approachrays[::max(1,len(approachrays)//10)]:
+            grasp = zeros(gmodel.totaldof)
+            grasp[gmodel.graspindices['igrasppos']] = approachray[0:3]
+            grasp[gmodel.graspindices['igraspdir']] = -approachray[3:6]
+            grasp[gmodel.graspindices['igrasppreshape']] = preshape
+            grasp[gmodel.graspindices['imanipulatordirection']] = gmodel.manip.GetDirection()
+            with target:
+                target.SetTransform(eye(4))
+                try:
+                    with robot:
+                        contacts,finalconfig,mindist,volume = gmodel.runGrasp(grasp=grasp,translate=True,forceclosure=False)
+                except planning_error:
+                    continue
+                quality = gmodel.computeGraspQuality(contacts,mindist,volume,graspquality='centroid')
+            with robot:
+                performance = gmodel._ComputeGraspPerformance(grasp)
+            assert(quality == performance or abs(quality-performance) <= g_epsilon)
+            numtested += 1
+        assert(numtested > 0)
+
+    def test_kerneldensity(self):
+        points = random.rand(200,3)
+        weights = random.rand(200)
+        ibandwidth = -0.5/array([0.1,0.2,0.2])**2
+        p = random.rand(50,3)
+        neighs = -ones((len(p),20),int)
+        for i in range(len(p)):
+            numneighs = random.randint(0,21)
+            neighs[i,:numneighs] = random.permutation(len(points))[:numneighs]
+        probs = databases.inversereachability.InverseReachabilityModel.EvaluateKernelDensity(p,neighs,points,weights,ibandwidth,chunksize=16)
+        for i in range(len(p)):
+            inds = neighs[i,neighs[i,:]>=0]
+            prob = 0
+            if len(inds) > 0:
+                prob = dot(weights[inds],numpy.exp(dot((points[inds,:]-tile(p[i,:],(len(inds),1)))**2,ibandwidth)))
+            assert(abs(probs[i]-prob) <= g_epsilon)
+
+    def test_griddensity(self):
+        # linear interpolation of a linear density is exact
+        coeffs = array([0.3,-1.0,2.0])
+        def densityfn(poses):
+            qposes,angles = normalizeZRotation(poses[:,0:4])
+            return 5.0+dot(c_[angles,poses[:,4:6]],coeffs)
+        bounds = array([[-1.0,-0.5,-0.5],[1.0,0.5,0.5]])
+        griddensity = databases.inversereachability.InverseReachabilityModel.ComputeGridDensity(densityfn,bounds,array([0.1,0.05,0.05]))
+        samples = random.rand(100,3)*(bounds[1]-bounds[0])+bounds[0]
+        poses = c_[cos(samples[:,0]*0.5),zeros((len(samples),2)),sin(samples[:,0]*0.5),samples[:,1:3],zeros((len(samples),1))]
+        assert(numpy.max(abs(griddensity(poses)-densityfn(poses))) <= 1e-6)
+        poses[:,4] += 2.0
+        assert(all(griddensity(poses) == 0))
+
+    def test_basedistributioncache(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        irmodel = databases.inversereachability.InverseReachabilityModel(robot)
+        assert(irmodel.basecache is not None)
+        # (angle,x,y,weight) samples of every class
+        irmodel.equivalenceclasses = [(None,None,c_[random.rand(N,3)-0.5,random.rand(N)+0.1]) for N in [100,200,300]]
+        cache = irmodel.basecache
+        cache.maxpoints = 500
+        anglebucket = cache.anglebucket
+        for classindex,angle in [(0,0.3),(1,-1.2),(0,0.3+0.1*anglebucket),(2,2.0)]:
+            irmodel.basecache = None
+            points,cumweights,entry = irmodel._getEquivalenceClassPoints(classindex,angle)
+            assert(entry is None)
+            irmodel.basecache = cache
+            cachedpoints,cachedcumweights,entry = irmodel._getEquivalenceClassPoints(classindex,angle)
+            assert(abs(entry['angle']-angle) <= 0.5*anglebucket+g_epsilon)
+            assert(transdist(cachedpoints[:,0],points[:,0]) <= g_epsilon)
+            # the xy offsets are rotated by the bucket angle
+            assert(numpy.max(abs(cachedpoints[:,1:3]-points[:,1:3])) <= anglebucket)
+            assert(transdist(cachedcumweights,cumweights) <= g_epsilon)
+        assert(cache.hits == 1 and cache.misses == 3)
+        # the least recently used class 1 entry was evicted to keep at most 500 points
+        assert(len(cache) == 2 and cache.numpoints == 400)
+        entry = cache.get(irmodel.equivalenceclasses,0,0.0)
+        assert(len(cache) == 3 and cache.numpoints == 500)
+        kdtree,kdtreepoints = cache.getKDTree(entry,0.2)
+        assert(transdist(kdtreepoints[:,0],0.2*entry['points'][:,0]) <= g_epsilon)
+        assert(cache.getKDTree(entry,0.2)[0] is kdtree)
+        # the kdtree counts twice its points, so all the older entries are evicted
+        assert(len(cache) == 1 and cache.numpoints == 300)
+        cache.clear()
+        assert(len(cache) == 0 and cache.numpoints == 0)
+
+    def test_quaternionmean(self):
+        from scipy.optimize import leastsq
+        qmean = quatFromAxisAngle(random.rand(3)-0.5)
+        qarray = array([quatMult(qmean,quatFromAxisAngle((random.rand(3)-0.5)*0.2)) for i in range(100)])
+        qarray[qarray[:,0]<0] *= -1 # all on the same hemisphere
+        def rmsangle(q):
+            return sqrt(mean(quatArrayTDist(q,qarray)**2))
+        # the mean computed before the closed-form one
+        qleastsq,success = leastsq(lambda q: quatArrayTDist(q/sqrt(sum(q**2)),qarray), qarray[0],maxfev=10000)
+        qleastsq /= sqrt(sum(qleastsq**2))
+        q = databases.inversereachability.InverseReachabilityModel.ComputeQuaternionMean(qarray)
+        assert(abs(sum(q**2)-1) <= g_epsilon)
+        assert(quatArrayTDist(q,array([qmean]))[0] <= 0.02)
+        assert(rmsangle(q) <= rmsangle(qleastsq)+1e-3)
+        # refining never increases the error
+        qrefined = databases.inversereachability.InverseReachabilityModel.ComputeQuaternionMean(qarray,refinethresh=0)
+        assert(abs(sum(qrefined**2)-1) <= g_epsilon)
+        assert(rmsangle(qrefined) <= rmsangle(q)+1e-6)
+
+    def test_samplebasedistribution(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        irmodel = databases.inversereachability.InverseReachabilityModel(robot)
+        irmodel.quatdelta = 0.05
+        irmodel.xyzdelta = 0.02
+        # one equivalence class whose samples all place the base at angle 0.4 and 0.5m behind the grasp
+        classangle = 0.4
+        irmodel.equivalenceclasses = [(array([1.0,0,0,0,0.3]),array([0.1,0.05]),tile([classangle,-0.5,0.0,1.0],(50,1)))]
+        irmodel.preprocess()
+        with env:
+            robot.SetTransform(eye(4))
+            Tgrasp = dot(irmodel.manip.GetBase().GetTransform(),matrixFromPose([1,0,0,0,0.5,0,0.3]))
+            N = 2000
+            for Nprematuresamples in [0,N]:
+                iterator = irmodel.sampleBaseDistributionIterator([(Tgrasp,0)],logllthresh=-inf,Nprematuresamples=Nprematuresamples)
+                poses = array([iterator.next()[0] for i in range(N)])
+                angles = 2*arctan2(poses[:,3],poses[:,0])
+                angles -= 2*pi*round((angles-classangle)/(2*pi))
+                # the angles are distributed with the kernel bandwidth around the class angle in both modes
+                assert(abs(mean(angles)-classangle) <= 4*irmodel.quatdelta/sqrt(N))
+                assert(abs(std(angles)-irmodel.quatdelta) <= 0.2*irmodel.quatdelta)
+
+    def test_appendonlyarray(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            rows = random.rand(100,8)
+            stats = databases.kinematicreachability.ReachabilityModel.AppendOnlyArray(os.path.join(tempdir,'stats.bin'),8,buffersize=7)
+            offset = 0
+            for numrows in [3,10,0,1,26]:
+                stats.append(rows[offset:(offset+numrows)])
+                offset += numrows
+            assert(len(stats) == offset)
+            numflushed = stats.flush()
+            assert(numflushed == offset)
+            stats.append(rows[offset:offset+20].flatten())
+            # resume from the flushed rows, the rows appended afterwards are lost
+            stats.truncate(numflushed)
+            stats.append(rows[numflushed:])
+            allrows = stats.getArray()
+            assert(allrows.shape == rows.shape and all(allrows == rows))
+            del allrows
+            stats.remove()
+            assert(not os.path.exists(stats.filename))
+        finally:
+            shutil.rmtree(tempdir)
+
 #     def test_database_paths(self):
 #         pass
@@ -240,6 +240,14 @@ class TestTrajectory(EnvironmentSetup):
                 data2 = traj2.Sample(t)
                 assert( transdist(data1,data2) <= g_epsilon)
 
+            times = arange(0,traj.GetDuration(),stepsize*0.5)
+            alldata = traj.SampleRange(times)
+            assert(alldata.shape == (len(times),spec.GetDOF()))
+            for i,t in enumerate(times):
+                assert( transdist(alldata[i],traj.Sample(t)) <= g_epsilon)
+            alldata = traj.SampleRange(times,robot.GetActiveConfigurationSpecification())
+            assert( transdist(alldata[-1],traj.Sample(times[-1],robot.GetActiveConfigurationSpecification())) <= g_epsilon)
+
     def test_simpleretiming(self):
         env=self.env
         env.Load('robots/barrettwam.robot.xml')